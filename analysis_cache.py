@@ -0,0 +1,92 @@
+"""
+Persistent analysis result cache (content-addressed).
+
+key = ANALYZER_VERSION + ชนิดการวิเคราะห์ + sha256 ของ byte ช่วงที่ถูกวิเคราะห์ (segment ที่ carve / ทั้ง image)
+value = findings (list ของข้อความ) เก็บเป็น JSON ใน SQLite
+
+image / segment เดิมที่ถูกเปิดซ้ำจะได้ผลทันทีโดยไม่ต้องวิเคราะห์ใหม่ ไม่ว่าไฟล์จะอยู่ที่ path ไหน
+ขนาดรวมถูกจำกัดด้วย max_bytes (ai.cache_max_mb ใน config.yaml) → ลบ entry ที่ใช้ล่าสุดนานที่สุดออกก่อน (LRU)
+
+ใช้ร่วมกับ fw_analysis.analyze_firmware_detailed(cache=...) / analyze_segments(cache_path=...)
+"""
+
+import os, json, mmap, time, sqlite3, hashlib
+
+from hashing import file_digest
+
+def region_digest(src, offset=0, length=None):
+    """sha256 of [offset, offset+length) of a file path or open buffer (mmap / bytes), no copy."""
+    if isinstance(src, (str, os.PathLike)):
+        if offset == 0 and length is None:
+            return file_digest(src)     # whole file: shared memo with the rest of the session
+        if os.path.getsize(src) == 0:
+            return hashlib.sha256().hexdigest()
+        with open(src, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return region_digest(mm, offset, length)
+    end = len(src) if length is None else min(len(src), offset + length)
+    h = hashlib.sha256()
+    with memoryview(src) as view:
+        # hashlib releases the GIL for large updates; chunking keeps the slices bounded
+        for pos in range(offset, end, 16 * 1048576):
+            h.update(view[pos:min(end, pos + 16 * 1048576)])
+    return h.hexdigest()
+
+class AnalysisCache:
+    def __init__(self, db_path, max_bytes=64 * 1048576):
+        d = os.path.dirname(db_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results(
+                key TEXT PRIMARY KEY, findings TEXT, size INTEGER, last_used REAL);
+            CREATE INDEX IF NOT EXISTS results_lru ON results(last_used);
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    @staticmethod
+    def key(version, kind, digest):
+        return f"{version}:{kind}:{digest}"
+
+    def get(self, key):
+        row = self.conn.execute("SELECT findings FROM results WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE results SET last_used=? WHERE key=?", (time.time(), key))
+        self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, findings):
+        data = json.dumps(findings, ensure_ascii=False)
+        self.conn.execute("INSERT OR REPLACE INTO results VALUES (?,?,?,?)",
+                          (key, data, len(data.encode("utf-8")), time.time()))
+        self._evict()
+        self.conn.commit()
+
+    def total_bytes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def _evict(self):
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        drop = []
+        for key, size in self.conn.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            drop.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM results WHERE key=?", drop)
@@ -1,139 +1,76 @@
 # Firmware Workbench (Extended + Per-Segment Patching + Diff Viewer + Multi-Segment AI)
-import sys, os, subprocess, threading, hashlib, shutil, tempfile, random, datetime, yaml, difflib
+import sys, os, threading, shutil, datetime, yaml, difflib, sqlite3, itertools
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton,
     QTextEdit, QFileDialog, QLabel, QHBoxLayout, QMessageBox,
     QTabWidget, QLineEdit, QCheckBox, QGroupBox, QFormLayout, QListWidget,
-    QListWidgetItem, QComboBox, QSplitter, QSizePolicy
+    QListWidgetItem, QComboBox, QSplitter, QSizePolicy, QPlainTextEdit, QListView
 )
-from PySide6.QtCore import Qt, Signal, QObject, QTimer, QThread
+from PySide6.QtCore import Qt, Signal, QObject, QTimer, QThread, QAbstractListModel, QModelIndex
 from passlib.hash import sha512_crypt
 
 from fmk_integration import (
     locate_fmk, extract_firmware, build_firmware, extract_multisquash,
     build_multisquash, install_ipk, remove_ipk, postprocess_linksys_footer,
     detect_linksys_candidate, compute_original_rootfs_span,
-    estimate_squashfs_size, FMKError
+    estimate_squashfs_size, estimate_squashfs_breakdown, sample_squashfs_size, FMKError
 )
+from rebuild_squashfs import SquashFSError
 from patch_utils import (
-    patch_root_password, patch_services, PatchError
+    compile_ops, apply_ops, service_ops, PatchError
+)
+from patch_plan import load_plan, find_targets, apply_plan
+from size_fit import find_fit, build_overrides, level_name
+from fs_utils import clone_tree
+from object_store import ObjectStore
+from catalog import Catalog
+from search_index import SearchIndex
+from entropy_profile import entropy_profile
+from fw_analysis import analyze_firmware_detailed, boot_delay_findings, analyze_segments
+from analysis_cache import AnalysisCache
+import hashing
+import fs_index
+import tracing
+from hashing import file_digest, file_digests
+from fw_scan import scan_layout, format_layout
+from log_pipeline import LogBuffer, LEVELS, LEVEL_NAMES
+from rootfs_manifest import (
+    manifest_path, load_manifest, update_manifest, snapshot_manifests, diff_manifests, iter_changes
 )
 
 # ---------------- Utility ----------------
 def sha256sum(path):
-    h=hashlib.sha256()
-    with open(path,"rb") as f:
-        for b in iter(lambda: f.read(1048576), b''):
-            h.update(b)
-    return h.hexdigest()
+    return file_digest(path,"sha256")
 
 def md5sum(path):
-    h=hashlib.md5()
-    with open(path,"rb") as f:
-        for b in iter(lambda: f.read(1048576), b''):
-            h.update(b)
-    return h.hexdigest()
-
-def get_entropy(path, sample_size=65536, samples=4):
-    import math
-    size = os.path.getsize(path)
-    ent=[]
-    with open(path,"rb") as f:
-        for _ in range(samples):
-            if size>sample_size:
-                f.seek(random.randint(0,size-sample_size))
-            else:
-                f.seek(0)
-            data=f.read(sample_size)
-            if not data: break
-            freq=[0]*256
-            for b in data: freq[b]+=1
-            e=-sum((c/len(data))*math.log2(c/len(data)) for c in freq if c)
-            ent.append(e)
-    if not ent: return "-"
-    return f"min={min(ent):.3f}, max={max(ent):.3f}, avg={sum(ent)/len(ent):.3f}"
-
-# ---------------- Firmware Analysis ----------------
-def analyze_firmware_detailed(fw_path, rootfs_offset, rootfs_size, log_func):
-    findings = []
-    try:
-        log_func(">> วิเคราะห์ boot delay ...")
-        with open(fw_path, "rb") as f:
-            f.seek(0x100)
-            bootdelay_byte = f.read(1)
-            if bootdelay_byte:
-                bootdelay = bootdelay_byte[0]
-                if bootdelay == 0:
-                    findings.append("Boot delay = 0 วินาที (ไม่มี delay)")
-                elif bootdelay > 9:
-                    findings.append(f"Boot delay {bootdelay} วินาที (ยาวผิดปกติ)")
-                else:
-                    findings.append(f"Boot delay = {bootdelay} วินาที")
-    except Exception as e:
-        findings.append(f"อ่าน boot delay ผิดพลาด: {e}")
+    return file_digest(path,"md5")
 
-    tmpdir = tempfile.mkdtemp(prefix="fw-rootfs-")
-    try:
-        rootfs_bin = os.path.join(tmpdir, "rootfs.bin")
-        with open(fw_path, "rb") as f:
-            f.seek(rootfs_offset)
-            chunk = f.read(rootfs_size)
-            with open(rootfs_bin, "wb") as o:
-                o.write(chunk)
-        unsquash_dir = os.path.join(tmpdir, "unsquash")
-        os.makedirs(unsquash_dir)
-        try:
-            subprocess.check_output(
-                ["unsquashfs", "-d", unsquash_dir, rootfs_bin],
-                stderr=subprocess.STDOUT, timeout=45
-            )
-            # inittab
-            inittab = os.path.join(unsquash_dir,"etc","inittab")
-            if os.path.isfile(inittab):
-                with open(inittab,"r",encoding="utf-8",errors="ignore") as f:
-                    txt=f.read()
-                if "getty" in txt and "ttyS" in txt:
-                    findings.append("serial shell (getty) อาจเปิดใช้งาน")
-                else:
-                    findings.append("ไม่พบ getty serial shell")
-            # inetd services
-            inetd = os.path.join(unsquash_dir,"etc","inetd.conf")
-            if os.path.isfile(inetd):
-                data=open(inetd,"r",encoding="utf-8",errors="ignore").read()
-                findings.append("Telnet enabled" if "telnet" in data else "Telnet disabled")
-                findings.append("FTP enabled" if "ftp" in data else "FTP disabled")
-            # users
-            passwd = os.path.join(unsquash_dir,"etc","passwd")
-            if os.path.isfile(passwd):
-                users=[line.split(":")[0] for line in open(passwd,"r",encoding="utf-8",errors="ignore") if ":" in line]
-                findings.append("Users: " + ", ".join(users))
-            shadow = os.path.join(unsquash_dir,"etc","shadow")
-            if os.path.isfile(shadow):
-                for line in open(shadow,"r",encoding="utf-8",errors="ignore"):
-                    if line.startswith("root:"):
-                        parts=line.split(":")
-                        if parts[1] in ("!","*",""):
-                            findings.append("root ไม่มีรหัส / ถูกล็อค")
-                        else:
-                            findings.append("root มี hash password")
-        except Exception as e:
-            findings.append(f"แตก rootfs ไม่สำเร็จ: {e}")
-    finally:
-        shutil.rmtree(tmpdir, ignore_errors=True)
-    findings.append(f"Entropy firmware: {get_entropy(fw_path)}")
-    return findings
+def checksums(path):
+    # sha256 + md5 ในการอ่านไฟล์ครั้งเดียว (memo ต่อ inode ทั้ง session)
+    return file_digests(path,("sha256","md5"))
+
+def get_entropy(path, window=65536):
+    prof=entropy_profile(path, window)
+    if not len(prof["entropy"]): return "-"
+    return f"min={prof['min']:.3f}, max={prof['max']:.3f}, avg={prof['avg']:.3f}"
 
 # ---------------- AI Workers ----------------
 class AIWorker(QObject):
     finished = Signal(list)
     error = Signal(str)
     log = Signal(str)
-    def __init__(self, fw_path, offset, size):
+    def __init__(self, fw_path, offset, size, cache_path=None, cache_max_bytes=None):
         super().__init__()
         self.fw_path=fw_path; self.offset=offset; self.size=size
+        self.cache_path=cache_path; self.cache_max_bytes=cache_max_bytes
     def run(self):
         try:
-            res = analyze_firmware_detailed(self.fw_path,self.offset,self.size,self.log.emit)
+            if self.cache_path:
+                # sqlite connection must be created in this (worker) thread
+                with AnalysisCache(self.cache_path, self.cache_max_bytes) as cache:
+                    res = analyze_firmware_detailed(self.fw_path,self.offset,self.size,self.log.emit,cache=cache)
+            else:
+                res = analyze_firmware_detailed(self.fw_path,self.offset,self.size,self.log.emit)
             self.finished.emit(res)
         except Exception as e:
             import traceback
@@ -144,17 +81,19 @@ class MultiSegmentAIWorker(QObject):
     segment_done = Signal(str, list)
     all_done = Signal(dict)
     error = Signal(str)
-    def __init__(self, fw_path, segments_meta):
+    def __init__(self, fw_path, segments_meta, workers=None, cache_path=None, cache_max_bytes=None):
         super().__init__()
         self.fw_path=fw_path
         # segments_meta: list of (segment_name, meta)
         self.segments_meta = segments_meta
+        self.workers=workers
+        self.cache_path=cache_path; self.cache_max_bytes=cache_max_bytes
         self.stop_flag=False
     def run(self):
         results={}
         try:
+            jobs=[]
             for name, meta in self.segments_meta:
-                if self.stop_flag: break
                 fs_offset=meta.get("FS_OFFSET")
                 footer_off=meta.get("FOOTER_OFFSET", meta.get("FW_SIZE",0))
                 rootfs_size = footer_off - fs_offset - meta.get("FOOTER_SIZE",0) if fs_offset else 0
@@ -163,26 +102,47 @@ class MultiSegmentAIWorker(QObject):
                     self.segment_done.emit(name, ["Cannot compute rootfs"])
                     continue
                 self.progress.emit(f"[AI ALL] วิเคราะห์ {name} offset=0x{fs_offset:X} size={rootfs_size}")
-                res = analyze_firmware_detailed(self.fw_path, fs_offset, rootfs_size, self.progress.emit)
-                results[name]=res
-                self.segment_done.emit(name,res)
+                jobs.append((name, fs_offset, rootfs_size))
+            boot=boot_delay_findings(self.fw_path, self.progress.emit)
+            # segments run in parallel worker processes; results arrive in completion order
+            for name, res in analyze_segments(self.fw_path, jobs, self.workers, self.progress.emit,
+                                              should_stop=lambda: self.stop_flag,
+                                              cache_path=self.cache_path, cache_max_bytes=self.cache_max_bytes):
+                results[name]=boot+res
+                self.segment_done.emit(name,results[name])
+            if self.stop_flag:
+                self.progress.emit(f"[AI ALL] ยกเลิก (เสร็จ {len(results)}/{len(jobs)} segment)")
             self.all_done.emit(results)
         except Exception as e:
             import traceback
             self.error.emit(traceback.format_exc())
 
 # ---------------- Diff Utilities ----------------
-def snapshot_rootfs(rootfs_dir):
+@tracing.traced("diff")
+def snapshot_rootfs(rootfs_dir, log=None):
     """
     Create snapshot directory rootfs_original beside rootfs if not exists.
-    Potentially large (duplicates data). For production you may want rsync + hardlinks or hashing.
+    Files are reflinked (CoW) where the filesystem supports it, otherwise hardlinked,
+    so the snapshot costs O(inodes) instead of O(bytes). With hardlinks both trees share
+    inodes: writers must break the link first (patch_utils does via _safe_backup).
+    Manifests (stat + sha256) of both trees are written once here for summarize_changes;
+    device nodes / fifos that could not be recreated exist only in the manifest (reported via log).
     """
     orig = os.path.join(os.path.dirname(rootfs_dir), "rootfs_original")
     if not os.path.exists(orig):
-        shutil.copytree(rootfs_dir, orig, symlinks=True)
+        skipped = []
+        clone_tree(rootfs_dir, orig, skipped=skipped)
+        snapshot_manifests(rootfs_dir, orig)
+        if skipped and log:
+            shown = ", ".join(skipped[:5]) + (" ..." if len(skipped) > 5 else "")
+            log(f"[SNAPSHOT] ไม่มีสิทธิ์ mknod: device/fifo {len(skipped)} รายการไม่ถูกสร้างใน rootfs_original "
+                f"(บันทึกไว้ใน manifest แทน): {shown}")
     return orig
 
 def list_all_files(root_dir):
+    idx=fs_index.get_index(root_dir)
+    if idx is not None:
+        return idx.files()
     out=[]
     for root,dirs,files in os.walk(root_dir):
         for f in files:
@@ -191,54 +151,245 @@ def list_all_files(root_dir):
             out.append(rel)
     return set(out)
 
-def read_text_safely(path, max_bytes=512*1024):
+def text_error(path, sniff_bytes=65536):
+    """None when the file looks like UTF-8 text, otherwise the reason (checked on the head only)."""
     try:
-        if os.path.getsize(path) > max_bytes:
-            return None, "File too large for diff view"
         with open(path,"rb") as f:
-            data=f.read()
-        try:
-            return data.decode("utf-8"), None
-        except UnicodeDecodeError:
-            return None, "Binary / non-UTF8"
+            head=f.read(sniff_bytes)
     except Exception as e:
-        return None, f"Read error: {e}"
+        return f"Read error: {e}"
+    if b"\0" in head:
+        return "Binary / non-UTF8"
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # a multi-byte character cut at the end of the sample is still text
+        if e.start < len(head)-3:
+            return "Binary / non-UTF8"
+    return None
+
+def iter_text_lines(path):
+    with open(path,"r",encoding="utf-8",errors="replace",newline=None) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+DIFF_WINDOW_LINES=4000     # lines of each file held and matched at a time
+DIFF_MAX_WINDOW_LINES=65536 # a window with no common run is grown up to this before it is cut anyway
+DIFF_CONTEXT=3
+
+def _unified_range(start, stop):
+    length=stop-start
+    if length==1:
+        return str(start+1)
+    return f"{start+1 if length else start},{length}"
+
+def _unified_hunks(a, b, a0, b0, n=DIFF_CONTEXT):
+    """Hunks of a vs b; a0 / b0 = line number of a[0] / b[0] in the whole file."""
+    for group in difflib.SequenceMatcher(None,a,b).get_grouped_opcodes(n):
+        first,last=group[0],group[-1]
+        yield f"@@ -{_unified_range(a0+first[1],a0+last[2])} +{_unified_range(b0+first[3],b0+last[4])} @@"
+        for tag,i1,i2,j1,j2 in group:
+            if tag=="equal":
+                for line in a[i1:i2]: yield " "+line
+                continue
+            if tag in ("replace","delete"):
+                for line in a[i1:i2]: yield "-"+line
+            if tag in ("replace","insert"):
+                for line in b[j1:j2]: yield "+"+line
+
+def _window_cut(a, b, n=DIFF_CONTEXT):
+    """
+    Where to end this window: n lines before the end of the last equal run that can hold
+    both a hunk's trailing context and the next one's leading context (n lines are carried over).
+    None when there is no such run.
+    """
+    for tag,i1,i2,j1,j2 in reversed(difflib.SequenceMatcher(None,a,b).get_opcodes()):
+        if tag=="equal" and i2-i1>=2*n:
+            return i2-n, j2-n
+    return None
 
-def compute_diff(rootfs_original, rootfs_current, rel_path):
+def iter_diff(rootfs_original, rootfs_current, rel_path, should_stop=None):
+    """
+    Unified diff lines, produced lazily (added / removed files are streamed from disk, no size limit).
+    Modified files are matched DIFF_WINDOW_LINES at a time (a window that is changed throughout grows
+    up to DIFF_MAX_WINDOW_LINES), so memory and the time to the first hunk stay bounded and
+    should_stop() is checked between windows. A block moved further than one window shows as
+    delete + insert instead of a move.
+    """
     a_path=os.path.join(rootfs_original, rel_path)
     b_path=os.path.join(rootfs_current, rel_path)
-    a_text,a_err=read_text_safely(a_path) if os.path.exists(a_path) else ("","(new file)")
-    b_text,b_err=read_text_safely(b_path) if os.path.exists(b_path) else ("","(removed)")
-    if a_err and not os.path.exists(b_path):
-        return [f"(removed, cannot read original: {a_err})"]
-    if b_err and not os.path.exists(a_path):
-        return [f"(new file, cannot read new: {b_err})"]
-    if a_text is None or b_text is None:
-        return [f"Binary/Unsupported diff: orig_err={a_err} new_err={b_err}"]
-    diff=list(difflib.unified_diff(
-        a_text.splitlines(), b_text.splitlines(),
-        fromfile="orig/"+rel_path, tofile="new/"+rel_path, lineterm=""
-    ))
-    if not diff:
-        return ["(no textual differences)"]
-    return diff
+    a_exists=os.path.lexists(a_path); b_exists=os.path.lexists(b_path)
+    a_err=text_error(a_path) if a_exists else None
+    b_err=text_error(b_path) if b_exists else None
+    if not b_exists:
+        if a_err:
+            yield f"(removed, cannot read original: {a_err})"; return
+        yield "--- orig/"+rel_path; yield "+++ /dev/null"
+        for line in iter_text_lines(a_path):
+            yield "-"+line
+        return
+    if not a_exists:
+        if b_err:
+            yield f"(new file, cannot read new: {b_err})"; return
+        yield "--- /dev/null"; yield "+++ new/"+rel_path
+        for line in iter_text_lines(b_path):
+            yield "+"+line
+        return
+    if a_err or b_err:
+        yield f"Binary/Unsupported diff: orig_err={a_err} new_err={b_err}"; return
+    a_lines=iter_text_lines(a_path); b_lines=iter_text_lines(b_path)
+    try:
+        a=[]; b=[]; a0=b0=0; limit=DIFF_WINDOW_LINES
+        a_eof=b_eof=False; empty=True
+        while True:
+            if should_stop and should_stop():
+                return
+            if not a_eof:
+                want=max(0,limit-len(a))
+                got=list(itertools.islice(a_lines,want)); a+=got; a_eof=len(got)<want
+            if not b_eof:
+                want=max(0,limit-len(b))
+                got=list(itertools.islice(b_lines,want)); b+=got; b_eof=len(got)<want
+            done=a_eof and b_eof
+            cut=None if done else _window_cut(a,b)
+            if cut is None and not done and limit<DIFF_MAX_WINDOW_LINES:
+                limit*=2            # the hunk would end without trailing context: read further
+                continue
+            i,j=cut or (len(a),len(b))
+            for line in _unified_hunks(a[:i],b[:j],a0,b0):
+                if empty:
+                    yield "--- orig/"+rel_path; yield "+++ new/"+rel_path
+                    empty=False
+                yield line
+            if done:
+                break
+            a=a[i:]; b=b[j:]; a0+=i; b0+=j; limit=DIFF_WINDOW_LINES
+        if empty:
+            yield "(no textual differences)"
+    finally:
+        a_lines.close(); b_lines.close()
+
+def compute_diff(rootfs_original, rootfs_current, rel_path):
+    return list(iter_diff(rootfs_original, rootfs_current, rel_path))
 
 def summarize_changes(rootfs_original, rootfs_current):
-    orig_files=list_all_files(rootfs_original) if os.path.exists(rootfs_original) else set()
-    cur_files=list_all_files(rootfs_current)
-    added=cur_files - orig_files
-    removed=orig_files - cur_files
-    common=orig_files & cur_files
-    modified=[]
-    for rel in common:
-        a=os.path.join(rootfs_original, rel)
-        b=os.path.join(rootfs_current, rel)
+    """
+    Diff via manifests: rootfs_original's manifest is written at snapshot time; the
+    current tree is re-stat'ed and only files whose (size, mode, mtime_ns, inode)
+    changed since the last call are re-hashed.
+    """
+    orig={}
+    if os.path.exists(rootfs_original):
+        orig=load_manifest(manifest_path(rootfs_original))
+        if orig is None:
+            orig=update_manifest(rootfs_original)
+    cur=update_manifest(rootfs_current)
+    return diff_manifests(orig, cur)
+
+# ---------------- Diff Model / Workers ----------------
+CHANGE_TAGS={"added":"[A]","removed":"[R]","modified":"[M]"}
+CHANGE_ORDER={"added":0,"removed":1,"modified":2}
+DIFF_PAGE_LINES=2000
+
+class ChangeListModel(QAbstractListModel):
+    """(kind, rel) rows; appended in batches while the scan runs, sorted once it finishes."""
+    def __init__(self):
+        super().__init__()
+        self.rows=[]
+    def rowCount(self,parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    def data(self,index,role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        kind,rel=self.rows[index.row()]
+        if role==Qt.DisplayRole:
+            return f"{CHANGE_TAGS[kind]} {rel}"
+        if role==Qt.UserRole:
+            return (kind,rel)
+        return None
+    def clear(self):
+        self.beginResetModel(); self.rows=[]; self.endResetModel()
+    def append_rows(self,items):
+        if not items:
+            return
+        n=len(self.rows)
+        self.beginInsertRows(QModelIndex(),n,n+len(items)-1)
+        self.rows.extend(items)
+        self.endInsertRows()
+    def sort_rows(self):
+        self.layoutAboutToBeChanged.emit()
+        old=self.persistentIndexList()
+        keep=[self.rows[i.row()] for i in old]
+        self.rows.sort(key=lambda r:(CHANGE_ORDER[r[0]],r[1]))
+        pos={r:i for i,r in enumerate(self.rows)}
+        self.changePersistentIndexList(old,[self.index(pos[r]) for r in keep])
+        self.layoutChanged.emit()
+    def counts(self):
+        out={k:0 for k in CHANGE_TAGS}
+        for kind,_ in self.rows:
+            out[kind]+=1
+        return out
+
+class DiffScanWorker(QObject):
+    found = Signal(list)
+    finished = Signal(bool)     # False = cancelled
+    error = Signal(str)
+    def __init__(self, orig, cur):
+        super().__init__()
+        self.orig=orig; self.cur=cur; self.stop_flag=False
+    def run(self):
         try:
-            if os.path.getsize(a)!=os.path.getsize(b) or sha256sum(a)!=sha256sum(b):
-                modified.append(rel)
-        except FileNotFoundError:
-            continue
-    return added, removed, modified
+            if not os.path.isdir(self.orig):
+                snapshot_rootfs(self.cur)
+            orig={}
+            if os.path.exists(self.orig):
+                orig=load_manifest(manifest_path(self.orig))
+                if orig is None:
+                    orig=update_manifest(self.orig)
+            for batch in iter_changes(orig, self.cur, should_stop=lambda: self.stop_flag):
+                self.found.emit(batch)
+            self.finished.emit(not self.stop_flag)
+        except Exception as e:
+            self.error.emit(str(e))
+
+class DiffPager(QObject):
+    """Pulls iter_diff() on a background thread one page at a time; more() asks for the next page."""
+    page = Signal(int, list, bool)      # token, lines, has_more
+    def __init__(self, token, orig, cur, rel):
+        super().__init__()
+        self.token=token; self.orig=orig; self.cur=cur; self.rel=rel
+        self.cancelled=False
+        self._want=threading.Event(); self._want.set()
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+    def more(self):
+        self._want.set()
+    def cancel(self):
+        self.cancelled=True; self._want.set()
+    def run(self):
+        gen=iter_diff(self.orig,self.cur,self.rel,should_stop=lambda: self.cancelled)
+        try:
+            while True:
+                self._want.wait()
+                self._want.clear()
+                if self.cancelled:
+                    return
+                lines=[]
+                for line in gen:
+                    lines.append(line)
+                    if len(lines)>=DIFF_PAGE_LINES or self.cancelled:
+                        break
+                if self.cancelled:
+                    return
+                more=len(lines)>=DIFF_PAGE_LINES
+                self.page.emit(self.token,lines,more)
+                if not more:
+                    return
+        except Exception as e:
+            if not self.cancelled:
+                self.page.emit(self.token,[f"Diff error: {e}"],False)
+        finally:
+            gen.close()
 
 # ---------------- MainWindow ----------------
 class MainWindow(QMainWindow):
@@ -257,19 +408,47 @@ class MainWindow(QMainWindow):
         self.current_segment=None
         self.use_sudo_extract=self.config.get("fmk",{}).get("use_sudo_extract","auto")
         self.use_sudo_build=self.config.get("fmk",{}).get("use_sudo_build","auto")
+        self.build_engine=self.config.get("build",{}).get("engine","auto")
+        self.build_workers=self.config.get("build",{}).get("workers",0) or None
+        self.size_cache_path=self.config.get("build",{}).get("size_cache",os.path.join("workspaces",".size_cache.sqlite"))
+        self.build_overrides=None   # settings found by Fit to Span (python engine)
+        self.ai_workers=self.config.get("ai",{}).get("workers",0) or None
+        self.ai_cache_path=self.config.get("ai",{}).get("cache",os.path.join("workspaces",".analysis_cache.sqlite"))
+        self.ai_cache_max_bytes=int(self.config.get("ai",{}).get("cache_max_mb",64))*1048576
+        # hash ทุกจุด (diff / snapshot / size cache / build) ผ่าน service เดียว; cache บน disk ถ้ากำหนด
+        hashing.configure(self.config.get("hashing",{}).get("cache") or None)
+        self.object_store_path=self.config.get("store",{}).get("path") or None
+        self.catalog_path=self.config.get("catalog",{}).get("path",os.path.join("workspaces",".catalog.sqlite")) or None
+        self.search_index_path=self.config.get("search",{}).get("path",os.path.join("workspaces",".search_index.sqlite")) or None
+        tracing.enable(self.config.get("trace",{}).get("enabled",False))
+        self.trace_mark=0
 
         os.makedirs("workspaces",exist_ok=True)
         os.makedirs("output",exist_ok=True)
 
-        self.log_emitter=LogEmitter()
-        self.log_emitter.log_signal.connect(self.append_log)
+        # log จากทุก thread เข้า buffer (ไม่ส่ง signal ต่อบรรทัด) แล้ว flush ลง view เป็นชุดทุก flush_ms
+        log_cfg=self.config.get("log",{})
+        self.log_buffer=LogBuffer(int(log_cfg.get("ring_lines",5000)))
+        self.log_buffer.set_file(log_cfg.get("file",os.path.join("workspaces","workbench.log")) or None)
+        self.log_level=LEVELS.get(str(log_cfg.get("level","INFO")).upper(),LEVELS["INFO"])
+        self.log_timer=QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(int(log_cfg.get("flush_ms",100)))
 
         self.tabs=QTabWidget()
         self.setCentralWidget(self.tabs)
 
         # Log tab
-        self.log_view=QTextEdit(); self.log_view.setReadOnly(True)
-        log_tab=QWidget(); v=QVBoxLayout(log_tab); v.addWidget(QLabel("System Log")); v.addWidget(self.log_view)
+        self.log_view=QPlainTextEdit(); self.log_view.setReadOnly(True)
+        self.log_view.setMaximumBlockCount(self.log_buffer.history.maxlen)
+        self.log_level_box=QComboBox(); self.log_level_box.addItems(list(LEVELS))
+        self.log_level_box.setCurrentText(LEVEL_NAMES[self.log_level])
+        self.log_level_box.currentTextChanged.connect(self.set_log_level)
+        self.log_file_label=QLabel(self.log_buffer.file_path or "-")
+        log_bar=QHBoxLayout(); log_bar.addWidget(QLabel("System Log")); log_bar.addStretch()
+        log_bar.addWidget(QLabel("Level:")); log_bar.addWidget(self.log_level_box)
+        log_bar.addWidget(QLabel("File:")); log_bar.addWidget(self.log_file_label)
+        log_tab=QWidget(); v=QVBoxLayout(log_tab); v.addLayout(log_bar); v.addWidget(self.log_view)
         self.tabs.addTab(log_tab,"Logs")
 
         # AI (basic) tab
@@ -284,8 +463,14 @@ class MainWindow(QMainWindow):
         self.btn_ai_single.clicked.connect(self.manual_ai_current)
         self.btn_ai_all=QPushButton("วิเคราะห์ทุก Segment (AI ALL)")
         self.btn_ai_all.clicked.connect(self.ai_all_segments)
+        self.btn_ai_stop=QPushButton("หยุด AI ALL")
+        self.btn_ai_stop.clicked.connect(self.stop_ai_all)
+        self.btn_scan_layout=QPushButton("Scan Layout (signature scan)")
+        self.btn_scan_layout.clicked.connect(self.scan_firmware_layout)
         vai.addWidget(self.btn_ai_single)
         vai.addWidget(self.btn_ai_all)
+        vai.addWidget(self.btn_ai_stop)
+        vai.addWidget(self.btn_scan_layout)
         vai.addWidget(QLabel("ผลวิเคราะห์ AI / รวม"))
         vai.addWidget(self.ai_info)
         self.tabs.addTab(ai_tab,"AI")
@@ -348,6 +533,9 @@ class MainWindow(QMainWindow):
         patch_layout.addRow("", self.chk_telnet)
         patch_layout.addRow("", self.chk_ftp)
         patch_layout.addRow("", self.btn_patch_segment)
+        self.btn_patch_plan=QPushButton("Apply Patch Plan (YAML/JSON) to All Segments")
+        self.btn_patch_plan.clicked.connect(self.apply_patch_plan)
+        patch_layout.addRow("", self.btn_patch_plan)
         patch_box.setLayout(patch_layout)
         vf.addWidget(patch_box)
 
@@ -355,6 +543,10 @@ class MainWindow(QMainWindow):
         self.btn_predict=QPushButton("Predict RootFS Size")
         self.btn_predict.clicked.connect(self.predict_rootfs)
         pred_layout.addWidget(self.btn_predict)
+        self.btn_fit=QPushButton("Fit to Span")
+        self.btn_fit.setToolTip("ลอง compression / level / block size ขนานกัน หา config ที่ลงพื้นที่เดิมได้")
+        self.btn_fit.clicked.connect(self.fit_rootfs)
+        pred_layout.addWidget(self.btn_fit)
         vf.addLayout(pred_layout)
 
         build_layout=H=QHBoxLayout()
@@ -378,18 +570,27 @@ class MainWindow(QMainWindow):
         top_bar.addWidget(self.btn_export_diff)
         vd.addLayout(top_bar)
 
-        self.diff_files_list=QListWidget()
-        self.diff_files_list.itemSelectionChanged.connect(self.show_selected_diff)
+        # model/view: rows arrive in batches from DiffScanWorker, only visible rows are rendered
+        self.diff_model=ChangeListModel()
+        self.diff_files_list=QListView(); self.diff_files_list.setUniformItemSizes(True)
+        self.diff_files_list.setModel(self.diff_model)
+        self.diff_files_list.selectionModel().selectionChanged.connect(self.show_selected_diff)
+        self.diff_status=QLabel("")
         vd.addWidget(QLabel("Changed Files (Added / Removed / Modified)"))
         vd.addWidget(self.diff_files_list)
+        vd.addWidget(self.diff_status)
 
-        self.diff_view=QTextEdit(); self.diff_view.setReadOnly(True)
+        self.diff_view=QPlainTextEdit(); self.diff_view.setReadOnly(True)
+        self.diff_view.verticalScrollBar().valueChanged.connect(self.diff_scrolled)
         vd.addWidget(QLabel("Unified Diff"))
         vd.addWidget(self.diff_view)
+        self.diff_scan_thread=None; self.diff_scan_worker=None; self.diff_rescan=False
+        self.diff_pager=None; self.diff_token=0; self.diff_has_more=False; self.diff_first_page=False
         self.tabs.addTab(diff_tab,"Diff Viewer")
 
         # AI aggregated results store
         self.ai_all_results = {}
+        self.fw_layout = []
 
         if self.fmk_root:
             self.append_log(f"พบ FMK root: {self.fmk_root}")
@@ -408,8 +609,33 @@ class MainWindow(QMainWindow):
 
     # ------------- Logging -------------
     def append_log(self,text):
-        self.log_view.append(text)
-        self.log_view.ensureCursorVisible()
+        self.log_buffer(text)
+
+    def flush_log(self):
+        batch=self.log_buffer.drain()
+        lines=[l for lv,l in batch if lv>=self.log_level]
+        if lines:
+            self.log_view.appendPlainText("\n".join(lines))
+        path=self.log_buffer.file_path or "-"
+        if self.log_file_label.text()!=path:
+            self.log_file_label.setText(path)
+
+    def set_log_level(self,name):
+        self.flush_log()
+        self.log_level=LEVELS[name]
+        self.log_view.setPlainText("\n".join(l for lv,l in self.log_buffer.snapshot(self.log_level)))
+        self.log_view.moveCursor(self.log_view.textCursor().MoveOperation.End)
+
+    def closeEvent(self,event):
+        self.export_trace()
+        fs_index.close_all()
+        self.flush_log()
+        self.log_buffer.close()
+        super().closeEvent(event)
+
+    def log_to_workspace(self,ws,mark):
+        # log เต็มของ session นี้ไปอยู่ใน workspace (รวมบรรทัดตั้งแต่เริ่ม extract)
+        self.log_buffer.set_file(os.path.join(ws,"logs","workbench.log"),replay_from=mark)
 
     # ------------- FW selection -------------
     def choose_firmware(self):
@@ -419,6 +645,23 @@ class MainWindow(QMainWindow):
             self.fw_line.setText(path)
             self.append_log(f"เลือก firmware: {path}")
 
+    # ------------- Layout scan -------------
+    def scan_firmware_layout(self):
+        path=self.fw_line.text()
+        if not path or not os.path.isfile(path):
+            QMessageBox.warning(self,"Layout","ยังไม่ได้เลือก firmware")
+            return
+        try:
+            self.fw_layout=scan_layout(path)
+        except Exception as e:
+            QMessageBox.warning(self,"Layout",f"สแกนไม่สำเร็จ: {e}")
+            return
+        self.ai_info.append("=== Firmware Layout ===")
+        for line in format_layout(self.fw_layout):
+            self.ai_info.append(line)
+        if not self.fw_layout:
+            self.ai_info.append("ไม่พบ signature ที่รู้จัก")
+
     # ------------- FMK root -------------
     def choose_fmk_root(self):
         d=QFileDialog.getExistingDirectory(self,"เลือก FMK Root")
@@ -443,6 +686,73 @@ class MainWindow(QMainWindow):
             self.ws_name.setText(name)
         return name
 
+    @tracing.traced("workspace")
+    def store_rootfs(self, rootfs_dir):
+        """Deduplicate a freshly extracted rootfs into the object store (store.path in config.yaml)."""
+        if not self.object_store_path or not os.path.isdir(rootfs_dir):
+            return
+        try:
+            with ObjectStore(self.object_store_path) as store:
+                st=store.ingest_tree(rootfs_dir)
+            self.log_buffer(f"[STORE] {rootfs_dir}: {st['files']} files, new {st['new']}, "
+                            f"linked {st['linked']} (ประหยัด {st['bytes_saved']} bytes)")
+        except (OSError, ValueError) as e:
+            self.log_buffer(f"[STORE] ingest ไม่สำเร็จ: {e}")
+
+    def catalog_record(self, action):
+        """Run action(catalog) on the workspace catalog (catalog.path in config.yaml) in the calling thread."""
+        if not self.catalog_path:
+            return
+        try:
+            with Catalog(self.catalog_path) as cat:
+                action(cat)
+        except (sqlite3.Error, OSError) as e:
+            self.log_buffer(f"[CATALOG] บันทึกไม่สำเร็จ: {e}")
+
+    @tracing.traced("workspace")
+    def search_index_rootfs(self, rootfs_dirs):
+        """Add freshly extracted trees to the corpus search index (search.path in config.yaml)."""
+        if not self.search_index_path:
+            return
+        try:
+            with SearchIndex(self.search_index_path) as idx:
+                for rootfs_dir in rootfs_dirs:
+                    if os.path.isdir(rootfs_dir):
+                        idx.index_tree(rootfs_dir, self.build_workers, self.log_buffer)
+        except (sqlite3.Error, OSError) as e:
+            self.log_buffer(f"[SEARCH] index ไม่สำเร็จ: {e}")
+
+    def export_trace(self):
+        """Spans since the last extract -> <workspace>/logs/trace.json (trace.enabled in config.yaml)."""
+        if not tracing.enabled() or not self.fmk_workspace:
+            return
+        path=os.path.join(self.fmk_workspace,"logs","trace.json")
+        try:
+            n=tracing.export(path, since=self.trace_mark)
+            self.log_buffer(f"[TRACE] {n} spans → {path}")
+        except OSError as e:
+            self.log_buffer(f"[TRACE] export ไม่สำเร็จ: {e}")
+
+    def current_segment_name(self):
+        if self.multisquash_mode and self.current_segment:
+            return self.current_segment["name"]
+        return "rootfs"
+
+    @tracing.traced("workspace")
+    def watch_rootfs(self, rootfs_dirs):
+        """Live in-memory index (fs_index) of the open workspace's rootfs trees; replaces the previous ones."""
+        fs_index.close_all()
+        for rootfs_dir in rootfs_dirs:
+            if not os.path.isdir(rootfs_dir):
+                continue
+            try:
+                idx=fs_index.open_index(rootfs_dir)
+            except OSError as e:
+                self.log_buffer(f"[INDEX] {rootfs_dir}: {e}")
+                continue
+            self.log_buffer(f"[INDEX] {rootfs_dir}: {idx.file_count()} files, {idx.total_size()} bytes"
+                            f"{'' if idx.live else ' (ไม่มี inotify: snapshot เท่านั้น)'}")
+
     def snapshot_current_segment(self):
         # Determine rootfs path
         if self.multisquash_mode and self.current_segment:
@@ -451,7 +761,7 @@ class MainWindow(QMainWindow):
             if not self.fmk_workspace: return
             rootfs_dir=os.path.join(self.fmk_workspace,"rootfs")
         if os.path.isdir(rootfs_dir):
-            snapshot_rootfs(rootfs_dir)
+            snapshot_rootfs(rootfs_dir, log=self.log_buffer)
 
     # ------------- Extract Single -------------
     def extract_single(self):
@@ -461,23 +771,36 @@ class MainWindow(QMainWindow):
         ws=os.path.join("workspaces", self.workspace_name())
         self.append_log(f"[FMK] Extract Single → {ws}")
         self.multisquash_mode=False
+        self.build_overrides=None
+        mark=self.log_buffer.mark()
+        self.trace_mark=tracing.mark()
         def worker():
             try:
                 meta=extract_firmware(self.fmk_root,self.fw_line.text(),ws,
-                                      log_callback=self.log_emitter.log_signal.emit,
+                                      log_callback=self.log_buffer,
                                       use_sudo=self.use_sudo_extract)
                 self.fmk_workspace=ws
+                self.log_to_workspace(ws,mark)
                 self.fmk_meta=meta
                 self.segments=[]
                 self.current_segment=None
+                fw=self.fw_line.text()
+                def record(cat):
+                    cat.record_workspace(ws, fw, mode="single")
+                    cat.record_segment(ws, "rootfs", meta)
+                self.catalog_record(record)
+                self.store_rootfs(os.path.join(ws,"rootfs"))
+                self.watch_rootfs([os.path.join(ws,"rootfs")])
                 # snapshot
                 self.snapshot_current_segment()
-                self.log_emitter.log_signal.emit("[FMK] Extract Single สำเร็จ")
+                self.search_index_rootfs([os.path.join(ws,"rootfs")])
+                self.log_buffer("[FMK] Extract Single สำเร็จ")
+                self.export_trace()
                 QTimer.singleShot(0,self.render_meta)
                 if self.chk_auto_ai.isChecked():
                     self.ai_current_segment(auto=True)
             except Exception as e:
-                self.log_emitter.log_signal.emit(f"[FMK] ERROR extract: {e}")
+                self.log_buffer(f"[FMK] ERROR extract: {e}")
         threading.Thread(target=worker, daemon=True).start()
 
     # ------------- Extract Multi -------------
@@ -488,27 +811,41 @@ class MainWindow(QMainWindow):
         ws=os.path.join("workspaces", self.workspace_name())
         self.append_log(f"[FMK] Extract Multi-Squash → {ws}")
         self.multisquash_mode=True
+        self.build_overrides=None
+        mark=self.log_buffer.mark()
+        self.trace_mark=tracing.mark()
         def worker():
             try:
                 segs=extract_multisquash(self.fmk_root,self.fw_line.text(),ws,
-                                         log_callback=self.log_emitter.log_signal.emit)
+                                         log_callback=self.log_buffer)
                 self.fmk_workspace=ws
+                self.log_to_workspace(ws,mark)
                 self.segments=segs
                 if segs:
                     self.current_segment=segs[0]
                     self.fmk_meta=segs[0]["meta"]
+                fw=self.fw_line.text()
+                def record(cat):
+                    cat.record_workspace(ws, fw, mode="multi")
+                    for seg in segs:
+                        cat.record_segment(ws, seg["name"], seg["meta"])
+                self.catalog_record(record)
+                self.watch_rootfs([os.path.join(seg["segment_dir"],"rootfs") for seg in segs])
                 # snapshot each segment
                 for seg in segs:
                     snap_root=os.path.join(seg["segment_dir"],"rootfs")
                     if os.path.isdir(snap_root):
-                        snapshot_rootfs(snap_root)
-                self.log_emitter.log_signal.emit(f"[FMK] Extract Multi สำเร็จ (segments={len(segs)})")
+                        self.store_rootfs(snap_root)
+                        snapshot_rootfs(snap_root, log=self.log_buffer)
+                self.search_index_rootfs([os.path.join(seg["segment_dir"],"rootfs") for seg in segs])
+                self.log_buffer(f"[FMK] Extract Multi สำเร็จ (segments={len(segs)})")
+                self.export_trace()
                 QTimer.singleShot(0,self.render_segments)
                 QTimer.singleShot(0,self.render_meta)
                 if self.chk_auto_ai.isChecked():
                     self.ai_current_segment(auto=True)
             except Exception as e:
-                self.log_emitter.log_signal.emit(f"[FMK] ERROR multi extract: {e}")
+                self.log_buffer(f"[FMK] ERROR multi extract: {e}")
         threading.Thread(target=worker, daemon=True).start()
 
     def render_segments(self):
@@ -567,7 +904,7 @@ class MainWindow(QMainWindow):
             return
         self.ai_info.append(f"เริ่ม AI offset=0x{offset:X} size={size}")
         self.ai_thread_single=QThread()
-        self.ai_worker=AIWorker(fw_path, offset, size)
+        self.ai_worker=AIWorker(fw_path, offset, size, self.ai_cache_path, self.ai_cache_max_bytes)
         self.ai_worker.moveToThread(self.ai_thread_single)
         self.ai_thread_single.started.connect(self.ai_worker.run)
         self.ai_worker.log.connect(self.append_log)
@@ -581,6 +918,10 @@ class MainWindow(QMainWindow):
         self.ai_info.append("=== Segment AI Result ===")
         for line in findings:
             self.ai_info.append(line)
+        if self.fmk_workspace:
+            ws,name=self.fmk_workspace,self.current_segment_name()
+            self.catalog_record(lambda cat: cat.record_findings(ws, name, findings))
+            self.export_trace()
 
     def ai_single_error(self, msg):
         self.ai_info.append("AI ERROR\n"+msg)
@@ -598,7 +939,8 @@ class MainWindow(QMainWindow):
             seg_meta_pairs.append((seg["name"], seg["meta"]))
         self.ai_info.append("เริ่มวิเคราะห์ทุก segment ...")
         self.ai_thread_all=QThread()
-        self.ai_all_worker=MultiSegmentAIWorker(self.fw_line.text(), seg_meta_pairs)
+        self.ai_all_worker=MultiSegmentAIWorker(self.fw_line.text(), seg_meta_pairs, self.ai_workers,
+                                                self.ai_cache_path, self.ai_cache_max_bytes)
         self.ai_all_worker.moveToThread(self.ai_thread_all)
         self.ai_thread_all.started.connect(self.ai_all_worker.run)
         self.ai_all_worker.progress.connect(self.append_log)
@@ -609,6 +951,11 @@ class MainWindow(QMainWindow):
         self.ai_all_worker.error.connect(self.ai_thread_all.quit)
         self.ai_thread_all.start()
 
+    def stop_ai_all(self):
+        if hasattr(self,"ai_thread_all") and self.ai_thread_all and self.ai_thread_all.isRunning():
+            self.ai_all_worker.stop_flag=True
+            self.append_log("[AI ALL] กำลังหยุด ...")
+
     def ai_all_segment_done(self, name, findings):
         self.ai_info.append(f"--- {name} ---")
         for line in findings:
@@ -616,6 +963,13 @@ class MainWindow(QMainWindow):
 
     def ai_all_done(self, results):
         self.ai_all_results=results
+        if self.fmk_workspace:
+            ws=self.fmk_workspace
+            def record(cat):
+                for name,res in results.items():
+                    cat.record_findings(ws, name, res)
+            self.catalog_record(record)
+            self.export_trace()
         self.ai_info.append("=== รวมเสร็จสิ้น ===")
         # Summary detection (e.g. insecure root)
         risk=[]
@@ -645,8 +999,45 @@ class MainWindow(QMainWindow):
         if not os.path.isdir(rootfs_dir):
             QMessageBox.information(self,"Predict","ไม่พบ rootfs directory")
             return
+        overrides=None if self.multisquash_mode else self.build_overrides
+        est=None
+        if not self.fmk_builds():
+            # sampled / python estimates are only exact against the python engine
+            try:
+                est=sample_squashfs_size(rootfs_dir, meta, workers=self.build_workers,
+                                         build_overrides=overrides, log_callback=self.log_buffer)
+            except (SquashFSError, OSError) as e:
+                self.append_log(f"[Predict] sampling ใช้ไม่ได้ ({e})")
+        if est and est.verdict(span)!="uncertain":
+            # the whole confidence interval is on one side of the span -> no exact pass needed
+            msg=(f"Original span: {span} bytes\nPredicted (sampled): {est.size} bytes "
+                 f"({est.confidence:.0%}: {est.low}-{est.high})\nRemaining: {span-est.size} bytes")
+            if est.verdict(span)=="over":
+                QMessageBox.warning(self,"Predict","ขนาดเกินพื้นที่เดิม (เกือบแน่นอน)\n"+msg)
+            else:
+                QMessageBox.information(self,"Predict",msg)
+            return
+        if est:
+            self.append_log("[Predict] ค่าประมาณใกล้ span เกินไป → คำนวณแบบเต็ม")
         try:
-            predicted=estimate_squashfs_size(rootfs_dir, meta, log_callback=self.log_emitter.log_signal.emit)
+            predicted=None
+            if not self.fmk_builds():
+                try:
+                    predicted,attribution=estimate_squashfs_breakdown(
+                        rootfs_dir, meta, cache_path=self.size_cache_path,
+                        log_callback=self.log_buffer, workers=self.build_workers,
+                        firmware_path=self.fw_line.text().strip() or None,
+                        build_overrides=overrides)
+                    self.append_log("[Predict] ไฟล์ที่ใช้พื้นที่มากที่สุด:")
+                    for rel,nbytes in sorted(attribution.items(), key=lambda x: -x[1])[:15]:
+                        self.append_log(f"  {nbytes:>10}  {rel}")
+                except (SquashFSError, OSError) as e:
+                    if self.build_engine=="python":
+                        raise
+                    self.append_log(f"[Predict] python builder ใช้ไม่ได้ ({e}) → mksquashfs")
+            if predicted is None:
+                predicted=estimate_squashfs_size(rootfs_dir, meta, log_callback=self.log_buffer,
+                                                 engine="mksquashfs")
         except Exception as e:
             QMessageBox.warning(self,"Predict",f"ประเมินไม่สำเร็จ: {e}")
             return
@@ -657,6 +1048,43 @@ class MainWindow(QMainWindow):
         else:
             QMessageBox.information(self,"Predict",msg)
 
+    def fit_rootfs(self):
+        meta=self.fmk_meta
+        span=compute_original_rootfs_span(meta)
+        if span is None:
+            QMessageBox.information(self,"Fit","ไม่สามารถคำนวณ span เดิมได้")
+            return
+        if self.multisquash_mode:
+            QMessageBox.information(self,"Fit","Build แบบ Multi-Squash ใช้สคริปต์ FMK – ปรับ config ไม่ได้")
+            return
+        if self.build_engine=="fmk":
+            QMessageBox.information(self,"Fit","ต้องใช้ build.engine = auto หรือ python")
+            return
+        rootfs_dir=os.path.join(self.fmk_workspace or "","rootfs")
+        if not os.path.isdir(rootfs_dir):
+            QMessageBox.information(self,"Fit","ไม่พบ rootfs directory")
+            return
+        self.append_log(f"[FIT] หา config ที่ลง span {span} bytes ...")
+        self.btn_fit.setEnabled(False)
+        def worker():
+            try:
+                best,results=find_fit(rootfs_dir, meta, span, workers=self.build_workers,
+                                      log_callback=self.log_buffer)
+                if best:
+                    self.build_overrides=build_overrides(best)
+                    self.log_buffer(f"[FIT] เล็กที่สุดที่ลงได้: {best['compression']}-"
+                                    f"{level_name(best['compression'],best['level'])} block={best['block_size']} "
+                                    f"size={best['size']} margin={best['margin']} → ใช้กับ Build ครั้งถัดไป")
+                else:
+                    smallest=min(results, key=lambda r: r["size"])
+                    self.log_buffer(f"[FIT] ไม่มี config ที่ลงได้ (เล็กที่สุด {smallest['size']} bytes, "
+                                    f"เกิน {-smallest['margin']} bytes) – ต้องลดไฟล์ใน rootfs")
+            except (SquashFSError, OSError) as e:
+                self.log_buffer(f"[FIT] ERROR: {e}")
+            finally:
+                QTimer.singleShot(0, lambda: self.btn_fit.setEnabled(True))
+        threading.Thread(target=worker, daemon=True).start()
+
     # ------------- Build Firmware -------------
     def build_firmware(self):
         if not self.fmk_workspace:
@@ -674,27 +1102,39 @@ class MainWindow(QMainWindow):
             try:
                 if self.multisquash_mode:
                     out_fw=build_multisquash(self.fmk_root,self.fmk_workspace,nopad=nopad,minblk=minblk,
-                                             log_callback=self.log_emitter.log_signal.emit)
+                                             log_callback=self.log_buffer)
                 else:
                     out_fw=build_firmware(self.fmk_root,self.fmk_workspace,nopad=nopad,minblk=minblk,
-                                          log_callback=self.log_emitter.log_signal.emit)
+                                          log_callback=self.log_buffer,
+                                          engine=self.build_engine, workers=self.build_workers,
+                                          firmware_path=self.fw_line.text().strip() or None,
+                                          build_overrides=self.build_overrides)
                 if not out_fw:
-                    self.log_emitter.log_signal.emit("[FMK] Build failed (no output file).")
+                    self.log_buffer("[FMK] Build failed (no output file).")
                     return
                 final=out_fw
                 if self.chk_linksys.isChecked() and detect_linksys_candidate(self.fmk_meta):
-                    self.log_emitter.log_signal.emit("[FMK] Linksys footer fix ...")
+                    self.log_buffer("[FMK] Linksys footer fix ...")
                     mod=postprocess_linksys_footer(self.fmk_root,out_fw,
-                                                   log_callback=self.log_emitter.log_signal.emit)
+                                                   log_callback=self.log_buffer)
                     if mod:
                         final=mod
                 target=os.path.join("output","rebuilt_"+os.path.basename(self.fw_line.text()))
-                shutil.copy2(final,target)
-                self.log_emitter.log_signal.emit(f"[FMK] Build OK → {target}")
+                with tracing.span("copy_output", cat="build", target=target):
+                    shutil.copy2(final,target)
+                self.log_buffer(f"[FMK] Build OK → {target}")
+                ws=self.fmk_workspace
+                engine="fmk" if self.multisquash_mode else self.build_engine
+                self.catalog_record(lambda cat: cat.record_build(ws, target, engine))
+                self.export_trace()
             except Exception as e:
-                self.log_emitter.log_signal.emit(f"[FMK] ERROR build: {e}")
+                self.log_buffer(f"[FMK] ERROR build: {e}")
         threading.Thread(target=worker, daemon=True).start()
 
+    def fmk_builds(self):
+        """True when build-firmware.sh (FMK's mksquashfs) will write the rootfs image."""
+        return self.multisquash_mode or self.build_engine=="fmk"
+
     def pre_build_warning(self):
         meta=self.fmk_meta
         span=compute_original_rootfs_span(meta)
@@ -704,8 +1144,25 @@ class MainWindow(QMainWindow):
         else:
             rootfs_dir=os.path.join(self.fmk_workspace,"rootfs")
         if not os.path.isdir(rootfs_dir): return None
+        overrides=None if self.multisquash_mode else self.build_overrides
+        if self.fmk_builds():
+            # FMK's mksquashfs writes the image: the python estimates are not bounded
+            # against it, so always measure with mksquashfs itself
+            engine="mksquashfs"
+        else:
+            engine=self.build_engine
+            try:
+                est=sample_squashfs_size(rootfs_dir, meta, workers=self.build_workers, build_overrides=overrides)
+                if est.low>span:
+                    return f"คาดว่าจะเกินพื้นที่ rootfs เดิม (sampled {est.size}, อย่างน้อย {est.low} > {span})"
+                if est.high+65536<=span:
+                    return None
+            except Exception:
+                pass
+        # sampled interval too close to the span (or sampling unusable) -> exact prediction
         try:
-            predicted=estimate_squashfs_size(rootfs_dir, meta)
+            predicted=estimate_squashfs_size(rootfs_dir, meta, engine=engine, workers=self.build_workers,
+                                             cache_path=self.size_cache_path, build_overrides=overrides)
         except Exception:
             return None
         free=span - predicted
@@ -736,12 +1193,12 @@ class MainWindow(QMainWindow):
         enable_ftp=self.chk_ftp.isChecked()
 
         try:
-            if pw is not None:
-                patch_root_password(rootfs_dir, pw)
+            # password + services in one batch: each file is read/written once
+            ops=service_ops(enable_serial, enable_telnet, enable_ftp, root_password=pw)
+            acts=apply_ops(rootfs_dir, compile_ops(ops))["actions"]
+            if "root_password_set" in acts:
                 self.append_log("[Patch] Root password updated")
-            acts=patch_services(rootfs_dir, ensure_serial=enable_serial,
-                                enable_telnet_flag=enable_telnet,
-                                enable_ftp_flag=enable_ftp)
+            acts=[a for a in acts if a!="root_password_set"]
             if acts:
                 self.append_log("[Patch] Service actions: "+", ".join(acts))
             QMessageBox.information(self,"Patch","Patch สำเร็จ")
@@ -752,6 +1209,33 @@ class MainWindow(QMainWindow):
         # After patch we can refresh diff
         self.refresh_diff_list()
 
+    def apply_patch_plan(self):
+        if not self.fmk_workspace:
+            QMessageBox.warning(self,"Patch","ยังไม่มี workspace")
+            return
+        path,_=QFileDialog.getOpenFileName(self,"เลือก Patch Plan","","Plan (*.yaml *.yml *.json);;All Files (*)")
+        if not path:
+            return
+        try:
+            name,ops=load_plan(path)
+        except PatchError as e:
+            QMessageBox.warning(self,"Patch Plan",str(e))
+            return
+        targets=find_targets([self.fmk_workspace])
+        self.append_log(f"[Plan] {name}: {len(targets)} rootfs")
+        def worker():
+            errors=0
+            for rec in apply_plan(ops, targets):
+                rel=os.path.relpath(rec["target"], os.path.abspath(self.fmk_workspace))
+                if rec["status"]=="ok":
+                    self.log_buffer(f"[Plan] {rel}: {', '.join(rec['actions']) or '(ไม่มีการเปลี่ยนแปลง)'}")
+                else:
+                    errors+=1
+                    self.log_buffer(f"[Plan] {rel}: ERROR {rec['error']}")
+            self.log_buffer(f"[Plan] {name} เสร็จ (error={errors})")
+            QTimer.singleShot(0,self.refresh_diff_list)
+        threading.Thread(target=worker, daemon=True).start()
+
     # ------------- Diff Viewer -------------
     def get_rootfs_paths(self):
         if self.multisquash_mode and self.current_segment:
@@ -763,65 +1247,118 @@ class MainWindow(QMainWindow):
         return orig, cur
 
     def refresh_diff_list(self):
-        self.diff_files_list.clear()
+        if self.diff_scan_thread is not None:
+            # a scan is still running: stop it and start over once it has finished
+            self.diff_scan_worker.stop_flag=True
+            self.diff_rescan=True
+            return
+        self.cancel_diff_page()
+        self.diff_model.clear()
         orig,cur=self.get_rootfs_paths()
         if not orig or not cur or not os.path.isdir(cur):
             self.diff_view.setPlainText("ไม่มี rootfs / ยังไม่ได้ extract")
             return
         if not os.path.isdir(orig):
             self.diff_view.setPlainText("ไม่พบ snapshot (rootfs_original) – จะสร้างอัตโนมัติ")
-            snapshot_rootfs(cur)
-            orig=os.path.join(os.path.dirname(cur),"rootfs_original")
-        added, removed, modified = summarize_changes(orig, cur)
-        for r in sorted(added):
-            it=QListWidgetItem(f"[A] {r}")
-            it.setData(Qt.UserRole, ("added", r))
-            self.diff_files_list.addItem(it)
-        for r in sorted(removed):
-            it=QListWidgetItem(f"[R] {r}")
-            it.setData(Qt.UserRole, ("removed", r))
-            self.diff_files_list.addItem(it)
-        for r in sorted(modified):
-            it=QListWidgetItem(f"[M] {r}")
-            it.setData(Qt.UserRole, ("modified", r))
-            self.diff_files_list.addItem(it)
-        self.diff_view.setPlainText(f"Added: {len(added)} | Removed: {len(removed)} | Modified: {len(modified)}")
+        else:
+            self.diff_view.clear()
+        self.diff_status.setText("กำลังสแกน ...")
+        self.diff_scan_thread=QThread()
+        self.diff_scan_worker=DiffScanWorker(orig,cur)
+        self.diff_scan_worker.moveToThread(self.diff_scan_thread)
+        self.diff_scan_thread.started.connect(self.diff_scan_worker.run)
+        self.diff_scan_worker.found.connect(self.diff_model.append_rows)
+        self.diff_scan_worker.found.connect(self.diff_scan_progress)
+        self.diff_scan_worker.finished.connect(self.diff_scan_done)
+        self.diff_scan_worker.error.connect(self.diff_scan_error)
+        self.diff_scan_worker.finished.connect(self.diff_scan_thread.quit)
+        self.diff_scan_worker.error.connect(self.diff_scan_thread.quit)
+        self.diff_scan_thread.finished.connect(self.diff_scan_cleanup)
+        self.diff_scan_thread.start()
+
+    def diff_status_text(self):
+        c=self.diff_model.counts()
+        return f"Added: {c['added']} | Removed: {c['removed']} | Modified: {c['modified']}"
+
+    def diff_scan_progress(self,batch):
+        self.diff_status.setText(self.diff_status_text()+"  (กำลังสแกน ...)")
+
+    def diff_scan_done(self,complete):
+        self.diff_model.sort_rows()
+        self.diff_status.setText(self.diff_status_text()+("" if complete else "  (ยกเลิก)"))
+
+    def diff_scan_error(self,msg):
+        self.diff_status.setText(f"สแกนไม่สำเร็จ: {msg}")
+        self.append_log(f"[Diff] ERROR: {msg}")
+
+    def diff_scan_cleanup(self):
+        self.diff_scan_thread=None; self.diff_scan_worker=None
+        if self.diff_rescan:
+            self.diff_rescan=False
+            self.refresh_diff_list()
+
+    def selected_change(self):
+        idx=self.diff_files_list.selectionModel().selectedIndexes()
+        return idx[0].data(Qt.UserRole) if idx else None
+
+    def cancel_diff_page(self):
+        if self.diff_pager is not None:
+            self.diff_pager.cancel()
+            self.diff_pager=None
+        self.diff_token+=1
+        self.diff_has_more=False
 
     def show_selected_diff(self):
-        items=self.diff_files_list.selectedItems()
-        if not items:
+        sel=self.selected_change()
+        if not sel:
             return
-        change_type, rel=items[0].data(Qt.UserRole)
+        _,rel=sel
         orig,cur=self.get_rootfs_paths()
         if not orig or not cur:
             return
-        if change_type=="added":
-            diff=compute_diff(orig,cur,rel)
-        elif change_type=="removed":
-            diff=compute_diff(orig,cur,rel)
+        # the previous file's diff is abandoned as soon as the selection moves
+        self.cancel_diff_page()
+        self.diff_view.setPlainText("กำลังคำนวณ diff ...")
+        self.diff_first_page=True
+        self.diff_pager=DiffPager(self.diff_token,orig,cur,rel)
+        self.diff_pager.page.connect(self.diff_page_ready)
+        self.diff_pager.start()
+
+    def diff_page_ready(self,token,lines,more):
+        if token!=self.diff_token:
+            return
+        bar=self.diff_view.verticalScrollBar()
+        if self.diff_first_page:
+            self.diff_first_page=False
+            self.diff_view.setPlainText("\n".join(lines))
         else:
-            diff=compute_diff(orig,cur,rel)
-        self.diff_view.setPlainText("\n".join(diff))
+            pos=bar.value()
+            self.diff_view.appendPlainText("\n".join(lines))
+            bar.setValue(pos)
+        self.diff_has_more=more
+        self.diff_status.setText(self.diff_status_text()+("  (เลื่อนลงเพื่อโหลด diff ต่อ)" if more else ""))
+
+    def diff_scrolled(self,value):
+        bar=self.diff_view.verticalScrollBar()
+        if self.diff_has_more and self.diff_pager is not None and value>=bar.maximum()-bar.pageStep():
+            self.diff_has_more=False
+            self.diff_pager.more()
 
     def export_selected_diff(self):
-        items=self.diff_files_list.selectedItems()
-        if not items:
+        sel=self.selected_change()
+        if not sel:
             QMessageBox.information(self,"Export","ยังไม่ได้เลือกไฟล์")
             return
-        _,rel=items[0].data(Qt.UserRole)
+        _,rel=sel
         save_path,_=QFileDialog.getSaveFileName(self,"บันทึก diff",f"{rel.replace('/','_')}.diff","Diff Files (*.diff);;All Files (*)")
         if not save_path:
             return
         orig,cur=self.get_rootfs_paths()
-        diff=compute_diff(orig,cur,rel)
         with open(save_path,"w",encoding="utf-8") as f:
-            f.write("\n".join(diff))
+            for line in iter_diff(orig,cur,rel):
+                f.write(line+"\n")
         QMessageBox.information(self,"Export",f"บันทึก diff ที่ {save_path}")
 
-# ---------------- Support Classes ----------------
-class LogEmitter(QObject):
-    log_signal=Signal(str)
-
 # ---------------- Main ----------------
 if __name__=="__main__":
     app=QApplication(sys.argv)
@@ -0,0 +1,535 @@
+"""
+Benchmark harness: สร้าง firmware สังเคราะห์ที่ทำซ้ำได้ (seed เดียวกัน = image เดียวกันทุก byte) แล้วจับเวลา
+extract -> analyze -> diff -> predict -> build แบบ end to end เก็บผลเป็น JSON ไว้เทียบกันข้าม commit
+
+  python bench.py run -o bench/base.json                               # profile เริ่มต้น
+  python bench.py run --files 5000 --size 64M --segments 2 --header trx --comp gzip --repeat 3 -o bench/x.json
+  python bench.py gen bench/fw --files 2000                            # สร้างแค่ image + config.log
+  python bench.py compare bench/base.json bench/x.json
+  python bench.py coverage --seeds 5 --size 48M --files 3000 --comp gzip,xz   # ช่วงของ size_sample ครอบขนาดจริงไหม
+  python bench.py mksquashfs --seeds 3 --comp gzip,xz                  # SquashFSBuilder เทียบ mksquashfs จริง (ต้องมีใน PATH)
+
+image: header (uImage 64 bytes / TRX 28 bytes, CRC ถูกต้อง) + kernel (ข้อมูลสุ่มหัว LZMA) + squashfs segment
+(align 64 KB) + filler 0xFF + footer 32 bytes; config.log ต่อ segment แบบที่ FMK เขียน (FW_SIZE, HEADER_*, FS_*, FOOTER_*)
+rootfs: ELF-like / text / compressed / data ขนาด log-uniform รวมประมาณ --size, ไฟล์ซ้ำ, symlink ของ busybox,
+/etc ที่ analyzer มีอะไรให้เจอ (telnet, getty, root ไม่มีรหัส); mtime คงที่ทั้งหมด
+
+squashfs สร้างด้วย mksquashfs ถ้ามีใน PATH ไม่งั้นใช้ rebuild_squashfs.SquashFSBuilder
+ไม่มี FMK (--fmk / config.yaml): extract ใช้ squashfs_reader แตก tree + เขียน workspace แบบ FMK เอง และ
+build จับเวลาเฉพาะ SquashFSBuilder (+ block reuse) เพราะ build_firmware ต้องใช้ crcalc ของ FMK
+(ผลบอกว่าแต่ละขั้นใช้ implementation ไหนใน "impl" / ขั้นที่ข้ามอยู่ใน "skipped")
+"""
+
+import os, sys, json, math, time, zlib, shutil, struct, random, tempfile, platform, argparse, subprocess, statistics
+
+from fmk_integration import (locate_fmk, extract_firmware, build_firmware, parse_config, estimate_squashfs_size,
+                             sample_squashfs_size, compute_original_rootfs_span, open_block_reuse)
+from rebuild_squashfs import SquashFSBuilder
+from squashfs_reader import SquashFSImage
+from size_sample import estimate as sample_estimate
+from fw_analysis import analyze_firmware_detailed
+
+RESULT_VERSION = 1
+EPOCH = 1600000000            # fixed mtime / mkfs time: identical images for identical profiles
+ALIGN = 65536
+FOOTER_SIZE = 32
+UIMAGE_MAGIC = 0x27051956
+
+PROFILE = {"files": 1500, "size": 24 * 1048576, "segments": 1, "header": "uimage", "comp": "xz",
+           "block_size": 131072, "kernel": 1048576, "seed": 1, "modify": 50}
+
+_WORDS = ("config option enable disable network interface wireless firewall service daemon root "
+          "admin default value string return static void include define struct kernel module "
+          "address netmask gateway dhcp dns server client port http https telnet ftp ssh").split()
+
+# -------------------------------------------------
+# Synthetic rootfs / image
+# -------------------------------------------------
+def _content(rng, kind, size):
+    if kind == "elf":
+        head = b"\x7fELF\x01\x01\x01" + bytes(9) + struct.pack("<HHI", 2, 8, 1)
+        return (head + bytes(rng.choices(range(24), k=max(0, size - len(head)))))[:size]
+    if kind == "text":
+        out = []
+        n = 0
+        while n < size:
+            line = " ".join(rng.choices(_WORDS, k=rng.randint(3, 12))) + "\n"
+            out.append(line)
+            n += len(line)
+        return "".join(out).encode()[:size]
+    if kind == "compressed":
+        return (b"\x1f\x8b\x08\x00" + rng.randbytes(max(0, size - 4)))[:size]
+    data = bytearray(size)            # tables / calibration data: zero runs with random islands
+    for _ in range(size // 4096 + 1):
+        pos = rng.randrange(size) if size else 0
+        chunk = rng.randbytes(min(512, size - pos))
+        data[pos:pos + len(chunk)] = chunk
+    return bytes(data)
+
+def generate_rootfs(dest, files, total_bytes, seed):
+    """Deterministic rootfs tree in dest (must not exist). Returns {kind: count}."""
+    rng = random.Random(seed)
+    dirs = ["bin", "sbin", "lib", "lib/modules", "usr/bin", "usr/sbin", "usr/lib", "usr/share/misc",
+            "etc", "etc/init.d", "etc/config", "www", "www/cgi-bin", "www/js"]
+    kind_dirs = {"elf": ["bin", "sbin", "lib", "usr/bin", "usr/sbin", "usr/lib", "lib/modules"],
+                 "text": ["etc", "etc/init.d", "etc/config", "www", "www/js", "www/cgi-bin"],
+                 "compressed": ["www", "usr/share/misc", "lib/modules"],
+                 "data": ["usr/share/misc", "lib"]}
+    os.makedirs(dest)
+    for d in dirs:
+        os.makedirs(os.path.join(dest, d), exist_ok=True)
+    fixed = {
+        "etc/passwd": b"root:x:0:0:root:/root:/bin/sh\nadmin:x:1000:1000::/home/admin:/bin/sh\n",
+        "etc/shadow": b"root::18000:0:99999:7:::\nadmin:$1$abc$xyz:18000:0:99999:7:::\n",
+        "etc/inittab": b"::sysinit:/etc/init.d/rcS\nttyS0::respawn:/sbin/getty -L ttyS0 115200 vt100\n",
+        "etc/inetd.conf": b"telnet stream tcp nowait root /usr/sbin/telnetd telnetd\n",
+        "bin/busybox": _content(rng, "elf", 600000) + b"\0BusyBox v1.24.1 (2016-01-01 00:00:00 UTC)\0",
+    }
+    for rel, data in fixed.items():
+        with open(os.path.join(dest, rel), "wb") as f:
+            f.write(data)
+    for applet in ("sh", "ls", "cat", "mount", "ps", "vi", "grep", "sed", "ifconfig", "route"):
+        os.symlink("busybox", os.path.join(dest, "bin", applet))
+    kinds = rng.choices(["elf", "text", "compressed", "data"], weights=[35, 35, 15, 15], k=files)
+    raw = [math.exp(rng.uniform(math.log(64), math.log(1048576))) for _ in range(files)]
+    budget = max(0, total_bytes - sum(len(d) for d in fixed.values()))
+    scale = budget / sum(raw) if raw else 0
+    counts = {}
+    written = []
+    for i, (kind, r) in enumerate(zip(kinds, raw)):
+        rel = f"{rng.choice(kind_dirs[kind])}/{kind}_{i:05d}" + (".txt" if kind == "text" else "")
+        if written and rng.random() < 0.05:
+            with open(os.path.join(dest, rng.choice(written)), "rb") as f:
+                data = f.read()                     # duplicate content (builder stores it once)
+            kind = "duplicate"
+        else:
+            data = _content(rng, kind, max(1, int(r * scale)))
+        with open(os.path.join(dest, rel), "wb") as f:
+            f.write(data)
+        written.append(rel)
+        counts[kind] = counts.get(kind, 0) + 1
+    for root, dnames, fnames in os.walk(dest, topdown=False):
+        for name in fnames + dnames:
+            os.utime(os.path.join(root, name), (EPOCH, EPOCH), follow_symlinks=False)
+    os.utime(dest, (EPOCH, EPOCH))
+    return counts
+
+def make_squashfs(root, out, comp, block_size):
+    """Returns the tool used: "mksquashfs" when on PATH, else "python" (SquashFSBuilder)."""
+    if shutil.which("mksquashfs"):
+        subprocess.run(["mksquashfs", root, out, "-comp", comp, "-b", str(block_size), "-noappend",
+                        "-all-root", "-no-progress"], check=True, stdout=subprocess.DEVNULL)
+        return "mksquashfs"
+    SquashFSBuilder(root, block_size=block_size, compression=comp, mkfs_time=EPOCH).build(out)
+    return "python"
+
+def _align(n, a=ALIGN):
+    return -(-n // a) * a
+
+def _write_config(path, meta):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for k, v in meta.items():
+            f.write(f"{k}='{hex(v) if k in ('FS_OFFSET', 'FOOTER_OFFSET') else v}'\n")
+
+def generate_image(out_dir, profile):
+    """
+    firmware.bin + seg_<i>/ (rootfs_src, rootfs.img, logs/config.log) in out_dir.
+    Returns {"firmware", "size", "squashfs", "segments": [{name, offset, size, config, rootfs_src}]}.
+    """
+    p = dict(PROFILE, **profile)
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(p["seed"])
+    header_size = 64 if p["header"] == "uimage" else 28
+    kernel = b"\x5d\x00\x00\x80\x00" + rng.randbytes(p["kernel"] - 5)
+    segs = []
+    tool = None
+    for i in range(p["segments"]):
+        seg_dir = os.path.join(out_dir, f"seg_{i}")
+        src = os.path.join(seg_dir, "rootfs_src")
+        if os.path.exists(seg_dir):
+            shutil.rmtree(seg_dir)
+        counts = generate_rootfs(src, p["files"] // p["segments"], p["size"] // p["segments"], p["seed"] * 1000 + i)
+        img = os.path.join(seg_dir, "rootfs.img")
+        tool = make_squashfs(src, img, p["comp"], p["block_size"])
+        segs.append({"name": f"seg_{i}", "rootfs_src": src, "image": img, "size": os.path.getsize(img),
+                     "files": counts})
+    # layout: header | kernel | segments (64 KB aligned) | 0xFF headroom | footer
+    pos = _align(header_size + len(kernel))
+    for s in segs:
+        s["offset"] = pos
+        pos = _align(pos + s["size"])
+    fw_size = _align(pos + max(ALIGN, pos // 10)) + FOOTER_SIZE
+    fw = os.path.join(out_dir, "firmware.bin")
+    with open(fw, "wb") as o:
+        o.write(bytes(header_size))
+        o.write(kernel)
+        for s in segs:
+            o.write(b"\xff" * (s["offset"] - o.tell()))
+            with open(s["image"], "rb") as f:
+                shutil.copyfileobj(f, o)
+        o.write(b"\xff" * (fw_size - FOOTER_SIZE - o.tell()))
+        o.write(b"BENCHFTR" + bytes(FOOTER_SIZE - 8))
+    with open(fw, "r+b") as f:
+        body = f.read()[header_size:fw_size - FOOTER_SIZE]
+        if p["header"] == "uimage":
+            hdr = struct.pack(">IIIIIIIBBBB32s", UIMAGE_MAGIC, 0, EPOCH, len(body), 0x80000000, 0x80000000,
+                              zlib.crc32(body), 5, 5, 2, 3, b"bench synthetic")
+            hdr = hdr[:4] + struct.pack(">I", zlib.crc32(hdr)) + hdr[8:]
+        else:
+            offsets = (header_size, header_size, segs[0]["offset"])
+            tail = struct.pack("<I3I", 1 << 16, *offsets) + body
+            hdr = b"HDR0" + struct.pack("<II", header_size + len(body), zlib.crc32(tail)) + tail[:16]
+        f.seek(0)
+        f.write(hdr)
+        f.seek(fw_size - FOOTER_SIZE + 8)
+        f.write(struct.pack(">II", zlib.crc32(body), fw_size))
+    for i, s in enumerate(segs):
+        last = i == len(segs) - 1
+        meta = {"FW_SIZE": fw_size, "HEADER_TYPE": p["header"], "HEADER_SIZE": header_size,
+                "HEADER_IMAGE_SIZE": fw_size - header_size - FOOTER_SIZE, "FS_TYPE": "squashfs",
+                "FS_OFFSET": s["offset"], "FS_COMPRESSION": p["comp"], "FS_BLOCKSIZE": p["block_size"],
+                "FOOTER_SIZE": FOOTER_SIZE if last else 0, "MKFS": "mksquashfs-4.3"}
+        if not last:
+            meta["FOOTER_OFFSET"] = segs[i + 1]["offset"]
+        s["config"] = os.path.join(out_dir, s["name"], "logs", "config.log")
+        _write_config(s["config"], meta)
+    return {"firmware": fw, "size": fw_size, "squashfs": tool, "segments": segs}
+
+# -------------------------------------------------
+# Stages
+# -------------------------------------------------
+def _python_extract(fw, seg, ws):
+    """FMK-shaped workspace (rootfs/, image_parts/, logs/config.log) unpacked with squashfs_reader."""
+    meta, _ = parse_config(seg["config"])
+    rootfs = os.path.join(ws, "rootfs")
+    parts = os.path.join(ws, "image_parts")
+    os.makedirs(parts)
+    shutil.copytree(os.path.dirname(seg["config"]), os.path.join(ws, "logs"))
+    with open(fw, "rb") as f:
+        data = f.read()
+    with open(os.path.join(parts, "header.img"), "wb") as f:
+        f.write(data[:meta["FS_OFFSET"]])
+    with open(os.path.join(parts, "footer.img"), "wb") as f:
+        f.write(data[len(data) - meta["FOOTER_SIZE"]:] if meta["FOOTER_SIZE"] else b"")
+    shutil.copyfile(seg["image"], os.path.join(parts, "rootfs.img"))
+    os.makedirs(rootfs)
+    dirs = []
+    with SquashFSImage(fw, meta["FS_OFFSET"]) as img:
+        for rel, ino in img.walk():
+            path = os.path.join(rootfs, rel)
+            if ino.is_dir():
+                os.mkdir(path)
+                dirs.append((path, ino))
+            elif ino.is_symlink():
+                os.symlink(ino.target, path)
+            elif ino.is_file():
+                with open(path, "wb") as o:
+                    for chunk in img.iter_file(ino):
+                        o.write(chunk)
+                os.chmod(path, ino.mode & 0o7777)
+                os.utime(path, (ino.mtime, ino.mtime))
+    for path, ino in reversed(dirs):
+        os.chmod(path, ino.mode & 0o7777)
+        os.utime(path, (ino.mtime, ino.mtime))
+    return meta
+
+def _modify(rootfs, count, seed):
+    """Deterministic edits for the diff / build stages: append to, add and remove files."""
+    rng = random.Random(seed)
+    files = sorted(os.path.relpath(os.path.join(r, f), rootfs) for r, _, fs in os.walk(rootfs) for f in fs
+                   if not os.path.islink(os.path.join(r, f)))
+    picked = rng.sample(files, min(count, len(files)))
+    for n, rel in enumerate(picked):
+        path = os.path.join(rootfs, rel)
+        if n % 5 == 4:
+            os.remove(path)
+        else:
+            with open(path, "ab") as f:
+                f.write(b"# bench edit %d\n" % n)
+    for n in range(count // 5):
+        with open(os.path.join(rootfs, "etc", f"bench_added_{n}.conf"), "wb") as f:
+            f.write(_content(rng, "text", 2048))
+    return len(picked)
+
+class _Timer:
+    def __init__(self, stages, name, impl=None):
+        self.entry = stages.setdefault(name, {"seconds": []})
+        if impl:
+            self.entry["impl"] = impl
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self.entry
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.entry["seconds"].append(round(time.perf_counter() - self.t0, 4))
+
+def run_pipeline(image, work_dir, fmk_root=None, workers=None, modify=50, log=None):
+    """One pass over every stage in a fresh workspace; fills and returns {stage: entry}, skipped."""
+    from app import snapshot_rootfs, summarize_changes     # GUI module (Qt import only, no window)
+    log = log or (lambda msg: None)
+    stages, skipped = {}, {}
+    fw = image["firmware"]
+    seg = image["segments"][0]
+    ws = os.path.join(work_dir, "ws")
+    if os.path.exists(ws):
+        shutil.rmtree(ws)
+    with _Timer(stages, "extract", "fmk" if fmk_root else "python") as e:
+        meta = extract_firmware(fmk_root, fw, ws, log_callback=log) if fmk_root else _python_extract(fw, seg, ws)
+    rootfs = os.path.join(ws, "rootfs")
+    with _Timer(stages, "analyze") as e:
+        for s in image["segments"]:
+            smeta, _ = parse_config(s["config"])
+            e["findings"] = len(analyze_firmware_detailed(fw, s["offset"], compute_original_rootfs_span(smeta), log))
+    with _Timer(stages, "snapshot"):
+        orig = snapshot_rootfs(rootfs)
+    e_mod = _modify(rootfs, modify, 7)
+    with _Timer(stages, "diff") as e:
+        added, removed, modified = summarize_changes(orig, rootfs)
+        e["changes"] = len(added) + len(removed) + len(modified)
+        e["edited"] = e_mod
+    with _Timer(stages, "diff_warm"):
+        summarize_changes(orig, rootfs)
+    with _Timer(stages, "predict_sample") as e:
+        est = sample_squashfs_size(rootfs, meta, workers=workers)
+        e["size"], e["low"], e["high"] = est.size, est.low, est.high
+    with _Timer(stages, "predict") as e:
+        e["size"] = estimate_squashfs_size(rootfs, meta, log_callback=log, workers=workers)
+    crcalc = fmk_root and os.path.isfile(os.path.join(fmk_root, "src", "crcalc", "crcalc"))
+    if crcalc:
+        with _Timer(stages, "build", "fmk+python") as e:
+            out = build_firmware(fmk_root, ws, log_callback=log, workers=workers, firmware_path=fw)
+            e["size"] = os.path.getsize(out) if out else None
+    else:
+        skipped["build"] = "no FMK crcalc: timed build_squashfs (SquashFSBuilder + block reuse) instead"
+        with _Timer(stages, "build_squashfs", "python") as e:
+            builder = SquashFSBuilder.from_meta(rootfs, meta, workers=workers)
+            builder.reuse = open_block_reuse(rootfs, meta, fw, log)
+            try:
+                e["size"] = builder.build(os.path.join(ws, "new-filesystem.squashfs"))
+            finally:
+                if builder.reuse:
+                    builder.reuse.close()
+            e["reused_bytes"] = builder.reused_bytes
+    return stages, skipped
+
+def summarize(stages):
+    for entry in stages.values():
+        secs = entry["seconds"]
+        if secs:
+            entry["min"] = min(secs)
+            entry["median"] = round(statistics.median(secs), 4)
+    return stages
+
+def run(profile, work_dir, repeat=1, fmk_root=None, workers=None, log=None):
+    p = dict(PROFILE, **profile)
+    t0 = time.perf_counter()
+    image = generate_image(os.path.join(work_dir, "image"), p)
+    gen = round(time.perf_counter() - t0, 3)
+    stages, skipped = {}, {}
+    for r in range(repeat):
+        one, skipped = run_pipeline(image, os.path.join(work_dir, f"run_{r}"), fmk_root, workers, p["modify"], log)
+        for name, entry in one.items():
+            merged = stages.setdefault(name, {"seconds": []})
+            merged["seconds"] += entry.pop("seconds")
+            merged.update(entry)
+    return {
+        "version": RESULT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "git": _git_head(),
+        "profile": p,
+        "image": {"size": image["size"], "squashfs": image["squashfs"], "generate_seconds": gen,
+                  "segments": [{k: s[k] for k in ("name", "offset", "size", "files")} for s in image["segments"]]},
+        "stages": summarize(stages),
+        "skipped": skipped,
+    }
+
+def coverage(work_dir, seeds, files, size, comps, block_size=131072, workers=None, margin=65536, log=None):
+    """
+    size_sample.estimate() against SquashFSBuilder.build(None) on one generated tree per seed.
+    Returns [{seed, comp, real, size, low, high, inside, safe}]; safe = real <= high + margin, the rule
+    pre_build_warning relies on when it skips the exact pass.
+    """
+    out = []
+    for seed in seeds:
+        root = os.path.join(work_dir, f"rootfs_{seed}")
+        generate_rootfs(root, files, size, seed)
+        for comp in comps:
+            builder = SquashFSBuilder(root, block_size=block_size, compression=comp, workers=workers)
+            real = builder.build(None)
+            est = sample_estimate(SquashFSBuilder(root, block_size=block_size, compression=comp, workers=workers),
+                                  workers=workers)
+            r = {"seed": seed, "comp": comp, "real": real, "size": est.size, "low": est.low, "high": est.high,
+                 "inside": est.low <= real <= est.high, "safe": real <= est.high + margin}
+            out.append(r)
+            if log:
+                log(f"[COVERAGE] seed={seed} {comp:<5} real={real} est={est.size} [{est.low}, {est.high}] "
+                    f"{'ok' if r['inside'] else 'OUTSIDE'}")
+        shutil.rmtree(root, ignore_errors=True)
+    return out
+
+def mksquashfs_gap(work_dir, seeds, files, size, comps, block_size=131072, workers=None, log=None):
+    """
+    Size of SquashFSBuilder.build(None) against a real mksquashfs image of the same generated tree
+    (what estimate_squashfs_breakdown's python prediction is off by when FMK builds the image).
+    Returns [{seed, comp, python, mksquashfs, diff}]; diff = python - mksquashfs.
+    """
+    if not shutil.which("mksquashfs"):
+        raise FileNotFoundError("mksquashfs not found in PATH")
+    out = []
+    for seed in seeds:
+        root = os.path.join(work_dir, f"rootfs_{seed}")
+        generate_rootfs(root, files, size, seed)
+        for comp in comps:
+            img = os.path.join(work_dir, f"{seed}.{comp}.sqsh")
+            make_squashfs(root, img, comp, block_size)
+            real = os.path.getsize(img)
+            os.remove(img)
+            predicted = SquashFSBuilder(root, block_size=block_size, compression=comp, workers=workers).build(None)
+            out.append({"seed": seed, "comp": comp, "python": predicted, "mksquashfs": real, "diff": predicted - real})
+            if log:
+                log(f"[MKSQUASHFS] seed={seed} {comp:<5} python={predicted} mksquashfs={real} "
+                    f"diff={predicted - real:+d} ({(predicted - real) / real:+.2%})")
+        shutil.rmtree(root, ignore_errors=True)
+    return out
+
+def _git_head():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(old, new):
+    """Lines comparing stage medians of two result files (ratio < 1 = faster)."""
+    lines = [f"{'stage':<16}{'old':>10}{'new':>10}{'ratio':>8}"]
+    for name in list(dict.fromkeys(list(old["stages"]) + list(new["stages"]))):
+        a = old["stages"].get(name, {}).get("median")
+        b = new["stages"].get(name, {}).get("median")
+        ratio = f"{b / a:.2f}" if a and b else "-"
+        lines.append(f"{name:<16}{a if a is not None else '-':>10}{b if b is not None else '-':>10}{ratio:>8}")
+    if old.get("profile") != new.get("profile"):
+        lines.append("หมายเหตุ: profile ต่างกัน – เทียบได้ไม่ตรงตัว")
+    return lines
+
+def _size_arg(text):
+    units = {"K": 1024, "M": 1048576, "G": 1073741824}
+    return int(float(text[:-1]) * units[text[-1].upper()]) if text[-1:].upper() in units else int(text)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Synthetic firmware benchmark (extract / analyze / diff / predict / build)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("run", "gen"):
+        sp = sub.add_parser(name)
+        if name == "gen":
+            sp.add_argument("out_dir")
+        sp.add_argument("--files", type=int, default=PROFILE["files"])
+        sp.add_argument("--size", type=_size_arg, default=PROFILE["size"], help="rootfs bytes, e.g. 64M")
+        sp.add_argument("--segments", type=int, default=PROFILE["segments"])
+        sp.add_argument("--header", choices=("uimage", "trx"), default=PROFILE["header"])
+        sp.add_argument("--comp", choices=("gzip", "xz", "lzma"), default=PROFILE["comp"])
+        sp.add_argument("--block-size", type=_size_arg, default=PROFILE["block_size"])
+        sp.add_argument("--kernel", type=_size_arg, default=PROFILE["kernel"])
+        sp.add_argument("--seed", type=int, default=PROFILE["seed"])
+        if name == "run":
+            sp.add_argument("--modify", type=int, default=PROFILE["modify"], help="files edited before diff / build")
+            sp.add_argument("--repeat", type=int, default=1)
+            sp.add_argument("--fmk", help="firmware-mod-kit root (default: config.yaml fmk.root / FMK_PATH)")
+            sp.add_argument("--no-fmk", action="store_true", help="python extract / build_squashfs even if FMK exists")
+            sp.add_argument("-j", "--workers", type=int, default=None)
+            sp.add_argument("--work", default=os.path.join("workspaces", "bench"),
+                            help="parent directory; each run works in a new subdirectory of it")
+            sp.add_argument("--keep", action="store_true", help="keep the run's subdirectory")
+            sp.add_argument("-o", "--output", default="-", help="result JSON ('-' = stdout)")
+    cp = sub.add_parser("compare")
+    cp.add_argument("old")
+    cp.add_argument("new")
+    cv = sub.add_parser("coverage", help="size_sample interval vs the real build(None) size over several seeds")
+    cv.add_argument("--seeds", type=int, default=5)
+    cv.add_argument("--files", type=int, default=PROFILE["files"])
+    cv.add_argument("--size", type=_size_arg, default=PROFILE["size"])
+    cv.add_argument("--comp", default="gzip,xz", help="comma separated codecs")
+    cv.add_argument("--block-size", type=_size_arg, default=PROFILE["block_size"])
+    cv.add_argument("--margin", type=_size_arg, default=65536,
+                    help="slack pre_build_warning adds to the upper bound before skipping the exact pass")
+    cv.add_argument("-j", "--workers", type=int, default=None)
+    cv.add_argument("--work", default=os.path.join("workspaces", "bench"),
+                    help="parent directory; the trees go in a new subdirectory of it")
+    mk = sub.add_parser("mksquashfs", help="SquashFSBuilder size vs real mksquashfs over several seeds")
+    mk.add_argument("--seeds", type=int, default=3)
+    mk.add_argument("--files", type=int, default=PROFILE["files"])
+    mk.add_argument("--size", type=_size_arg, default=PROFILE["size"])
+    mk.add_argument("--comp", default="gzip,xz", help="comma separated codecs")
+    mk.add_argument("--block-size", type=_size_arg, default=PROFILE["block_size"])
+    mk.add_argument("-j", "--workers", type=int, default=None)
+    mk.add_argument("--work", default=os.path.join("workspaces", "bench"),
+                    help="parent directory; the trees go in a new subdirectory of it")
+    a = ap.parse_args(argv)
+
+    if a.cmd == "compare":
+        with open(a.old, encoding="utf-8") as f1, open(a.new, encoding="utf-8") as f2:
+            print("\n".join(compare(json.load(f1), json.load(f2))))
+        return 0
+    if a.cmd == "coverage":
+        os.makedirs(a.work, exist_ok=True)
+        work = tempfile.mkdtemp(prefix="coverage_", dir=a.work)
+        try:
+            results = coverage(work, range(1, a.seeds + 1), a.files, a.size, a.comp.split(","), a.block_size,
+                               a.workers, a.margin, log=lambda msg: print(msg, file=sys.stderr))
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        print(json.dumps(results, indent=1))
+        inside = sum(r["inside"] for r in results)
+        print(f"[COVERAGE] {inside}/{len(results)} inside the interval, "
+              f"{sum(not r['safe'] for r in results)} above high + margin", file=sys.stderr)
+        return 0 if all(r["safe"] for r in results) else 1
+    if a.cmd == "mksquashfs":
+        os.makedirs(a.work, exist_ok=True)
+        work = tempfile.mkdtemp(prefix="mksquashfs_", dir=a.work)
+        try:
+            results = mksquashfs_gap(work, range(1, a.seeds + 1), a.files, a.size, a.comp.split(","),
+                                     a.block_size, a.workers, log=lambda msg: print(msg, file=sys.stderr))
+        except FileNotFoundError as e:
+            ap.error(str(e))
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        print(json.dumps(results, indent=1))
+        return 0
+    profile = {"files": a.files, "size": a.size, "segments": a.segments, "header": a.header, "comp": a.comp,
+               "block_size": a.block_size, "kernel": a.kernel, "seed": a.seed}
+    if a.cmd == "gen":
+        image = generate_image(a.out_dir, profile)
+        print(json.dumps({k: image[k] for k in ("firmware", "size", "squashfs")}))
+        return 0
+    profile["modify"] = a.modify
+    fmk_root = None
+    if not a.no_fmk:
+        from fw_batch import load_config
+        fmk_root = locate_fmk(a.fmk or load_config().get("fmk", {}).get("root"))
+    log = lambda msg: print(msg, file=sys.stderr)
+    # never delete what --work names (a typo like --work . would wipe real data): own a fresh subdirectory
+    os.makedirs(a.work, exist_ok=True)
+    work = tempfile.mkdtemp(prefix="run_", dir=a.work)
+    try:
+        result = run(profile, work, a.repeat, fmk_root, a.workers, log)
+    finally:
+        if a.keep:
+            log(f"[BENCH] work directory: {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    text = json.dumps(result, ensure_ascii=False, indent=1)
+    if a.output == "-":
+        print(text)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(a.output)), exist_ok=True)
+        with open(a.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    for name, entry in result["stages"].items():
+        log(f"[BENCH] {name:<16} {entry.get('median', '-'):>8}s  {entry.get('impl', '')}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Workspace catalog (SQLite, WAL): image / workspace / segment / metadata / findings / build output
+บันทึกทันทีที่เกิดขึ้น (GUI + fw_batch) ค้นย้อนหลังได้โดยไม่ต้องเดิน workspaces/ หรือ parse config.log ใหม่
+
+  python catalog.py query --meta FS_COMPRESSION=lzma --finding "Telnet enabled"
+  python catalog.py query --meta FS_COMPRESSION=xz --finding-like "%ไม่มีรหัส%" --json
+  python catalog.py import workspaces/          # เติม workspace ที่มีอยู่ก่อนเปิดใช้ catalog
+  python catalog.py stats
+
+  with Catalog("workspaces/.catalog.sqlite") as cat:
+      ws = cat.record_workspace("workspaces/ws_a", image="fw.bin", mode="single")
+      cat.record_segment(ws, "rootfs", meta)
+      cat.record_findings(ws, "rootfs", findings)
+      rows = cat.find_segments(meta={"FS_COMPRESSION": "lzma"}, findings=["Telnet enabled"])
+
+- ค่า meta เก็บเป็นข้อความ (str ของค่าจาก parse_config) index ที่ (key, value) -> query ด้วย meta ไม่ scan ทั้งตาราง
+- findings index ที่ข้อความ (ตรงตัว) ; findings ระดับ image (boot delay) ใช้ segment ""
+- WAL: GUI / CLI อ่านได้ระหว่างที่ batch เขียน; ผู้เขียนรอกันเอง (busy_timeout)
+"""
+
+import os, sys, json, time, sqlite3, argparse
+
+from fmk_integration import parse_config, compute_original_rootfs_span
+from hashing import file_digests
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images(
+    id INTEGER PRIMARY KEY, sha256 TEXT UNIQUE, md5 TEXT, size INTEGER, path TEXT, seen REAL);
+CREATE TABLE IF NOT EXISTS workspaces(
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, image_id INTEGER REFERENCES images(id),
+    mode TEXT, created REAL, updated REAL);
+CREATE TABLE IF NOT EXISTS segments(
+    id INTEGER PRIMARY KEY, workspace_id INTEGER NOT NULL REFERENCES workspaces(id) ON DELETE CASCADE,
+    name TEXT NOT NULL, offset INTEGER, size INTEGER, UNIQUE(workspace_id, name));
+CREATE TABLE IF NOT EXISTS meta(
+    segment_id INTEGER NOT NULL REFERENCES segments(id) ON DELETE CASCADE,
+    key TEXT NOT NULL, value TEXT, PRIMARY KEY(segment_id, key)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS meta_kv ON meta(key, value);
+CREATE TABLE IF NOT EXISTS findings(
+    segment_id INTEGER NOT NULL REFERENCES segments(id) ON DELETE CASCADE, text TEXT NOT NULL, recorded REAL);
+CREATE INDEX IF NOT EXISTS findings_text ON findings(text, segment_id);
+CREATE INDEX IF NOT EXISTS findings_segment ON findings(segment_id);
+CREATE TABLE IF NOT EXISTS builds(
+    id INTEGER PRIMARY KEY, workspace_id INTEGER NOT NULL REFERENCES workspaces(id) ON DELETE CASCADE,
+    output TEXT, sha256 TEXT, size INTEGER, engine TEXT, built REAL);
+CREATE INDEX IF NOT EXISTS builds_workspace ON builds(workspace_id);
+"""
+
+IMAGE_SEGMENT = ""      # findings of the whole image (boot delay, ...)
+
+class Catalog:
+    def __init__(self, db_path):
+        d = os.path.dirname(db_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    # ---------- recording ----------
+    def record_image(self, path, digests=None):
+        """Image row by content (sha256); digests = {"sha256", "md5"} when already known."""
+        if digests is None:
+            digests = file_digests(path, ("sha256", "md5"))
+        size = os.path.getsize(path) if os.path.isfile(path) else None
+        with self.conn:
+            self.conn.execute("""INSERT INTO images(sha256, md5, size, path, seen) VALUES (?,?,?,?,?)
+                                 ON CONFLICT(sha256) DO UPDATE SET path=excluded.path, seen=excluded.seen""",
+                              (digests["sha256"], digests.get("md5"), size, os.path.abspath(path), time.time()))
+        return self.conn.execute("SELECT id FROM images WHERE sha256=?", (digests["sha256"],)).fetchone()[0]
+
+    def record_workspace(self, ws_path, image=None, mode=None, digests=None):
+        """Workspace row (keyed by absolute path); image = firmware path it was extracted from."""
+        image_id = self.record_image(image, digests) if image and (digests or os.path.isfile(image)) else None
+        now = time.time()
+        with self.conn:
+            self.conn.execute("""INSERT INTO workspaces(path, image_id, mode, created, updated) VALUES (?,?,?,?,?)
+                                 ON CONFLICT(path) DO UPDATE SET
+                                     image_id=COALESCE(excluded.image_id, image_id),
+                                     mode=COALESCE(excluded.mode, mode), updated=excluded.updated""",
+                              (os.path.abspath(ws_path), image_id, mode, now, now))
+        return self._workspace_id(ws_path)
+
+    def _workspace_id(self, ws):
+        if isinstance(ws, int):
+            return ws
+        row = self.conn.execute("SELECT id FROM workspaces WHERE path=?", (os.path.abspath(ws),)).fetchone()
+        return row[0] if row else self.record_workspace(ws)
+
+    def _segment_id(self, ws, name):
+        ws_id = self._workspace_id(ws)
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO segments(workspace_id, name) VALUES (?,?)", (ws_id, name))
+        return self.conn.execute("SELECT id FROM segments WHERE workspace_id=? AND name=?",
+                                 (ws_id, name)).fetchone()[0]
+
+    def record_segment(self, ws, name, meta, offset=None, size=None):
+        """Segment + its config.log metadata (replaces earlier values). offset / size default from meta."""
+        seg_id = self._segment_id(ws, name)
+        if offset is None:
+            offset = meta.get("FS_OFFSET")
+        if size is None:
+            size = compute_original_rootfs_span(meta)
+        with self.conn:
+            self.conn.execute("UPDATE segments SET offset=?, size=? WHERE id=?", (offset, size, seg_id))
+            self.conn.execute("DELETE FROM meta WHERE segment_id=?", (seg_id,))
+            self.conn.executemany("INSERT INTO meta VALUES (?,?,?)",
+                                  [(seg_id, k, str(v)) for k, v in meta.items()])
+        return seg_id
+
+    def record_findings(self, ws, name, findings):
+        """Replace the findings of one segment (name IMAGE_SEGMENT = image-level findings)."""
+        seg_id = self._segment_id(ws, name)
+        now = time.time()
+        with self.conn:
+            self.conn.execute("DELETE FROM findings WHERE segment_id=?", (seg_id,))
+            self.conn.executemany("INSERT INTO findings VALUES (?,?,?)",
+                                  [(seg_id, text, now) for text in dict.fromkeys(findings)])
+
+    def record_build(self, ws, output, engine=None):
+        digests = file_digests(output, ("sha256",)) if os.path.isfile(output) else {}
+        size = os.path.getsize(output) if digests else None
+        with self.conn:
+            self.conn.execute("INSERT INTO builds(workspace_id, output, sha256, size, engine, built) "
+                              "VALUES (?,?,?,?,?,?)",
+                              (self._workspace_id(ws), os.path.abspath(output), digests.get("sha256"),
+                               size, engine, time.time()))
+
+    def record_batch(self, rec):
+        """Everything a fw_batch report record knows (workspace = the image path when not kept)."""
+        if rec.get("status") != "ok" or "sha256" not in rec:
+            return None
+        ws = rec.get("workspace") or rec["firmware"]
+        ws_id = self.record_workspace(ws, rec["firmware"], mode=rec.get("extract") or "scan",
+                                      digests={"sha256": rec["sha256"], "md5": rec.get("md5")})
+        if rec.get("boot"):
+            self.record_findings(ws_id, IMAGE_SEGMENT, rec["boot"])
+        for seg in rec.get("segments", []):
+            self.record_segment(ws_id, seg["name"], seg.get("meta", {}), seg.get("offset"), seg.get("size"))
+            self.record_findings(ws_id, seg["name"], seg.get("findings", []))
+        return ws_id
+
+    def forget(self, ws):
+        """Drop a deleted workspace (segments / meta / findings / builds cascade)."""
+        with self.conn:
+            self.conn.execute("DELETE FROM workspaces WHERE path=?", (os.path.abspath(ws),))
+
+    # ---------- queries ----------
+    def find_segments(self, meta=None, findings=(), findings_like=(), limit=None):
+        """
+        Segments whose metadata has every meta {key: value} and that have every finding (exact text)
+        and a finding LIKE each pattern. Returns [{workspace, segment, offset, size, image, sha256, mode}].
+        """
+        sql = ["""SELECT w.path, s.name, s.offset, s.size, i.path, i.sha256, w.mode
+                  FROM segments s JOIN workspaces w ON w.id = s.workspace_id
+                  LEFT JOIN images i ON i.id = w.image_id WHERE 1"""]
+        args = []
+        for k, v in (meta or {}).items():
+            sql.append("AND s.id IN (SELECT segment_id FROM meta WHERE key=? AND value=?)")
+            args += [k, str(v)]
+        for text in findings:
+            sql.append("AND s.id IN (SELECT segment_id FROM findings WHERE text=?)")
+            args.append(text)
+        for pattern in findings_like:
+            sql.append("AND s.id IN (SELECT segment_id FROM findings WHERE text LIKE ?)")
+            args.append(pattern)
+        sql.append("ORDER BY w.path, s.name")
+        if limit:
+            sql.append("LIMIT ?")
+            args.append(int(limit))
+        keys = ("workspace", "segment", "offset", "size", "image", "sha256", "mode")
+        return [dict(zip(keys, row)) for row in self.conn.execute(" ".join(sql), args)]
+
+    def segment_meta(self, ws, name):
+        return dict(self.conn.execute("""SELECT m.key, m.value FROM meta m JOIN segments s ON s.id = m.segment_id
+                                         JOIN workspaces w ON w.id = s.workspace_id
+                                         WHERE w.path=? AND s.name=?""", (os.path.abspath(ws), name)))
+
+    def segment_findings(self, ws, name):
+        return [r[0] for r in self.conn.execute("""SELECT f.text FROM findings f
+                                                   JOIN segments s ON s.id = f.segment_id
+                                                   JOIN workspaces w ON w.id = s.workspace_id
+                                                   WHERE w.path=? AND s.name=? ORDER BY f.rowid""",
+                                                (os.path.abspath(ws), name))]
+
+    def stats(self):
+        return {t: self.conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                for t in ("images", "workspaces", "segments", "findings", "builds")}
+
+    # ---------- backfill ----------
+    def import_workspaces(self, root, log_callback=None):
+        """Record workspaces already on disk under root (FMK logs/config.log, single or multi-squash)."""
+        n = 0
+        for entry in sorted(os.scandir(root), key=lambda e: e.name):
+            conf = os.path.join(entry.path, "logs", "config.log")
+            if not entry.is_dir() or not os.path.isfile(conf):
+                continue
+            meta, extra = parse_config(conf)
+            seg_dirs = [p for p in extra if os.path.isdir(p)]
+            # config.log does not name the source image: image stays unknown until the workspace is re-extracted
+            ws_id = self.record_workspace(entry.path, mode="multi" if seg_dirs else "single")
+            if seg_dirs:
+                for seg_dir in seg_dirs:
+                    seg_meta, _ = parse_config(os.path.join(seg_dir, "logs", "config.log"))
+                    self.record_segment(ws_id, os.path.basename(os.path.normpath(seg_dir)), seg_meta)
+            else:
+                self.record_segment(ws_id, "rootfs", meta)
+            n += 1
+            if log_callback:
+                log_callback(f"[CATALOG] {entry.path}: {len(seg_dirs) or 1} segment")
+        return n
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Query / fill the workspace catalog")
+    ap.add_argument("--db", default=None, help="catalog database (default: config.yaml catalog.path)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    q = sub.add_parser("query", help="segments matching metadata / findings")
+    q.add_argument("--meta", action="append", default=[], metavar="KEY=VALUE")
+    q.add_argument("--finding", action="append", default=[], metavar="TEXT", help="exact finding text")
+    q.add_argument("--finding-like", action="append", default=[], metavar="PATTERN", help="SQL LIKE pattern")
+    q.add_argument("--limit", type=int, default=None)
+    q.add_argument("--json", action="store_true")
+    imp = sub.add_parser("import", help="record existing workspaces")
+    imp.add_argument("roots", nargs="+")
+    sub.add_parser("stats")
+    a = ap.parse_args(argv)
+
+    db = a.db
+    if db is None:
+        from fw_batch import load_config
+        db = load_config().get("catalog", {}).get("path") or os.path.join("workspaces", ".catalog.sqlite")
+    with Catalog(db) as cat:
+        if a.cmd == "query":
+            meta = {}
+            for kv in a.meta:
+                if "=" not in kv:
+                    ap.error(f"--meta expects KEY=VALUE: {kv}")
+                k, v = kv.split("=", 1)
+                meta[k] = v
+            rows = cat.find_segments(meta, a.finding, a.finding_like, a.limit)
+            for row in rows:
+                if a.json:
+                    print(json.dumps(row, ensure_ascii=False))
+                else:
+                    print(f"{row['workspace']}\t{row['segment']}\t{row['image'] or '-'}")
+            return 0 if rows else 1
+        if a.cmd == "import":
+            log = lambda msg: print(msg, file=sys.stderr)
+            n = sum(cat.import_workspaces(root, log) for root in a.roots)
+            print(f"[CATALOG] imported {n} workspaces", file=sys.stderr)
+            return 0
+        print(json.dumps(cat.stats()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
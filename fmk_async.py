@@ -0,0 +1,235 @@
+"""
+asyncio API ของ fmk_integration: ขับ FMK job จำนวนมากจาก process / event loop เดียว (ไม่มี thread ต่อ job)
+
+  jobs = FMKJobs(fmk_root, max_jobs=8, timeout=1800, log_callback=buf)
+  metas = await asyncio.gather(*(jobs.extract(fw, ws) for fw, ws in pairs), return_exceptions=True)
+  out = await jobs.build("workspaces/ws_a", engine="fmk")
+  task.cancel()                                    # kill ทั้ง process group ของ script นั้น
+
+  python fmk_async.py extract a.bin b.bin c.bin -j 8 --timeout 900
+  python fmk_async.py build workspaces/ws_a workspaces/ws_b --engine fmk
+  python fmk_async.py predict workspaces/ws_a workspaces/ws_b
+
+- run_cmd_async(): asyncio.create_subprocess_exec ใน session / process group ใหม่ อ่าน output ทีละ 64 KB
+  แล้วส่งต่อ log_callback แบบเดียวกับ run_cmd (write_lines เป็นชุด หรือทีละบรรทัด)
+- timeout / cancel: SIGTERM ทั้ง group, รอ KILL_GRACE วินาที แล้ว SIGKILL – script ของ FMK เรียก unsquashfs /
+  mksquashfs ต่ออีกชั้น, kill แค่ shell จะเหลือ process ลูกค้างอยู่
+- FMKJobs จำกัดจำนวน job พร้อมกันด้วย semaphore: subprocess (extract / build script / IPK) = max_jobs,
+  งาน Python ที่ใช้ทุก core อยู่แล้ว (build engine python, predict) = max_cpu_jobs (ค่าเริ่มต้น 1)
+  งาน Python รันใน thread ของ executor: cancel แล้ว await คืนทันที แต่งานที่เริ่มไปแล้วทำต่อจนจบเบื้องหลัง
+- use_sudo: group ของ script เป็นของ root – signal ถึงเฉพาะตัว sudo ซึ่งส่งต่อให้ script
+"""
+
+import os, sys, json, time, shutil, signal, asyncio, argparse, functools
+
+from fmk_integration import (FMKError, locate_fmk, extract_cmd, workspace_meta, multisquash_cmd,
+                             multisquash_segments, build_cmd, build_firmware_python, new_firmware_path,
+                             ipk_cmd, estimate_squashfs_size)
+from rebuild_squashfs import SquashFSError
+from log_pipeline import LineSplitter, READ_CHUNK, DEBUG
+
+KILL_GRACE = 5.0      # seconds between SIGTERM and SIGKILL of a timed-out / cancelled job
+
+# -------------------------------------------------
+# Run command
+# -------------------------------------------------
+async def _pump(proc, log_callback):
+    write_lines = getattr(log_callback, "write_lines", None)
+    splitter = LineSplitter()
+    while True:
+        data = await proc.stdout.read(READ_CHUNK)
+        lines = splitter.feed(data) if data else splitter.finish()
+        if write_lines and lines:
+            write_lines(lines, DEBUG)
+        elif log_callback:
+            for line in lines:
+                log_callback(line)
+        if not data:
+            break
+    return await proc.wait()
+
+async def _kill_group(proc):
+    """SIGTERM the job's process group, SIGKILL whatever is left after KILL_GRACE."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        if proc.returncode is not None:
+            return
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        except PermissionError:      # sudo: only sudo itself is ours; it relays the signal
+            proc.send_signal(sig)
+        try:
+            await asyncio.wait_for(proc.wait(), KILL_GRACE)
+            return
+        except asyncio.TimeoutError:
+            continue
+
+async def run_cmd_async(cmd, cwd=None, log_callback=None, use_sudo=False, check=True, timeout=None):
+    """run_cmd for asyncio; timeout (seconds) or cancellation kills the whole process group."""
+    if use_sudo and os.geteuid()!=0 and shutil.which("sudo"):
+        cmd = ["sudo"] + cmd
+    if log_callback:
+        log_callback(f"[FMK] RUN: {' '.join(cmd)}")
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.STDOUT, cwd=cwd,
+                                                start_new_session=True)
+    try:
+        rc = await asyncio.wait_for(_pump(proc, log_callback), timeout)
+    except asyncio.TimeoutError:
+        await _kill_group(proc)
+        raise FMKError(f"Command timed out after {timeout}s: {' '.join(cmd)}")
+    except BaseException:            # CancelledError / KeyboardInterrupt: don't leave the script running
+        await _kill_group(proc)
+        raise
+    if check and rc!=0:
+        raise FMKError(f"Command failed: {' '.join(cmd)} (rc={rc})")
+    return rc
+
+# -------------------------------------------------
+# Bounded job API
+# -------------------------------------------------
+class FMKJobs:
+    """
+    Async counterparts of extract_firmware / extract_multisquash / build_firmware / build_multisquash /
+    install_ipk / remove_ipk / estimate_squashfs_size with bounded concurrency, per-job timeout and cancel.
+    log_callback: default sink of every job (a job's own log_callback overrides it).
+    """
+    def __init__(self, fmk_root, max_jobs=None, max_cpu_jobs=1, timeout=None, log_callback=None, use_sudo=False):
+        self.fmk_root = fmk_root
+        self.timeout = timeout
+        self.log_callback = log_callback
+        self.use_sudo = use_sudo
+        self._procs = asyncio.Semaphore(max_jobs or os.cpu_count() or 1)
+        self._cpu = asyncio.Semaphore(max_cpu_jobs or 1)
+
+    async def _run(self, cmd, log_callback, use_sudo=None, check=True):
+        async with self._procs:
+            return await run_cmd_async(cmd, cwd=self.fmk_root, log_callback=log_callback or self.log_callback,
+                                       use_sudo=self.use_sudo if use_sudo is None else use_sudo,
+                                       check=check, timeout=self.timeout)
+
+    async def _call(self, fn, *args, **kwargs):
+        async with self._cpu:
+            loop = asyncio.get_running_loop()
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(None, functools.partial(fn, *args, **kwargs)),
+                                              self.timeout)
+            except asyncio.TimeoutError:     # an OSError on 3.11+: must not look like "builder not usable"
+                raise FMKError(f"{fn.__name__} timed out after {self.timeout}s")
+
+    async def extract(self, firmware_path, workspace_dir, log_callback=None, use_sudo=None):
+        await self._run(extract_cmd(self.fmk_root, firmware_path, workspace_dir), log_callback, use_sudo)
+        return workspace_meta(workspace_dir)
+
+    async def extract_multisquash(self, firmware_path, workspace_dir, log_callback=None):
+        await self._run(multisquash_cmd(self.fmk_root, firmware_path, workspace_dir), log_callback, False)
+        return multisquash_segments(workspace_dir)
+
+    async def build(self, workspace_dir, nopad=False, minblk=False, engine="auto", workers=None,
+                    firmware_path=None, build_overrides=None, log_callback=None, use_sudo=None):
+        """Same engine selection as build_firmware (python first for auto, build-firmware.sh as fallback)."""
+        if not os.path.isdir(workspace_dir):
+            raise FMKError("Workspace not found.")
+        log = log_callback or self.log_callback
+        if engine in ("auto","python"):
+            try:
+                return await self._call(build_firmware_python, self.fmk_root, workspace_dir, nopad=nopad,
+                                        minblk=minblk, log_callback=log, workers=workers,
+                                        firmware_path=firmware_path, build_overrides=build_overrides)
+            except (SquashFSError, OSError) as e:
+                if engine=="python":
+                    raise FMKError(f"Python SquashFS build failed: {e}")
+                if log:
+                    log(f"[FMK] Python builder not usable ({e}), fallback to build-firmware.sh")
+        await self._run(build_cmd(self.fmk_root, "build-firmware.sh", workspace_dir, nopad, minblk), log, use_sudo)
+        return new_firmware_path(workspace_dir)
+
+    async def build_multisquash(self, workspace_dir, nopad=False, minblk=False, log_callback=None):
+        await self._run(build_cmd(self.fmk_root, "build-multisquashfs-firmware.sh", workspace_dir, nopad, minblk),
+                        log_callback, False)
+        return new_firmware_path(workspace_dir)
+
+    async def install_ipk(self, workspace_dir, ipk_path, log_callback=None):
+        await self._run(ipk_cmd(self.fmk_root, "ipkg_install.sh", workspace_dir, ipk_path), log_callback, False)
+
+    async def remove_ipk(self, workspace_dir, ipk_path, log_callback=None):
+        await self._run(ipk_cmd(self.fmk_root, "ipkg_remove.sh", workspace_dir, ipk_path), log_callback, False)
+
+    async def predict(self, rootfs_dir, meta, log_callback=None, **kwargs):
+        """estimate_squashfs_size (kwargs: engine, workers, cache_path, firmware_path, build_overrides)."""
+        return await self._call(estimate_squashfs_size, rootfs_dir, meta,
+                                log_callback=log_callback or self.log_callback, **kwargs)
+
+# -------------------------------------------------
+# CLI: many jobs from one process
+# -------------------------------------------------
+def _prefixed(name):
+    def log(line):
+        print(f"[{name}] {line}", file=sys.stderr)
+    return log
+
+async def _run_jobs(a, fmk_root):
+    jobs = FMKJobs(fmk_root, max_jobs=a.workers, timeout=a.timeout, use_sudo=a.sudo)
+
+    async def one(target):
+        target = os.path.abspath(target)       # FMK scripts run with cwd = fmk_root
+        name = os.path.basename(os.path.normpath(target))
+        log = _prefixed(name) if a.verbose else None
+        t = time.perf_counter()
+        rec = {"target": target, "status": "ok"}
+        try:
+            if a.cmd == "extract":
+                ws = os.path.abspath(os.path.join(a.workspaces, os.path.splitext(name)[0]))
+                rec["workspace"] = ws
+                if a.multi:
+                    rec["segments"] = [s["name"] for s in await jobs.extract_multisquash(target, ws, log)]
+                else:
+                    rec["meta"] = await jobs.extract(target, ws, log)
+            elif a.cmd == "build":
+                rec["output"] = await jobs.build(target, nopad=a.nopad, minblk=a.min, engine=a.engine,
+                                                 log_callback=log)
+            else:
+                rec["size"] = await jobs.predict(os.path.join(target, "rootfs"), workspace_meta(target), log)
+        except (FMKError, SquashFSError, OSError) as e:
+            rec["status"] = "error"
+            rec["error"] = f"{type(e).__name__}: {e}"
+        rec["seconds"] = round(time.perf_counter() - t, 2)
+        print(json.dumps(rec, ensure_ascii=False, default=str), flush=True)
+        return rec
+
+    return await asyncio.gather(*(one(t) for t in a.targets))
+
+def main(argv=None):
+    from fw_batch import load_config
+    cfg = load_config()
+    ap = argparse.ArgumentParser(description="Run many FMK jobs concurrently from one process (JSON line per job)")
+    ap.add_argument("cmd", choices=("extract", "build", "predict"))
+    ap.add_argument("targets", nargs="+", help="firmware images (extract) or workspaces (build / predict)")
+    fmk = cfg.get("fmk", {})
+    ap.add_argument("-j", "--workers", type=int, default=fmk.get("max_jobs", 0) or None,
+                    help="concurrent FMK scripts (default: config.yaml fmk.max_jobs, 0 = all cores)")
+    ap.add_argument("--timeout", type=float, default=fmk.get("timeout", 0) or None,
+                    help="seconds per job, then its process group is killed (default: fmk.timeout)")
+    ap.add_argument("--fmk", help="firmware-mod-kit root (default: config.yaml fmk.root / FMK_PATH)")
+    ap.add_argument("--sudo", action="store_true", help="run FMK scripts with sudo")
+    ap.add_argument("--workspaces", default=os.path.join("workspaces", "async"), help="extract: parent directory")
+    ap.add_argument("--multi", action="store_true", help="extract: use extract-multisquashfs-firmware.sh")
+    ap.add_argument("--engine", choices=("auto", "python", "fmk"), default=cfg.get("build", {}).get("engine", "auto"))
+    ap.add_argument("--nopad", action="store_true")
+    ap.add_argument("--min", action="store_true")
+    ap.add_argument("-v", "--verbose", action="store_true", help="stream every job's output to stderr")
+    a = ap.parse_args(argv)
+
+    fmk_root = locate_fmk(a.fmk or fmk.get("root"))
+    if fmk_root is None and a.cmd != "predict":
+        ap.error("firmware-mod-kit not found (use --fmk)")
+    try:
+        recs = asyncio.run(_run_jobs(a, fmk_root))
+    except KeyboardInterrupt:       # asyncio.run cancelled every job: their process groups are gone
+        print("[ASYNC] interrupted", file=sys.stderr)
+        return 130
+    return 0 if all(r["status"] == "ok" for r in recs) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,12 @@
 import os, subprocess, shutil, re, tempfile
+import fs_index, tracing
+
+from rebuild_squashfs import SquashFSBuilder, SquashFSError, BlockReuse
+from squashfs_reader import SquashFSImage
+from size_cache import SizeCache
+from size_sample import estimate as sample_estimate, SAMPLE_BYTES
+from fs_utils import copy_region
+from log_pipeline import read_lines, DEBUG
 
 class FMKError(Exception):
     pass
@@ -74,15 +82,32 @@ def parse_config(config_path):
 # Run command
 # -------------------------------------------------
 def run_cmd(cmd, cwd=None, log_callback=None, use_sudo=False, check=True):
+    """
+    Output is read in 64 KB chunks; a log_callback with write_lines (log_pipeline.LogBuffer)
+    receives each chunk as one batch at DEBUG level, any other callable gets one call per line.
+    """
+    label = os.path.basename(cmd[0])
     if use_sudo and os.geteuid()!=0 and shutil.which("sudo"):
         cmd = ["sudo"] + cmd
     if log_callback:
         log_callback(f"[FMK] RUN: {' '.join(cmd)}")
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, cwd=cwd)
-    for line in proc.stdout:
-        if log_callback:
-            log_callback(line.rstrip())
-    proc.wait()
+    with tracing.span(label, cat="subprocess", cmd=" ".join(cmd)[:500]) as sp:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
+        write_lines = getattr(log_callback, "write_lines", None)
+        for lines in read_lines(proc.stdout):
+            if write_lines:
+                write_lines(lines, DEBUG)
+            elif log_callback:
+                for line in lines:
+                    log_callback(line.rstrip())
+        proc.stdout.close()
+        if tracing.enabled():
+            # reap it ourselves to get the child's rusage (Popen.wait() discards it)
+            _, status, ru = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            sp.set(rc=proc.returncode, **tracing.rusage_args(ru))
+        else:
+            proc.wait()
     if check and proc.returncode!=0:
         raise FMKError(f"Command failed: {' '.join(cmd)} (rc={proc.returncode})")
     return proc.returncode
@@ -90,7 +115,8 @@ def run_cmd(cmd, cwd=None, log_callback=None, use_sudo=False, check=True):
 # -------------------------------------------------
 # Single-firmware extract / build
 # -------------------------------------------------
-def extract_firmware(fmk_root, firmware_path, workspace_dir, log_callback=None, use_sudo="auto"):
+def extract_cmd(fmk_root, firmware_path, workspace_dir):
+    """Checks + command line of extract-firmware.sh (shared by extract_firmware and fmk_async)."""
     if not os.path.isdir(fmk_root):
         raise FMKError("FMK root not found.")
     script = os.path.join(fmk_root,"extract-firmware.sh")
@@ -100,31 +126,159 @@ def extract_firmware(fmk_root, firmware_path, workspace_dir, log_callback=None,
     if os.path.exists(workspace_dir):
         raise FMKError(f"Workspace already exists: {workspace_dir}")
     os.makedirs(os.path.dirname(workspace_dir), exist_ok=True)
-    sudo_flag = (use_sudo is True)
-    run_cmd([script, firmware_path, workspace_dir], cwd=fmk_root, log_callback=log_callback, use_sudo=sudo_flag)
-    config_path = os.path.join(workspace_dir,"logs","config.log")
-    meta, _ = parse_config(config_path)
+    return [script, firmware_path, workspace_dir]
+
+def workspace_meta(workspace_dir):
+    meta, _ = parse_config(os.path.join(workspace_dir,"logs","config.log"))
     return meta
 
+def new_firmware_path(workspace_dir):
+    out_path = os.path.join(workspace_dir, "new-firmware.bin")
+    return out_path if os.path.isfile(out_path) else None
+
+@tracing.traced("fmk")
+def extract_firmware(fmk_root, firmware_path, workspace_dir, log_callback=None, use_sudo="auto"):
+    cmd = extract_cmd(fmk_root, firmware_path, workspace_dir)
+    sudo_flag = (use_sudo is True)
+    run_cmd(cmd, cwd=fmk_root, log_callback=log_callback, use_sudo=sudo_flag)
+    return workspace_meta(workspace_dir)
+
+@tracing.traced("fmk")
 def build_firmware(fmk_root, workspace_dir, nopad=False, minblk=False,
-                   log_callback=None, use_sudo="auto"):
-    script = os.path.join(fmk_root,"build-firmware.sh")
-    ensure_executable(script)
+                   log_callback=None, use_sudo="auto", engine="auto", workers=None,
+                   firmware_path=None, build_overrides=None):
+    """
+    engine: "fmk"    -> build-firmware.sh (mksquashfs + header/footer + crcalc)
+            "python" -> in-process SquashFSBuilder, then assemble like build-firmware.sh
+            "auto"   -> python when the segment is supported, otherwise fmk
+    firmware_path: the original firmware (python engine copies unchanged files' compressed
+    blocks from it when image_parts/rootfs.img is not there - see open_block_reuse)
+    build_overrides: SquashFSBuilder settings replacing config.log's (python engine only,
+    e.g. size_fit.build_overrides() of a find_fit() result)
+    """
     if not os.path.isdir(workspace_dir):
         raise FMKError("Workspace not found.")
+    if engine in ("auto","python"):
+        try:
+            return build_firmware_python(fmk_root, workspace_dir, nopad=nopad, minblk=minblk,
+                                          log_callback=log_callback, workers=workers,
+                                          firmware_path=firmware_path, build_overrides=build_overrides)
+        except (SquashFSError, OSError) as e:
+            if engine=="python":
+                raise FMKError(f"Python SquashFS build failed: {e}")
+            if log_callback:
+                log_callback(f"[FMK] Python builder not usable ({e}), fallback to build-firmware.sh")
+                if build_overrides:
+                    log_callback(f"[FMK] build-firmware.sh ignores {build_overrides}")
+    sudo_flag = (use_sudo is True)
+    run_cmd(build_cmd(fmk_root, "build-firmware.sh", workspace_dir, nopad, minblk),
+            cwd=fmk_root, log_callback=log_callback, use_sudo=sudo_flag)
+    return new_firmware_path(workspace_dir)
+
+def build_cmd(fmk_root, script_name, workspace_dir, nopad=False, minblk=False):
+    """Command line of build-firmware.sh / build-multisquashfs-firmware.sh."""
+    script = os.path.join(fmk_root,script_name)
+    ensure_executable(script)
     args = [script, workspace_dir]
+    # (Original script only accepts -nopad or -min? We mimic same semantics)
     if nopad:
         args.append("-nopad")
     elif minblk:
         args.append("-min")
-    sudo_flag = (use_sudo is True)
-    run_cmd(args, cwd=fmk_root, log_callback=log_callback, use_sudo=sudo_flag)
-    out_path = os.path.join(workspace_dir, "new-firmware.bin")
-    return out_path if os.path.isfile(out_path) else None
+    return args
+
+def open_block_reuse(rootfs_dir, meta, firmware_path=None, log_callback=None):
+    """
+    BlockReuse for rootfs_dir from the image it was extracted from, or None.
+    Image: <segment>/image_parts/rootfs.img, else firmware_path at FS_OFFSET.
+    Needs the rootfs_original snapshot (manifest) to tell unchanged files apart.
+    """
+    seg = os.path.dirname(os.path.normpath(rootfs_dir))
+    candidates = [(os.path.join(seg,"image_parts","rootfs.img"), 0)]
+    if firmware_path and meta.get("FS_OFFSET") is not None:
+        candidates.append((firmware_path, meta["FS_OFFSET"]))
+    for path, offset in candidates:
+        if not os.path.isfile(path):
+            continue
+        try:
+            return BlockReuse.from_image(path, offset, rootfs_dir)
+        except (SquashFSError, OSError) as e:
+            if log_callback:
+                log_callback(f"[FMK] Block reuse from {os.path.basename(path)} unavailable: {e}")
+    return None
+
+@tracing.traced("fmk")
+def build_firmware_python(fmk_root, workspace_dir, nopad=False, minblk=False,
+                           log_callback=None, workers=None, firmware_path=None, build_overrides=None):
+    """
+    Same steps as build-firmware.sh for a squashfs image, with the filesystem written by
+    SquashFSBuilder across a process pool:
+      header.img + new filesystem + 0xFF filler up to footer + footer.img, then crcalc.
+    Unchanged files keep their compressed blocks from the original image (open_block_reuse),
+    so only edited / added files are recompressed.
+    Raises SquashFSError when this workspace needs the FMK script instead.
+    """
+    meta, _ = parse_config(os.path.join(workspace_dir,"logs","config.log"))
+    parts = os.path.join(workspace_dir,"image_parts")
+    header_img = os.path.join(parts,"header.img")
+    footer_img = os.path.join(parts,"footer.img")
+    crcalc = os.path.join(fmk_root,"src","crcalc","crcalc")
+    if not os.path.isfile(header_img):
+        raise SquashFSError("image_parts/header.img not found")
+    if not os.path.isfile(crcalc):
+        raise SquashFSError("crcalc not built (needed to fix header checksums)")
+    overrides = {"block_size": 1048576} if minblk else {}
+    overrides.update(build_overrides or {})
+    if workers:
+        overrides["workers"] = workers
+    rootfs_dir = os.path.join(workspace_dir,"rootfs")
+    builder = SquashFSBuilder.from_meta(rootfs_dir, meta, **overrides)
+
+    fs_out = os.path.join(workspace_dir,"new-filesystem.squashfs")
+    fw_out = os.path.join(workspace_dir,"new-firmware.bin")
+    if log_callback:
+        log_callback(f"[FMK] Python SquashFS build: comp={builder.compression} "
+                     f"block={builder.block_size} workers={builder.workers}")
+    builder.reuse = open_block_reuse(rootfs_dir, meta, firmware_path, log_callback)
+    try:
+        with tracing.span("squashfs_build", cat="build", workers=builder.workers) as sp:
+            fs_size = builder.build(fs_out)
+            sp.set(fs_size=fs_size)
+    finally:
+        if builder.reuse:
+            builder.reuse.close()
+    if log_callback and builder.reuse:
+        log_callback(f"[FMK] Block reuse: copied {builder.reused_bytes} bytes "
+                     f"({len(builder.reuse.unchanged)} unchanged files), "
+                     f"recompressed {builder.compressed_bytes} bytes")
+    # read the new image back (metadata only, no extraction) before it goes into firmware
+    with tracing.span("verify_tree", cat="build"), SquashFSImage(fs_out) as img:
+        problems = img.verify_tree(os.path.join(workspace_dir,"rootfs"))
+    if problems:
+        raise SquashFSError("built image does not match rootfs: " + "; ".join(problems[:5]))
+
+    footer_size = meta.get("FOOTER_SIZE",0)
+    fw_size = meta.get("FW_SIZE",0)
+    with tracing.span("assemble", cat="build"), open(fw_out,"wb") as o:
+        copy_region(header_img, o)
+        copy_region(fs_out, o)
+        filler = fw_size - o.tell() - footer_size
+        if fw_size and filler < 0:
+            raise FMKError(f"New firmware image will be larger than original image! ({-filler} bytes over)")
+        if filler > 0 and not nopad:
+            o.write(b"\xff"*filler)
+        if footer_size > 0 and os.path.isfile(footer_img):
+            copy_region(footer_img, o)
+    if log_callback:
+        log_callback(f"[FMK] New filesystem {fs_size} bytes, firmware {os.path.getsize(fw_out)} bytes")
+    binlog = os.path.join(workspace_dir,"logs","binwalk.log")
+    run_cmd([crcalc, fw_out, binlog], cwd=fmk_root, log_callback=log_callback, check=False)
+    return fw_out
 
 # -------------------------------------------------
 # Multi-squash extract / build
 # -------------------------------------------------
+@tracing.traced("fmk")
 def extract_multisquash(fmk_root, firmware_path, workspace_dir, log_callback=None):
     """
     Uses extract-multisquashfs-firmware.sh which:
@@ -138,11 +292,18 @@ def extract_multisquash(fmk_root, firmware_path, workspace_dir, log_callback=Non
           'name': <basename of segment_dir>
         }
     """
+    run_cmd(multisquash_cmd(fmk_root, firmware_path, workspace_dir), cwd=fmk_root, log_callback=log_callback)
+    return multisquash_segments(workspace_dir)
+
+def multisquash_cmd(fmk_root, firmware_path, workspace_dir):
     script = os.path.join(fmk_root,"extract-multisquashfs-firmware.sh")
     ensure_executable(script)
     if os.path.exists(workspace_dir):
         raise FMKError(f"Workspace already exists: {workspace_dir}")
-    run_cmd([script, firmware_path, workspace_dir], cwd=fmk_root, log_callback=log_callback)
+    return [script, firmware_path, workspace_dir]
+
+def multisquash_segments(workspace_dir):
+    """Segment list (see extract_multisquash) of an extracted multi-squash workspace."""
     # parse main config for segment dirs
     top_config = os.path.join(workspace_dir,"logs","config.log")
     _, extra_lines = parse_config(top_config)
@@ -163,40 +324,36 @@ def extract_multisquash(fmk_root, firmware_path, workspace_dir, log_callback=Non
         raise FMKError("No squashfs segments detected in multi-squash extraction.")
     return segments
 
+@tracing.traced("fmk")
 def build_multisquash(fmk_root, workspace_dir, nopad=False, minblk=False,
                       log_callback=None):
-    script = os.path.join(fmk_root,"build-multisquashfs-firmware.sh")
-    ensure_executable(script)
-    args = [script, workspace_dir]
-    # (Original script only accepts -nopad or -min? We mimic same semantics)
-    if nopad:
-        args.append("-nopad")
-    elif minblk:
-        args.append("-min")
-    run_cmd(args, cwd=fmk_root, log_callback=log_callback)
-    out_path = os.path.join(workspace_dir, "new-firmware.bin")
-    return out_path if os.path.isfile(out_path) else None
+    run_cmd(build_cmd(fmk_root, "build-multisquashfs-firmware.sh", workspace_dir, nopad, minblk),
+            cwd=fmk_root, log_callback=log_callback)
+    return new_firmware_path(workspace_dir)
 
 # -------------------------------------------------
 # IPK management
 # -------------------------------------------------
-def install_ipk(fmk_root, workspace_dir, ipk_path, log_callback=None):
-    script = os.path.join(fmk_root,"ipkg_install.sh")
+def ipk_cmd(fmk_root, script_name, workspace_dir, ipk_path):
+    """Command line of ipkg_install.sh / ipkg_remove.sh."""
+    script = os.path.join(fmk_root,script_name)
     ensure_executable(script)
     if not os.path.isfile(ipk_path):
         raise FMKError("IPK file missing.")
-    run_cmd([script, ipk_path, workspace_dir], cwd=fmk_root, log_callback=log_callback)
+    return [script, ipk_path, workspace_dir]
+
+@tracing.traced("fmk")
+def install_ipk(fmk_root, workspace_dir, ipk_path, log_callback=None):
+    run_cmd(ipk_cmd(fmk_root, "ipkg_install.sh", workspace_dir, ipk_path), cwd=fmk_root, log_callback=log_callback)
 
+@tracing.traced("fmk")
 def remove_ipk(fmk_root, workspace_dir, ipk_path, log_callback=None):
-    script = os.path.join(fmk_root,"ipkg_remove.sh")
-    ensure_executable(script)
-    if not os.path.isfile(ipk_path):
-        raise FMKError("IPK file missing.")
-    run_cmd([script, ipk_path, workspace_dir], cwd=fmk_root, log_callback=log_callback)
+    run_cmd(ipk_cmd(fmk_root, "ipkg_remove.sh", workspace_dir, ipk_path), cwd=fmk_root, log_callback=log_callback)
 
 # -------------------------------------------------
 # Vendor post-process (Linksys footer example)
 # -------------------------------------------------
+@tracing.traced("fmk")
 def postprocess_linksys_footer(fmk_root, firmware_path, log_callback=None):
     script = os.path.join(fmk_root,"linksys_footer.sh")
     if not os.path.isfile(script):
@@ -230,11 +387,88 @@ def compute_original_rootfs_span(meta):
         return None
     return footer_off - fs_offset - footer_size
 
-def estimate_squashfs_size(rootfs_dir, meta, log_callback=None):
+def estimate_squashfs_breakdown(rootfs_dir, meta, cache_path=None, log_callback=None, workers=None,
+                                firmware_path=None, build_overrides=None):
     """
-    Predict compressed size by actually running mksquashfs to a temp file (then remove).
+    Size prediction with the in-process builder (nothing written to disk).
+    Returns (size, attribution) where attribution maps rel path -> bytes in the image
+    and "(metadata)" -> tables + superblock + padding; the values sum to size.
+
+    With cache_path (SQLite, see size_cache.py) compressed block sizes are cached per
+    file content hash / block size / codec, so a re-prediction only recompresses files
+    whose content changed and fragment blocks whose packed content changed.
+
+    Bound: the result is exactly (0 bytes error) the size SquashFSBuilder.build() writes
+    for the same tree and options - cache hits reuse the sizes of byte-identical input.
+    The bound holds only against the python engine. FMK's mksquashfs uses the same table layout
+    and 4K padding, but its compressor settings (zlib strategy / xz filters and dictionary),
+    fragment packing order and duplicate rules can differ, for gzip as well as xz, and no bound
+    against it is claimed; `python bench.py mksquashfs --comp gzip,xz` measures the gap. When
+    build-firmware.sh will write the image, predict with engine="mksquashfs" (app.py does).
+    Unchanged files take their block sizes from the original image (open_block_reuse),
+    exactly what the python build engine will write for them.
+    Raises SquashFSError if the segment needs mksquashfs.
+    """
+    kwargs = dict(build_overrides or {})
+    if workers:
+        kwargs["workers"] = workers
+    cache = SizeCache(cache_path) if cache_path else None
+    reuse = None
+    try:
+        builder = SquashFSBuilder.from_meta(rootfs_dir, meta, cache=cache, **kwargs)
+        if log_callback:
+            log_callback(f"[FMK] Predict size via python builder: comp={builder.compression} "
+                         f"block={builder.block_size} workers={builder.workers}")
+        builder.reuse = reuse = open_block_reuse(rootfs_dir, meta, firmware_path, log_callback)
+        size = builder.build(None)
+        if log_callback and (cache or reuse):
+            log_callback(f"[FMK] Predict cache: reused {builder.cached_bytes + builder.reused_bytes} bytes, "
+                         f"recompressed {builder.compressed_bytes} bytes")
+        return size, builder.attribution
+    finally:
+        if reuse:
+            reuse.close()
+        if cache:
+            cache.close()
+
+@tracing.traced("fmk")
+def sample_squashfs_size(rootfs_dir, meta, confidence=0.95, sample_bytes=SAMPLE_BYTES, workers=None,
+                         build_overrides=None, log_callback=None):
+    """
+    Sub-second estimate from a stratified sample of blocks (size_sample.py): returns a
+    SizeEstimate with .size / .low / .high (confidence interval) and .verdict(span).
+    Only worth an exact pass (estimate_squashfs_breakdown) when verdict(span) is "uncertain".
+    Raises SquashFSError if the segment needs mksquashfs.
+    """
+    builder = SquashFSBuilder.from_meta(rootfs_dir, meta, **(build_overrides or {}))
+    est = sample_estimate(builder, sample_bytes=sample_bytes, confidence=confidence, workers=workers)
+    if log_callback:
+        log_callback(f"[FMK] Sampled size: {est.size} bytes ({est.confidence:.0%} range {est.low}-{est.high}), "
+                     f"compressed {est.sampled_bytes} of {est.total_bytes} bytes in {est.seconds:.2f}s")
+    return est
+
+@tracing.traced("fmk")
+def estimate_squashfs_size(rootfs_dir, meta, log_callback=None, engine="auto", workers=None,
+                           cache_path=None, firmware_path=None, build_overrides=None):
+    """
+    Predict compressed size of the rootfs as a squashfs image.
+    engine "python"/"auto": SquashFSBuilder in count-only mode (no temp file, all cores,
+    optional per-file size cache - see estimate_squashfs_breakdown);
+    engine "mksquashfs" (or auto fallback): run mksquashfs to a temp file (then remove).
     We try to honor FS_BLOCKSIZE, FS_ARGS, FS_COMPRESSION heuristics.
     """
+    if engine in ("auto","python"):
+        try:
+            return estimate_squashfs_breakdown(rootfs_dir, meta, cache_path=cache_path,
+                                               log_callback=log_callback, workers=workers,
+                                               firmware_path=firmware_path,
+                                               build_overrides=build_overrides)[0]
+        except (SquashFSError, OSError) as e:
+            if engine=="python":
+                raise FMKError(f"Python SquashFS predict failed: {e}")
+            if log_callback:
+                log_callback(f"[FMK] Python builder not usable ({e}), fallback to mksquashfs")
+
     mkfs_path = meta.get("MKFS","").strip('"').strip("'")
     if not mkfs_path:
         # fallback
@@ -287,6 +521,9 @@ def estimate_squashfs_size(rootfs_dir, meta, log_callback=None):
     return size
 
 def folder_size_bytes(path):
+    idx=fs_index.get_index(path)
+    if idx is not None:
+        return idx.total_size()
     total=0
     for root,dirs,files in os.walk(path):
         for f in files:
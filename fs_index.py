@@ -0,0 +1,332 @@
+"""
+In-memory filesystem index ของ rootfs ที่เปิดอยู่ (หนึ่ง index ต่อ tree) อัปเดตสดผ่าน Linux inotify
+
+  idx = open_index("workspaces/ws_a/rootfs")       # os.scandir ครั้งเดียว แล้วเฝ้าทุก directory
+  idx.total_size(), idx.file_count()              # O(1) – ผลรวมเก็บไว้ที่แต่ละ directory node
+  idx.files()                                     # rel path ของทุก entry ที่ไม่ใช่ directory
+  mark = idx.mark(); ...patch / install_ipk...; idx.changed_since(mark)   # O(จำนวนที่เปลี่ยน)
+
+- node ใช้ __slots__ (name, parent, stat ย่อ, children / ผลรวมของ directory)
+- changed_since() คืน None เมื่อบอกไม่ได้ (inotify ใช้ไม่ได้, queue overflow, mark ก่อน rebuild) -> ให้ scan เต็ม
+- ไม่มี inotify (ไม่ใช่ Linux / watch เต็ม) index ยังใช้ได้แบบ snapshot: refresh() เพื่อสร้างใหม่
+- ขนาดรวมนับเฉพาะ regular file (ไม่ตาม symlink)
+"""
+
+import os, stat, errno, select, struct, threading, ctypes, ctypes.util
+
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF = 0x400, 0x800
+IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+IN_ONLYDIR, IN_DONT_FOLLOW, IN_EXCL_UNLINK = 0x01000000, 0x02000000, 0x04000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+_EVENT = struct.Struct("iIII")
+
+_libc = None
+
+def _inotify():
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            _libc.inotify_init1
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+class _Node:
+    __slots__ = ("name", "parent", "mode", "size", "mtime_ns", "children", "total", "count", "wd")
+
+    def __init__(self, name, parent, st):
+        self.name = name
+        self.parent = parent
+        self.mode = st.st_mode
+        self.size = st.st_size if stat.S_ISREG(st.st_mode) else 0
+        self.mtime_ns = st.st_mtime_ns
+        self.children = {} if stat.S_ISDIR(st.st_mode) else None
+        self.total = 0          # directories: bytes of regular files below
+        self.count = 0          # directories: non-directory entries below
+        self.wd = -1
+
+class TreeIndex:
+    def __init__(self, root_dir, live=True):
+        self.root_dir = os.path.abspath(root_dir)
+        self._lock = threading.RLock()
+        self._changed = {}          # rel -> generation of its last change
+        self._generation = 0
+        self._valid_from = 0        # marks older than this cannot be answered (rebuild / overflow)
+        self._wds = {}
+        self._fd = -1
+        self._thread = None
+        self._stop_r = self._stop_w = -1
+        self.live = False
+        self.marks = {}             # consumer bookmarks, e.g. rootfs_manifest: manifest path -> (mark, mtime)
+        libc = _inotify() if live else None
+        if libc:
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                self.live = True
+        self._root = self._build()
+        if self.live:
+            self._stop_r, self._stop_w = os.pipe()
+            self._thread = threading.Thread(target=self._run, name="fs-index", daemon=True)
+            self._thread.start()
+
+    # ---------- building ----------
+    def _build(self):
+        root = _Node("", None, os.lstat(self.root_dir))
+        self._fill(root, self.root_dir, None)
+        return root
+
+    def _watch(self, node, path):
+        if self._fd < 0:
+            return
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:        # fs.inotify.max_user_watches reached: stop being live
+                self.live = False
+            return
+        node.wd = wd
+        self._wds[wd] = node
+
+    def _fill(self, node, path, changed):
+        """Scan a new directory node; rel paths of the non-directory entries found go to changed."""
+        self._watch(node, path)
+        stack = [(node, path)]
+        while stack:
+            d, p = stack.pop()
+            try:
+                it = os.scandir(p)
+            except OSError:
+                continue
+            with it:
+                for de in it:
+                    try:
+                        st = de.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    child = _Node(de.name, d, st)
+                    d.children[de.name] = child
+                    if child.children is not None:
+                        self._watch(child, de.path)
+                        stack.append((child, de.path))
+                    else:
+                        self._adjust(d, child.size, 1)
+                        if changed is not None:
+                            changed.append(os.path.relpath(de.path, self.root_dir))
+
+    @staticmethod
+    def _adjust(d, size, count):
+        while d is not None:
+            d.total += size
+            d.count += count
+            d = d.parent
+
+    def _rel(self, node):
+        parts = []
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return "/".join(reversed(parts))
+
+    def _walk_files(self, node, prefix):
+        stack = [(node, prefix)]
+        while stack:
+            d, p = stack.pop()
+            for name, c in d.children.items():
+                rel = f"{p}/{name}" if p else name
+                if c.children is None:
+                    yield rel
+                else:
+                    stack.append((c, rel))
+
+    def refresh(self):
+        """Rebuild from disk (after an inotify overflow, or for a non-live index)."""
+        with self._lock:
+            for wd in list(self._wds):
+                if self._fd >= 0:
+                    _libc.inotify_rm_watch(self._fd, wd)
+            self._wds.clear()
+            self._root = self._build()
+            self._generation += 1
+            self._valid_from = self._generation
+            self._changed.clear()
+
+    # ---------- queries ----------
+    def _find(self, rel):
+        node = self._root
+        for part in rel.strip("/").split("/") if rel.strip("/") else ():
+            node = node.children.get(part) if node.children is not None else None
+            if node is None:
+                return None
+        return node
+
+    def total_size(self, rel=""):
+        with self._lock:
+            node = self._find(rel)
+            if node is None:
+                return 0
+            return node.total if node.children is not None else node.size
+
+    def file_count(self, rel=""):
+        with self._lock:
+            node = self._find(rel)
+            return 0 if node is None else node.count if node.children is not None else 1
+
+    def files(self, rel=""):
+        """Set of rel paths (relative to the tree root) of every non-directory entry below rel."""
+        with self._lock:
+            node = self._find(rel)
+            if node is None or node.children is None:
+                return set() if node is None else {rel.strip("/")}
+            return set(self._walk_files(node, rel.strip("/")))
+
+    def mark(self):
+        """Generation counter for changed_since(); events already queued by the kernel are applied first."""
+        with self._lock:
+            self._drain()
+            return self._generation
+
+    def changed_since(self, mark):
+        """Rel paths created / modified / removed after mark(), or None when unknown (full scan needed)."""
+        with self._lock:
+            if mark is None or not self.live or mark < self._valid_from:
+                return None
+            return {rel for rel, g in self._changed.items() if g > mark}
+
+    # ---------- inotify ----------
+    def _run(self):
+        while True:
+            try:
+                ready, _, _ = select.select([self._fd, self._stop_r], [], [])
+            except OSError:
+                return
+            if self._stop_r in ready:
+                return
+            with self._lock:       # read under the lock too: batches must be applied in order
+                if not self._drain():
+                    return
+
+    def _drain(self):
+        while self._fd >= 0:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            events = {}
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                name = data[pos + 16:pos + 16 + length].rstrip(b"\0")
+                pos += 16 + length
+                key = (wd, name)
+                events[key] = events.get(key, 0) | mask    # coalesce repeated IN_MODIFY etc.
+            self._apply(events)
+        return False
+
+    def _apply(self, events):
+        for (wd, name), mask in events.items():
+            if mask & IN_Q_OVERFLOW:
+                self.refresh()
+                return
+            d = self._wds.get(wd)
+            if mask & IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+            if d is None or not name:
+                continue
+            name = os.fsdecode(name)
+            changed = []
+            old = d.children.get(name)
+            if old is not None and mask & (IN_DELETE | IN_MOVED_FROM | IN_CREATE | IN_MOVED_TO):
+                self._remove(d, old, changed)
+            if mask & (IN_CREATE | IN_MOVED_TO | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE):
+                path = os.path.join(self.root_dir, self._rel(d), name)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    st = None
+                if st is not None:
+                    cur = d.children.get(name)
+                    if cur is not None and cur.children is None and not stat.S_ISDIR(st.st_mode):
+                        self._adjust(d, (st.st_size if stat.S_ISREG(st.st_mode) else 0) - cur.size, 0)
+                        cur.mode, cur.mtime_ns = st.st_mode, st.st_mtime_ns
+                        cur.size = st.st_size if stat.S_ISREG(st.st_mode) else 0
+                        changed.append(self._rel(cur))
+                    elif cur is None:
+                        node = _Node(name, d, st)
+                        d.children[name] = node
+                        if node.children is not None:
+                            self._fill(node, path, changed)
+                        else:
+                            self._adjust(d, node.size, 1)
+                            changed.append(self._rel(node))
+            if changed:
+                self._generation += 1
+                for rel in changed:
+                    self._changed[rel] = self._generation
+
+    def _remove(self, d, node, changed):
+        del d.children[node.name]
+        if node.children is None:
+            self._adjust(d, -node.size, -1)
+            changed.append(self._rel(d) + "/" + node.name if d.parent is not None else node.name)
+            return
+        self._adjust(d, -node.total, -node.count)
+        prefix = self._rel(d)
+        prefix = f"{prefix}/{node.name}" if prefix else node.name
+        changed.extend(self._walk_files(node, prefix))
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if n.wd >= 0 and self._wds.pop(n.wd, None) is not None:
+                _libc.inotify_rm_watch(self._fd, n.wd)     # moved-away dirs keep their watch otherwise
+            stack.extend(c for c in n.children.values() if c.children is not None)
+
+    def close(self):
+        if self._thread is not None:
+            os.write(self._stop_w, b"x")
+            self._thread.join()
+            self._thread = None
+            os.close(self._stop_r)
+            os.close(self._stop_w)
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self.live = False
+
+# -------------------------------------------------
+# Registry: one index per open tree, shared by the GUI / manifest / size helpers
+# -------------------------------------------------
+_indexes = {}
+_registry_lock = threading.Lock()
+
+def open_index(root_dir):
+    key = os.path.abspath(root_dir)
+    with _registry_lock:
+        idx = _indexes.get(key)
+        if idx is None:
+            idx = _indexes[key] = TreeIndex(key)
+        return idx
+
+def get_index(root_dir):
+    """The open index of root_dir, or None."""
+    return _indexes.get(os.path.abspath(root_dir))
+
+def close_index(root_dir):
+    with _registry_lock:
+        idx = _indexes.pop(os.path.abspath(root_dir), None)
+    if idx:
+        idx.close()
+
+def close_all():
+    with _registry_lock:
+        items = list(_indexes.values())
+        _indexes.clear()
+    for idx in items:
+        idx.close()
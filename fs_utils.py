@@ -0,0 +1,214 @@
+"""
+Filesystem helpers: cheap file/tree cloning (reflink -> hardlink -> copy), link breaking
+and zero-copy region carving.
+
+- reflink (FICLONE ioctl, btrfs/xfs/bcachefs ...) : แชร์ data block แบบ copy-on-write, เขียนทับได้ปลอดภัย
+- hardlink : แชร์ inode เดียวกัน → ก่อนเขียนไฟล์ต้องเรียก break_hardlink() เสมอ
+- copy     : fallback (ข้าม filesystem / ไม่มีสิทธิ์ link)
+
+copy_region() ตัดช่วง [offset, offset+length) ของไฟล์ด้วย os.copy_file_range (ใน kernel,
+อาจ reflink ได้เลย) -> os.sendfile -> mmap ทีละ chunk; หน่วยความจำคงที่ไม่ขึ้นกับขนาดช่วง
+  python fs_utils.py carve <src> <dst> <offset> [length]     (ใช้ใน scripts/extract_multi_auto.sh)
+"""
+
+import os, stat, shutil, errno, mmap
+from contextlib import nullcontext
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int)
+
+_NO_REFLINK_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.EPERM,
+                      errno.ENOSYS, errno.EBADF}
+
+def reflink(src, dst):
+    """Clone src to a new file dst sharing data blocks (raises OSError if unsupported)."""
+    import fcntl
+    with open(src, "rb") as fs:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, fs.fileno())
+        except OSError:
+            os.close(fd)
+            os.unlink(dst)
+            raise
+        os.close(fd)
+    shutil.copystat(src, dst, follow_symlinks=False)
+
+def clone_file(src, dst, methods=("reflink", "hardlink", "copy"), state=None):
+    """
+    Create dst from src using the first method that works; returns the method used.
+    state (dict) remembers methods that failed with "unsupported" so a tree clone
+    does not retry them for every file.
+    """
+    state = {} if state is None else state
+    for m in methods:
+        if state.get(m) is False:
+            continue
+        try:
+            if m == "reflink":
+                reflink(src, dst)
+            elif m == "hardlink":
+                os.link(src, dst, follow_symlinks=False)
+            else:
+                shutil.copy2(src, dst, follow_symlinks=False)
+            return m
+        except OSError as e:
+            if m == "copy":
+                raise
+            if m == "reflink" and e.errno in _NO_REFLINK_ERRNOS:
+                state[m] = False
+            elif m == "hardlink" and e.errno in (errno.EXDEV, errno.EMLINK, errno.ENOTSUP):
+                state[m] = False
+    raise OSError(errno.EIO, f"cannot clone {src}")
+
+def clone_tree(src_dir, dst_dir, methods=("reflink", "hardlink", "copy"), skipped=None):
+    """
+    Mirror src_dir into dst_dir (which must not exist): directories are created,
+    symlinks recreated, regular files cloned with clone_file(), device nodes / fifos
+    recreated with mknod when permitted. Cost is O(inodes), not O(bytes), unless
+    everything falls back to copy. Returns {method: count}; rel paths mknod could not
+    recreate (no CAP_MKNOD) are appended to the list `skipped` when given.
+    """
+    counts = {}
+    state = {}
+    os.makedirs(dst_dir)
+    dirs = [(src_dir, dst_dir)]
+    for root, dnames, fnames in os.walk(src_dir):
+        rel = os.path.relpath(root, src_dir)
+        target_root = dst_dir if rel == "." else os.path.join(dst_dir, rel)
+        for d in dnames:
+            s = os.path.join(root, d)
+            t = os.path.join(target_root, d)
+            if os.path.islink(s):
+                os.symlink(os.readlink(s), t)
+                counts["symlink"] = counts.get("symlink", 0) + 1
+            else:
+                os.mkdir(t)
+                dirs.append((s, t))
+        for f in fnames:
+            s = os.path.join(root, f)
+            t = os.path.join(target_root, f)
+            st = os.lstat(s)
+            if stat.S_ISLNK(st.st_mode):
+                os.symlink(os.readlink(s), t)
+                m = "symlink"
+            elif stat.S_ISREG(st.st_mode):
+                m = clone_file(s, t, methods, state)
+            else:
+                try:
+                    os.mknod(t, st.st_mode, st.st_rdev)
+                    m = "special"
+                except OSError:
+                    m = "skipped"
+                    if skipped is not None:
+                        skipped.append(os.path.relpath(s, src_dir))
+            counts[m] = counts.get(m, 0) + 1
+    # directory mtimes last (creating entries changes them)
+    for s, t in reversed(dirs):
+        try:
+            shutil.copystat(s, t, follow_symlinks=False)
+        except OSError:
+            pass
+    return counts
+
+def break_hardlink(path):
+    """
+    If path shares its inode with another name (e.g. a hardlink snapshot), replace it
+    with a private copy so an in-place write cannot leak into the other name.
+    Returns True if the link was broken.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    if not stat.S_ISREG(st.st_mode) or st.st_nlink < 2:
+        return False
+    tmp = path + ".fwb-unlink"
+    clone_file(path, tmp, methods=("reflink", "copy"))
+    os.replace(tmp, path)
+    return True
+
+# -------------------------------------------------
+# Region carving
+# -------------------------------------------------
+CARVE_CHUNK = 8 * 1024 * 1024
+
+_NO_FAST_COPY_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                        errno.ENOTSUP, errno.EBADF, errno.EPERM}
+
+def _copy_file_range(sfd, dfd, pos, count):
+    return os.copy_file_range(sfd, dfd, count, pos)
+
+def _sendfile(sfd, dfd, pos, count):
+    return os.sendfile(dfd, sfd, pos, count)
+
+def _mmap_chunk(sfd, dfd, pos, count):
+    base = pos - pos % mmap.ALLOCATIONGRANULARITY
+    with mmap.mmap(sfd, pos - base + count, access=mmap.ACCESS_READ, offset=base) as mm:
+        view = memoryview(mm)[pos - base:]
+        try:
+            done = 0
+            while done < count:
+                done += os.write(dfd, view[done:])
+        finally:
+            view.release()
+    return count
+
+_COPY_METHODS = tuple(m for m, fn in ((_copy_file_range, "copy_file_range"), (_sendfile, "sendfile"))
+                      if hasattr(os, fn)) + (_mmap_chunk,)
+
+def _copy_fds(sfd, dfd, offset, length):
+    """Copy length bytes from sfd@offset to dfd's current position, one CARVE_CHUNK at a time."""
+    methods = list(_COPY_METHODS)
+    done = 0
+    while done < length:
+        count = min(CARVE_CHUNK, length - done)
+        try:
+            n = methods[0](sfd, dfd, offset + done, count)
+        except OSError as e:
+            if e.errno not in _NO_FAST_COPY_ERRNOS or len(methods) == 1:
+                raise
+            n = 0
+        if n > 0:
+            done += n
+        elif len(methods) > 1:
+            methods.pop(0)  # unsupported here (or returned 0 on a pseudo fs) -> next method
+        else:
+            raise OSError(errno.EIO, f"short copy at offset {offset + done}")
+    return done
+
+def copy_region(src, dst, offset=0, length=None):
+    """
+    Copy [offset, offset+length) of src into dst without reading it into Python memory.
+    src : path or binary file object (its position is not used or changed).
+    dst : path (created/truncated) or binary file object opened for writing; the region is
+          appended at its current position and the position is advanced.
+    length=None copies to EOF; a length past EOF is clamped. Returns bytes copied.
+    """
+    with open(src, "rb") if isinstance(src, (str, bytes, os.PathLike)) else nullcontext(src) as fs:
+        size = os.fstat(fs.fileno()).st_size
+        if offset < 0 or offset > size:
+            raise ValueError(f"offset {offset} outside source ({size} bytes)")
+        length = size - offset if length is None else max(0, min(length, size - offset))
+        if isinstance(dst, (str, bytes, os.PathLike)):
+            with open(dst, "wb") as fd:
+                return _copy_fds(fs.fileno(), fd.fileno(), offset, length)
+        dst.flush()
+        dfd = dst.fileno()
+        start = dst.tell()
+        os.lseek(dfd, start, os.SEEK_SET)
+        n = _copy_fds(fs.fileno(), dfd, offset, length)
+        dst.seek(start + n)  # resync the buffered object with the fd position
+        return n
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="fs_utils command line helpers")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("carve", help="copy [offset, offset+length) of src into dst")
+    c.add_argument("src")
+    c.add_argument("dst")
+    c.add_argument("offset", type=lambda v: int(v, 0))
+    c.add_argument("length", nargs="?", type=lambda v: int(v, 0))
+    a = ap.parse_args()
+    if a.cmd == "carve":
+        copy_region(a.src, a.dst, a.offset, a.length)
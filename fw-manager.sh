@@ -96,6 +96,47 @@ do_extract() {
   die "All extraction methods failed."
 }
 
+do_scan() {
+  local firmware="$1"
+  [ -f "$firmware" ] || die "Input firmware not found: $firmware"
+  ensure_bin python3
+  python3 "$PROJECT_ROOT/fw_scan.py" "$firmware" "${@:2}"
+}
+
+# python CLIs run in the caller's directory (relative inputs / -o stay the caller's); they read
+# $PROJECT_ROOT/config.yaml themselves. Workspace defaults are given here so they stay in the project
+# (an explicit option later in "$@" wins).
+do_batch() {
+  ensure_bin python3
+  # ไม่ pull FMK ทุกครั้ง: ใช้ FMK ที่ติดตั้งไว้แล้ว (install/update แยกต่างหาก)
+  python3 "$PROJECT_ROOT/fw_batch.py" --fmk "$FMK_ROOT" --workspaces "$PROJECT_ROOT/workspaces/batch" "$@"
+}
+
+do_patch() {
+  ensure_bin python3
+  python3 "$PROJECT_ROOT/patch_plan.py" "$@"
+}
+
+do_store() {
+  ensure_bin python3
+  python3 "$PROJECT_ROOT/object_store.py" --store "$PROJECT_ROOT/workspaces/.objects" "$@"
+}
+
+do_catalog() {
+  ensure_bin python3
+  python3 "$PROJECT_ROOT/catalog.py" "$@"
+}
+
+do_search() {
+  ensure_bin python3
+  python3 "$PROJECT_ROOT/search_index.py" "$@"
+}
+
+do_jobs() {
+  ensure_bin python3
+  python3 "$PROJECT_ROOT/fmk_async.py" --workspaces "$PROJECT_ROOT/workspaces/async" "$@"
+}
+
 usage() {
   cat <<EOF
 Firmware Workbench Manager
@@ -104,6 +145,19 @@ Usage: $0 <command> [args]
 Commands:
   install               Clone/update firmware-mod-kit
   extract <firmware>    Extract firmware (FMK -> fallback carve)
+  scan <firmware> [--json|--tsv]  Show filesystem layout (offset / exact length / type)
+  batch <dir|files...> [-o report.jsonl] [-j N] [--extract auto|multi|single|none]
+                        Headless extract + analyze of many images (JSON Lines report)
+  patch <plan.yaml> <workspace|segment|rootfs...> [-j N] [-o report.jsonl] [--dry-run]
+                        Apply a declarative patch plan to every rootfs found (per-target report)
+  store ingest|extract|release|gc|stats [args]
+                        Content-addressed object store shared by all workspaces (dedup + GC)
+  catalog query|import|stats [args]
+                        Search recorded workspaces, e.g. query --meta FS_COMPRESSION=lzma --finding "Telnet enabled"
+  search index|query|prune|stats [args]
+                        Path / soname / version / text search across all extracted rootfs trees
+  jobs extract|build|predict <targets...> [-j N] [--timeout SEC]
+                        Run many FMK jobs concurrently from one process (JSON line per job)
   update                Update FMK
   help                  Show this help
 EOF
@@ -122,6 +176,41 @@ case "${1:-}" in
     clone_or_update_fmk
     do_extract "$1"
     ;;
+  scan)
+    shift
+    [ $# -ge 1 ] || die "scan requires <firmware_path>"
+    do_scan "$@"
+    ;;
+  batch)
+    shift
+    [ $# -ge 1 ] || die "batch requires <dir|firmware...>"
+    do_batch "$@"
+    ;;
+  patch)
+    shift
+    [ $# -ge 2 ] || die "patch requires <plan.yaml> <workspace...>"
+    do_patch "$@"
+    ;;
+  store)
+    shift
+    [ $# -ge 1 ] || die "store requires a subcommand (ingest|extract|release|gc|stats)"
+    do_store "$@"
+    ;;
+  catalog)
+    shift
+    [ $# -ge 1 ] || die "catalog requires a subcommand (query|import|stats)"
+    do_catalog "$@"
+    ;;
+  search)
+    shift
+    [ $# -ge 1 ] || die "search requires a subcommand (index|query|prune|stats)"
+    do_search "$@"
+    ;;
+  jobs)
+    shift
+    [ $# -ge 2 ] || die "jobs requires extract|build|predict <targets...>"
+    do_jobs "$@"
+    ;;
   help|-h|--help)
     usage
     ;;
@@ -0,0 +1,238 @@
+"""
+Firmware / segment analysis (ไม่ขึ้นกับ GUI) ใช้โดย AIWorker, MultiSegmentAIWorker และงาน headless
+
+- analyze_firmware_detailed(): boot delay + config ใน rootfs (squashfs_reader) + entropy ทั้ง image
+- analyze_segments(): วิเคราะห์หลาย segment ขนานกันใน process pool
+    * แต่ละ worker process เปิด mmap read-only ของ firmware ครั้งเดียว (page cache เดียวกันทุก process)
+      แล้วใช้ mmap นั้นกับทุก segment ที่ได้รับ: อ่าน rootfs ด้วย SquashFSImage + entropy เฉพาะช่วงของ segment
+    * ผลลัพธ์ yield ออกมาทันทีที่แต่ละ segment เสร็จ (imap_unordered)
+    * should_stop() ถูกเช็คทุก ~0.2 วินาที; เมื่อเป็น True จะ terminate pool (หยุดงานที่กำลังรันอยู่จริง)
+- trace.enabled: span ของแต่ละ segment ใน worker ถูกส่งกลับมาพร้อมผล (tracing.add_events)
+- ผลลัพธ์เก็บใน AnalysisCache (analysis_cache.py) ตาม sha256 ของ byte ที่วิเคราะห์ + ANALYZER_VERSION
+"""
+
+import os, mmap, shutil, subprocess, tempfile, multiprocessing
+import tracing
+from rebuild_squashfs import SquashFSError
+from squashfs_reader import SquashFSImage
+from fs_utils import copy_region
+from entropy_profile import entropy_profile, format_profile
+from analysis_cache import AnalysisCache, region_digest
+from proc_pool import pool_context
+
+# bump when findings change for the same input bytes (invalidates the analysis cache)
+ANALYZER_VERSION = "1"
+
+# -------------------------------------------------
+# Single firmware / segment
+# -------------------------------------------------
+def rootfs_findings(read_text):
+    """Findings from rootfs config files; read_text(rel) -> str or None if missing."""
+    findings = []
+    txt = read_text("etc/inittab")
+    if txt is not None:
+        if "getty" in txt and "ttyS" in txt:
+            findings.append("serial shell (getty) อาจเปิดใช้งาน")
+        else:
+            findings.append("ไม่พบ getty serial shell")
+    data = read_text("etc/inetd.conf")
+    if data is not None:
+        findings.append("Telnet enabled" if "telnet" in data else "Telnet disabled")
+        findings.append("FTP enabled" if "ftp" in data else "FTP disabled")
+    txt = read_text("etc/passwd")
+    if txt is not None:
+        users=[line.split(":")[0] for line in txt.splitlines() if ":" in line]
+        findings.append("Users: " + ", ".join(users))
+    txt = read_text("etc/shadow")
+    if txt is not None:
+        for line in txt.splitlines():
+            if line.startswith("root:"):
+                parts=line.split(":")
+                if parts[1] in ("!","*",""):
+                    findings.append("root ไม่มีรหัส / ถูกล็อค")
+                else:
+                    findings.append("root มี hash password")
+    return findings
+
+def _unsquashfs_findings(fw_path, rootfs_offset, rootfs_size):
+    """
+    Fallback for images the in-process reader cannot open (squashfs 3.x, big-endian ...).
+    Returns (findings, ok); ok=False when unsquashfs itself failed (result must not be cached).
+    """
+    findings = []
+    ok = False
+    tmpdir = tempfile.mkdtemp(prefix="fw-rootfs-")
+    try:
+        rootfs_bin = os.path.join(tmpdir, "rootfs.bin")
+        unsquash_dir = os.path.join(tmpdir, "unsquash")
+        os.makedirs(unsquash_dir)
+        try:
+            copy_region(fw_path, rootfs_bin, rootfs_offset, rootfs_size)
+            subprocess.check_output(
+                ["unsquashfs", "-d", unsquash_dir, rootfs_bin],
+                stderr=subprocess.STDOUT, timeout=45
+            )
+            def read_text(rel):
+                p = os.path.join(unsquash_dir, rel)
+                if not os.path.isfile(p):
+                    return None
+                with open(p, "r", encoding="utf-8", errors="ignore") as f:
+                    return f.read()
+            findings.extend(rootfs_findings(read_text))
+            ok = True
+        except Exception as e:
+            findings.append(f"แตก rootfs ไม่สำเร็จ: {e}")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return findings, ok
+
+def boot_delay_findings(fw_path, log_func=print):
+    findings = []
+    try:
+        log_func(">> วิเคราะห์ boot delay ...")
+        with open(fw_path, "rb") as f:
+            f.seek(0x100)
+            bootdelay_byte = f.read(1)
+            if bootdelay_byte:
+                bootdelay = bootdelay_byte[0]
+                if bootdelay == 0:
+                    findings.append("Boot delay = 0 วินาที (ไม่มี delay)")
+                elif bootdelay > 9:
+                    findings.append(f"Boot delay {bootdelay} วินาที (ยาวผิดปกติ)")
+                else:
+                    findings.append(f"Boot delay = {bootdelay} วินาที")
+    except Exception as e:
+        findings.append(f"อ่าน boot delay ผิดพลาด: {e}")
+    return findings
+
+def _segment_findings(fw_path, rootfs_offset, rootfs_size, log_func, buf=None):
+    try:
+        # อ่านเฉพาะไฟล์ที่ต้องใช้ตรงจาก image (ไม่ต้อง unsquashfs ทั้ง rootfs)
+        with SquashFSImage(fw_path if buf is None else buf, rootfs_offset) as img:
+            def read_text(rel):
+                if not img.isfile(rel):
+                    return None
+                return img.read_file(rel, max_size=1048576).decode("utf-8", "ignore")
+            return rootfs_findings(read_text), True
+    except SquashFSError as e:
+        log_func(f">> squashfs reader ใช้ไม่ได้ ({e}) -> unsquashfs")
+        return _unsquashfs_findings(fw_path, rootfs_offset, rootfs_size)
+    except Exception as e:
+        return [f"อ่าน rootfs ไม่สำเร็จ: {e}"], False
+
+def segment_findings(fw_path, rootfs_offset, rootfs_size, log_func=print, buf=None):
+    """rootfs findings of one segment; buf = already open mmap of fw_path (optional)."""
+    return _segment_findings(fw_path, rootfs_offset, rootfs_size, log_func, buf)[0]
+
+def _cached(cache, kind, src, offset, length, compute, log_func):
+    """compute() -> (findings, ok); results are looked up / stored by content digest of the region."""
+    if cache is None:
+        return compute()[0]
+    key = AnalysisCache.key(ANALYZER_VERSION, kind, region_digest(src, offset, length))
+    hit = cache.get(key)
+    if hit is not None:
+        log_func(f">> ใช้ผลวิเคราะห์จาก cache ({kind})")
+        return hit
+    findings, ok = compute()
+    if ok:
+        cache.put(key, findings)
+    return findings
+
+@tracing.traced("analysis")
+def analyze_firmware_detailed(fw_path, rootfs_offset, rootfs_size, log_func, cache=None):
+    """cache: AnalysisCache (optional) – rootfs and entropy results keyed by content."""
+    findings = boot_delay_findings(fw_path, log_func)
+    findings.extend(_cached(cache, "rootfs", fw_path, rootfs_offset, rootfs_size,
+                            lambda: _segment_findings(fw_path, rootfs_offset, rootfs_size, log_func),
+                            log_func))
+    findings.extend(_cached(cache, "entropy", fw_path, 0, None,
+                            lambda: (format_profile(entropy_profile(fw_path)), True), log_func))
+    return findings
+
+def _segment_result(fw_path, offset, size, log_func, buf=None):
+    findings, ok = _segment_findings(fw_path, offset, size, log_func, buf)
+    findings.extend(format_profile(entropy_profile(fw_path if buf is None else buf, offset=offset, length=size),
+                                   label="segment"))
+    return findings, ok
+
+@tracing.traced("analysis")
+def analyze_segment(fw_path, offset, size, log_func=print, cache=None):
+    """rootfs findings + entropy of one segment (same result / cache entry as analyze_segments)."""
+    with open(fw_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _cached(cache, "segment", mm, offset, size,
+                       lambda: _segment_result(fw_path, offset, size, log_func, mm), log_func)
+
+# -------------------------------------------------
+# Many segments on a process pool
+# -------------------------------------------------
+_FW_PATH = None
+_FW_MM = None
+
+def _init_segment_worker(fw_path, trace=False):
+    global _FW_PATH, _FW_MM
+    _FW_PATH = fw_path
+    tracing.enable(trace)
+    with open(fw_path, "rb") as f:
+        _FW_MM = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _segment_task(job):
+    name, offset, size, key = job
+    logs = []
+    with tracing.span("analyze_segment", cat="analysis", segment=name, size=size):
+        findings, ok = _segment_result(_FW_PATH, offset, size, logs.append, buf=_FW_MM)
+    # spans of this worker go back with the result (tracing.add_events in the parent)
+    return name, findings, logs, key if ok else None, tracing.drain() if tracing.enabled() else None
+
+def analyze_segments(fw_path, jobs, workers=None, log_func=print, should_stop=None, poll=0.2,
+                     cache_path=None, cache_max_bytes=64 * 1048576):
+    """
+    jobs: [(name, offset, size)]. Yields (name, findings) in completion order.
+    Segments found in the analysis cache (cache_path) are yielded first without touching the pool.
+    Stops early (terminating running workers) as soon as should_stop() returns True.
+    """
+    if not jobs:
+        return
+    cache = AnalysisCache(cache_path, cache_max_bytes) if cache_path else None
+    try:
+        pending = []
+        if cache is None:
+            pending = [job + (None,) for job in jobs]
+        else:
+            with open(fw_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                keyed = [(job, AnalysisCache.key(ANALYZER_VERSION, "segment", region_digest(mm, job[1], job[2])))
+                         for job in jobs]
+            for job, key in keyed:
+                hit = cache.get(key)
+                if hit is None:
+                    pending.append(job + (key,))
+                else:
+                    log_func(f"[AI ALL] {job[0]}: ใช้ผลจาก cache")
+                    yield job[0], hit
+        if not pending:
+            return
+        workers = max(1, min(len(pending), workers or os.cpu_count() or 1))
+        pool = pool_context().Pool(workers, initializer=_init_segment_worker,
+                                    initargs=(fw_path, tracing.enabled()))
+        try:
+            it = pool.imap_unordered(_segment_task, pending)
+            for _ in range(len(pending)):
+                while True:
+                    if should_stop and should_stop():
+                        return
+                    try:
+                        name, findings, logs, key, events = it.next(timeout=poll)
+                        break
+                    except multiprocessing.TimeoutError:
+                        continue
+                for line in logs:
+                    log_func(line)
+                tracing.add_events(events)
+                if cache is not None and key:
+                    cache.put(key, findings)
+                yield name, findings
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        if cache is not None:
+            cache.close()
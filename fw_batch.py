@@ -0,0 +1,312 @@
+"""
+Headless batch pipeline: extract -> analyze -> JSON Lines report (ไม่ต้องใช้ Qt)
+
+  python fw_batch.py corpus/ -o report.jsonl -j 8
+  python fw_batch.py --list images.txt --extract none         # scan + analyze เท่านั้น (เร็วที่สุด)
+  find /data -name '*.bin' | python fw_batch.py --list - -o - # อ่านรายการจาก stdin
+
+ต่อ image (หนึ่ง image ต่อ worker process):
+  1. fw_scan.scan_layout()                                   layout table
+  2. extract (--extract): auto = FMK multi-squash -> FMK single -> ไม่ extract
+                          multi / single = FMK script นั้นเท่านั้น, none = ข้าม
+  3. วิเคราะห์ทุก rootfs segment (offset จาก FMK config.log หรือ squashfs ใน layout)
+     ด้วย fw_analysis (squashfs_reader, ไม่ต้อง unsquashfs) + analysis cache (ai.cache ใน config.yaml)
+  4. เขียน 1 บรรทัด JSON ต่อ image ทันทีที่เสร็จ พร้อม sha256 + md5 (อ่านไฟล์ครั้งเดียว, hashing.py)
+     และ timing ของแต่ละขั้น (วินาที)
+
+workspace ที่ extract จะถูกลบหลังวิเคราะห์ เว้นแต่ใช้ --keep
+(--keep --store <dir>: rootfs ที่เก็บไว้ถูก dedup เข้า object store ร่วมกันทั้ง corpus, ดู object_store.py)
+--keep --index <db>: rootfs ที่เก็บไว้ถูกเพิ่มเข้า search index ของ corpus (ดู search_index.py)
+--trace: span ของแต่ละขั้น (tracing.py) -> <workspace>/logs/trace.json (--keep) หรือ <workspaces>/<ชื่อ>.trace.json
+ทุก record ที่สำเร็จถูกบันทึกลง catalog (catalog.path ใน config.yaml / --catalog, ดู catalog.py) โดย process หลัก
+"""
+
+import os, sys, json, time, shutil, hashlib, argparse, traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import yaml
+
+from fmk_integration import (locate_fmk, extract_firmware, extract_multisquash,
+                             compute_original_rootfs_span, FMKError)
+from fw_scan import scan_layout
+from fw_analysis import boot_delay_findings, analyze_segment, ANALYZER_VERSION
+from analysis_cache import AnalysisCache
+from object_store import ObjectStore
+from catalog import Catalog
+from search_index import SearchIndex
+import hashing, tracing
+from hashing import file_digests
+
+EXTRACT_MODES = ("auto", "multi", "single", "none")
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# settings holding a path relative to the directory of their config.yaml
+_PATH_KEYS = (("fmk", "root"), ("build", "size_cache"), ("ai", "cache"), ("hashing", "cache"),
+              ("store", "path"), ("catalog", "path"), ("search", "path"), ("log", "file"))
+
+def load_config(path=None):
+    """
+    config.yaml of the current directory, else the project's (the CLIs run from the caller's
+    directory, e.g. through fw-manager.sh). Relative paths of the project's config are made
+    absolute, so its caches / catalog / search index stay the ones the GUI uses.
+    """
+    if path is None and not os.path.isfile("config.yaml"):
+        path = os.path.join(PROJECT_DIR, "config.yaml")
+    try:
+        with open(path or "config.yaml", "r", encoding="utf-8") as f:
+            cfg = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError):
+        return {}
+    base = os.path.dirname(os.path.abspath(path)) if path else None
+    if base and base != os.getcwd():
+        for section, key in _PATH_KEYS:
+            value = (cfg.get(section) or {}).get(key)
+            if isinstance(value, str) and value and not os.path.isabs(value):
+                cfg[section][key] = os.path.join(base, value)
+    return cfg
+
+def collect_inputs(paths, list_file=None, pattern=None):
+    """Expand files / directories (recursive) / list file ('-' = stdin) into firmware paths."""
+    import fnmatch
+    items = list(paths)
+    if list_file:
+        f = sys.stdin if list_file == "-" else open(list_file, "r", encoding="utf-8")
+        with f:
+            items += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    out = []
+    for p in items:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                for name in sorted(files):
+                    if pattern is None or fnmatch.fnmatch(name, pattern):
+                        out.append(os.path.join(root, name))
+        else:
+            out.append(p)
+    return out
+
+def _workspace_name(fw_path):
+    base = os.path.splitext(os.path.basename(fw_path))[0].replace(" ", "_")
+    return f"{base}_{hashlib.sha1(os.path.abspath(fw_path).encode()).hexdigest()[:8]}"
+
+def _extract(fw_path, ws_root, mode, fmk_root, use_sudo, log):
+    """Returns (method, workspace, [(name, offset, size, meta)]) — method None when nothing was extracted."""
+    ws = os.path.join(ws_root, _workspace_name(fw_path))
+    if os.path.exists(ws):
+        shutil.rmtree(ws)
+    if mode in ("auto", "multi"):
+        try:
+            segs = extract_multisquash(fmk_root, fw_path, ws, log_callback=log)
+            return "multi", ws, [(s["name"], s["meta"].get("FS_OFFSET"), compute_original_rootfs_span(s["meta"]),
+                                  s["meta"]) for s in segs]
+        except FMKError as e:
+            if mode == "multi":
+                raise
+            log(f"[BATCH] multi-squash ไม่สำเร็จ ({e}) -> single")
+            shutil.rmtree(ws, ignore_errors=True)
+    meta = extract_firmware(fmk_root, fw_path, ws, log_callback=log, use_sudo=use_sudo)
+    return "single", ws, [("rootfs", meta.get("FS_OFFSET"), compute_original_rootfs_span(meta), meta)]
+
+@tracing.traced("batch")
+def _store_workspace(ws, store_path):
+    """Deduplicate every rootfs of a kept workspace into the object store; summed ingest stats."""
+    total = {}
+    with ObjectStore(store_path) as store:
+        for root, dirs, _ in os.walk(ws):
+            if "rootfs" in dirs:
+                for k, v in store.ingest_tree(os.path.join(root, "rootfs")).items():
+                    total[k] = total.get(k, 0) + v
+            dirs[:] = [d for d in dirs if d not in ("rootfs", "rootfs_original")]
+    return total
+
+@tracing.traced("batch")
+def _index_workspace(ws, db_path):
+    """Add every rootfs of a kept workspace to the search index; summed index_tree stats."""
+    total = {}
+    with SearchIndex(db_path) as idx:
+        for root, dirs, _ in os.walk(ws):
+            if "rootfs" in dirs:
+                # one process per image already: no nested pool
+                for k, v in idx.index_tree(os.path.join(root, "rootfs"), workers=1).items():
+                    total[k] = total.get(k, 0) + v
+            dirs[:] = [d for d in dirs if d not in ("rootfs", "rootfs_original")]
+    return total
+
+def process_image(fw_path, opts):
+    """Run the pipeline for one image; never raises, returns the report record."""
+    t0 = time.perf_counter()
+    logs = []
+    log = logs.append
+    rec = {"firmware": os.path.abspath(fw_path), "status": "ok", "analyzer": ANALYZER_VERSION, "timing": {}}
+    timing = rec["timing"]
+    ws = None
+    cache = None
+    if opts.get("trace"):
+        tracing.enable()
+        tracing.drain()         # worker processes are reused: start each image with an empty buffer
+    try:
+        hashing.use_cache(opts.get("hash_cache"))
+        rec["size"] = os.path.getsize(fw_path)
+        t = time.perf_counter()
+        with tracing.span("scan", cat="batch", firmware=fw_path):
+            rec.update(file_digests(fw_path, ("sha256", "md5")))
+            layout = scan_layout(fw_path)
+        rec["layout"] = layout
+        timing["scan"] = round(time.perf_counter() - t, 4)
+
+        jobs, rec["extract"] = None, None
+        if opts["extract"] != "none" and opts["fmk_root"]:
+            t = time.perf_counter()
+            try:
+                rec["extract"], ws, jobs = _extract(fw_path, opts["workspaces"], opts["extract"],
+                                                    opts["fmk_root"], opts["use_sudo"], log)
+            except (FMKError, OSError) as e:
+                if opts["extract"] != "auto":
+                    raise
+                log(f"[BATCH] FMK extract ไม่สำเร็จ ({e}) -> ใช้ layout")
+            timing["extract"] = round(time.perf_counter() - t, 4)
+        if jobs is None:
+            jobs = [(f"squashfs_{i}", r["offset"], r["length"], None)
+                    for i, r in enumerate(x for x in layout if x["type"] == "squashfs")]
+
+        t = time.perf_counter()
+        if opts["cache_path"]:
+            cache = AnalysisCache(opts["cache_path"], opts["cache_max_bytes"])
+        rec["boot"] = boot_delay_findings(fw_path, log)
+        rec["segments"] = []
+        for name, offset, size, meta in jobs:
+            seg = {"name": name, "offset": offset, "size": size}
+            if meta:
+                seg["meta"] = meta
+            if offset is None or not size or size <= 0:
+                seg["findings"] = ["Cannot compute rootfs"]
+            else:
+                seg["findings"] = analyze_segment(fw_path, offset, size, log, cache=cache)
+            rec["segments"].append(seg)
+        timing["analyze"] = round(time.perf_counter() - t, 4)
+        if ws and opts["keep"] and opts.get("store"):
+            t = time.perf_counter()
+            rec["store"] = _store_workspace(ws, opts["store"])
+            timing["store"] = round(time.perf_counter() - t, 4)
+        if ws and opts["keep"] and opts.get("index"):
+            t = time.perf_counter()
+            rec["index"] = _index_workspace(ws, opts["index"])
+            timing["index"] = round(time.perf_counter() - t, 4)
+    except Exception as e:
+        rec["status"] = "error"
+        rec["error"] = f"{type(e).__name__}: {e}"
+        log(traceback.format_exc())
+    finally:
+        if cache is not None:
+            cache.close()
+        if ws and not opts["keep"]:
+            shutil.rmtree(ws, ignore_errors=True)
+        elif ws:
+            rec["workspace"] = os.path.abspath(ws)
+    timing["total"] = round(time.perf_counter() - t0, 4)
+    if opts.get("trace"):
+        if ws and opts["keep"]:
+            path = os.path.join(ws, "logs", "trace.json")
+        else:
+            path = os.path.join(opts["workspaces"], _workspace_name(fw_path) + ".trace.json")
+        try:
+            tracing.export(path)
+            rec["trace"] = os.path.abspath(path)
+        except OSError as e:
+            log(f"[BATCH] trace export ไม่สำเร็จ: {e}")
+    if rec["status"] != "ok" or opts["verbose"]:
+        rec["log"] = logs[-40:]
+    return rec
+
+def run_batch(paths, opts, out, workers=None, progress=None, catalog=None):
+    """
+    Process paths on a process pool, writing one JSON line per image as it finishes
+    (and recording it in catalog, an open catalog.Catalog, from this process only).
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    counts = {"ok": 0, "error": 0}
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = {ex.submit(process_image, p, opts): p for p in paths}
+        for fut in as_completed(futures):
+            try:
+                rec = fut.result()
+            except Exception as e:  # worker process died
+                rec = {"firmware": os.path.abspath(futures[fut]), "status": "error",
+                       "error": f"{type(e).__name__}: {e}", "timing": {}}
+            counts[rec["status"]] = counts.get(rec["status"], 0) + 1
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            if catalog is not None:
+                catalog.record_batch(rec)
+            if progress:
+                progress(rec)
+    counts["seconds"] = round(time.perf_counter() - t0, 2)
+    return counts
+
+def main(argv=None):
+    cfg = load_config()
+    ap = argparse.ArgumentParser(description="Batch extract + analyze firmware images (JSON Lines report)")
+    ap.add_argument("inputs", nargs="*", help="firmware files or directories (recursive)")
+    ap.add_argument("--list", metavar="FILE", help="file with one firmware path per line ('-' = stdin)")
+    ap.add_argument("--pattern", help="filename glob when walking directories, e.g. '*.bin'")
+    ap.add_argument("-o", "--output", default="-", help="JSONL report path ('-' = stdout)")
+    ap.add_argument("-j", "--workers", type=int, default=cfg.get("batch", {}).get("workers", 0) or None,
+                    help="images processed in parallel (default: all cores)")
+    ap.add_argument("--extract", choices=EXTRACT_MODES, default="auto")
+    ap.add_argument("--fmk", help="firmware-mod-kit root (default: config.yaml fmk.root / FMK_PATH)")
+    ap.add_argument("--sudo", action="store_true", help="run FMK extract with sudo")
+    ap.add_argument("--workspaces", default=os.path.join("workspaces", "batch"))
+    ap.add_argument("--keep", action="store_true", help="keep extracted workspaces")
+    ap.add_argument("--store", default=cfg.get("store", {}).get("path") or None,
+                    help="with --keep: deduplicate kept rootfs trees into this object store")
+    ap.add_argument("--index", default=cfg.get("search", {}).get("path") or None,
+                    help="with --keep: add kept rootfs trees to this search index")
+    ap.add_argument("--catalog", default=cfg.get("catalog", {}).get("path", os.path.join("workspaces", ".catalog.sqlite")),
+                    help="record results in this workspace catalog ('' = off)")
+    ap.add_argument("--no-cache", action="store_true", help="do not use the analysis cache")
+    ap.add_argument("--trace", action="store_true", default=cfg.get("trace", {}).get("enabled", False),
+                    help="write a Chrome trace-event JSON of every image (see tracing.py)")
+    ap.add_argument("-v", "--verbose", action="store_true", help="include the log tail of every image")
+    a = ap.parse_args(argv)
+
+    paths = collect_inputs(a.inputs, a.list, a.pattern)
+    if not paths:
+        ap.error("no firmware images given")
+    ai = cfg.get("ai", {})
+    fmk_root = None
+    if a.extract != "none":
+        fmk_root = locate_fmk(a.fmk or cfg.get("fmk", {}).get("root"))
+        if fmk_root is None:
+            if a.extract != "auto":
+                ap.error("firmware-mod-kit not found (use --fmk or --extract none)")
+            print("[BATCH] FMK not found -> scan + analyze only", file=sys.stderr)
+    opts = {
+        "extract": a.extract, "fmk_root": fmk_root, "use_sudo": a.sudo,
+        "workspaces": a.workspaces, "keep": a.keep, "verbose": a.verbose, "store": a.store,
+        "index": a.index, "trace": a.trace,
+        "cache_path": None if a.no_cache else ai.get("cache", os.path.join("workspaces", ".analysis_cache.sqlite")),
+        "cache_max_bytes": int(ai.get("cache_max_mb", 64)) * 1048576,
+        "hash_cache": None if a.no_cache else cfg.get("hashing", {}).get("cache") or None,
+    }
+    os.makedirs(a.workspaces, exist_ok=True)
+
+    def progress(rec):
+        print(f"[BATCH] {rec['status']:<5} {rec['timing'].get('total', 0):8.2f}s  {rec['firmware']}",
+              file=sys.stderr)
+
+    out = sys.stdout if a.output == "-" else open(a.output, "w", encoding="utf-8")
+    catalog = Catalog(a.catalog) if a.catalog else None
+    try:
+        counts = run_batch(paths, opts, out, a.workers, progress, catalog)
+    finally:
+        if catalog is not None:
+            catalog.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"[BATCH] {len(paths)} images: ok={counts['ok']} error={counts['error']} "
+          f"in {counts['seconds']}s", file=sys.stderr)
+    return 0 if counts["error"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Native firmware signature scanner (แทน binwalk ใน scripts/extract_multi_auto.sh)
+
+ค้นหา magic ทุกตัวใน pass เดียวบน mmap ของ image (NumPy: กรอง byte แรกด้วย lookup table
+แล้วเทียบ word 4 byte กับชุด magic) จากนั้นอ่าน header เพื่อหาความยาวจริงของแต่ละส่วน:
+
+  squashfs (LE "hsqs" / BE "sqsh")  length = bytes_used จาก superblock (v2-v4)
+  jffs2    (LE / BE 0x1985 + nodetype) เดิน node ต่อกันจนสุด (ข้าม 0xFF padding), ตรวจ hdr_crc
+  uimage   (0x27051956)              length = 64 + ih_size, ตรวจ header CRC
+  trx      ("HDR0")                  length = len ใน header (v1/v2)
+  cramfs   (LE / BE 0x28cd3d45)      length = size ใน superblock, ตรวจ "Compressed ROMFS"
+  ubi      ("UBI#")                  นับ PEB ต่อเนื่องที่ขึ้นต้นด้วย EC header
+
+ผลลัพธ์เป็น layout table (list ของ dict) ที่ fw-manager.sh / GUI / extract_multi_auto.sh ใช้ได้ตรง ๆ:
+  python fw_scan.py firmware.bin            # ตาราง
+  python fw_scan.py firmware.bin --tsv      # offset<TAB>type<TAB>length<TAB>info (สำหรับ shell)
+  python fw_scan.py firmware.bin --json     # JSON
+  python fw_scan.py firmware.bin --tsv --save OUTDIR   # + OUTDIR/layout.txt, layout.json
+"""
+
+import os, sys, mmap, json, struct, zlib, re
+import numpy as np
+
+FILESYSTEMS = ("squashfs", "jffs2", "cramfs", "ubi")
+CHUNK = 16 * 1024 * 1024
+
+_JFFS2_NODETYPES = (0xE001, 0xE002, 0x2003, 0x2004, 0x6006, 0xE008, 0xE009)
+
+def _magics():
+    m = {
+        b"hsqs": ("squashfs", "<"), b"sqsh": ("squashfs", ">"),
+        b"\x27\x05\x19\x56": ("uimage", ">"),
+        b"HDR0": ("trx", "<"),
+        b"\x45\x3d\xcd\x28": ("cramfs", "<"), b"\x28\xcd\x3d\x45": ("cramfs", ">"),
+        b"UBI#": ("ubi", ">"),
+    }
+    for nt in _JFFS2_NODETYPES:
+        m[struct.pack("<HH", 0x1985, nt)] = ("jffs2", "<")
+        m[struct.pack(">HH", 0x1985, nt)] = ("jffs2", ">")
+    return m
+
+MAGICS = _magics()
+_WORDS = {struct.unpack("<I", k)[0]: v for k, v in MAGICS.items()}
+_WORD_ARRAY = np.array(sorted(_WORDS), dtype=np.uint32)
+_FIRST_BYTE = np.zeros(256, dtype=bool)
+_FIRST_BYTE[[k[0] for k in MAGICS]] = True
+
+def find_magics(mm, start=0, end=None):
+    """Single pass over the buffer; yields (offset, type, endian) in offset order."""
+    a = np.frombuffer(mm, dtype=np.uint8)
+    end = len(a) if end is None else min(end, len(a))
+    for s in range(start, end, CHUNK):
+        c = a[s:min(s + CHUNK, end) + 3]
+        n = min(CHUNK, end - s, len(c) - 3)
+        if n <= 0:
+            break
+        idx = np.flatnonzero(_FIRST_BYTE[c[:n]])
+        if not len(idx):
+            continue
+        w = (c[idx].astype(np.uint32) | (c[idx + 1].astype(np.uint32) << 8) |
+             (c[idx + 2].astype(np.uint32) << 16) | (c[idx + 3].astype(np.uint32) << 24))
+        hit = np.isin(w, _WORD_ARRAY)
+        for i, word in zip(idx[hit].tolist(), w[hit].tolist()):
+            kind, endian = _WORDS[word]
+            yield s + i, kind, endian
+
+# -------------------------------------------------
+# Header parsers: return (length, info) or None if not valid
+# -------------------------------------------------
+def _squashfs(mm, off, e):
+    if off + 96 > len(mm):
+        return None
+    major, minor = struct.unpack_from(e + "HH", mm, off + 28)
+    if major == 4:
+        (inodes, mkfs_time, block_size, fragments, comp, block_log, flags, no_ids,
+         _, _, root, bytes_used) = struct.unpack_from(e + "IIIIHHHHHHQQ", mm, off + 4)
+        if block_size != 1 << block_log or not 4096 <= block_size <= 1048576:
+            return None
+        comp_name = {1: "gzip", 2: "lzma", 3: "lzo", 4: "xz", 5: "lz4", 6: "zstd"}.get(comp, f"id{comp}")
+        info = f"v4.{minor} {comp_name} block={block_size} inodes={inodes}"
+    elif major in (2, 3):
+        block_size = struct.unpack_from(e + "I", mm, off + 51)[0]
+        if major == 3:
+            bytes_used = struct.unpack_from(e + "Q", mm, off + 63)[0]
+        else:
+            bytes_used = struct.unpack_from(e + "I", mm, off + 8)[0]
+        info = f"v{major}.{minor} block={block_size}"
+    else:
+        return None
+    if bytes_used < 96 or off + bytes_used > len(mm):
+        return None
+    return bytes_used, info + (" (big-endian)" if e == ">" else "")
+
+def _jffs2_crc(data):
+    # Linux crc32(0, ...) without pre/post inversion
+    return zlib.crc32(data, 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+_NOT_FF = re.compile(rb"[^\xff]")
+
+def _jffs2_node(mm, pos, e):
+    if pos + 12 > len(mm):
+        return None
+    magic, nodetype, totlen, hdr_crc = struct.unpack_from(e + "HHII", mm, pos)
+    if magic != 0x1985 or nodetype not in _JFFS2_NODETYPES or totlen < 12:
+        return None
+    if _jffs2_crc(mm[pos:pos + 8]) != hdr_crc or pos + totlen > len(mm):
+        return None
+    return totlen
+
+def _jffs2(mm, off, e):
+    if _jffs2_node(mm, off, e) is None:
+        return None
+    pos = end = off
+    nodes = 0
+    while pos < len(mm):
+        totlen = _jffs2_node(mm, pos, e)
+        if totlen is not None:
+            nodes += 1
+            end = pos + totlen
+            pos = (end + 3) & ~3
+            continue
+        if mm[pos] == 0xFF:
+            m = _NOT_FF.search(mm, pos)
+            if not m:
+                break
+            pos = m.start() & ~3
+            if _jffs2_node(mm, pos, e) is None:
+                break
+            continue
+        break
+    return end - off, f"nodes={nodes}" + (" (big-endian)" if e == ">" else "")
+
+def _uimage(mm, off, e):
+    if off + 64 > len(mm):
+        return None
+    hdr = bytearray(mm[off:off + 64])
+    hcrc, size = struct.unpack_from(">I", hdr, 4)[0], struct.unpack_from(">I", hdr, 12)[0]
+    hdr[4:8] = b"\0\0\0\0"
+    if zlib.crc32(hdr) != hcrc or off + 64 + size > len(mm):
+        return None
+    name = bytes(hdr[32:64]).split(b"\0", 1)[0].decode("latin-1")
+    return 64 + size, f"name='{name}' os={hdr[28]} arch={hdr[29]} type={hdr[30]} comp={hdr[31]}"
+
+def _trx(mm, off, e):
+    if off + 28 > len(mm):
+        return None
+    length, crc, flags, version = struct.unpack_from("<IIHH", mm, off + 4)
+    if version not in (1, 2) or length < 28 or off + length > len(mm):
+        return None
+    nparts = 3 if version == 1 else 4
+    parts = [p for p in struct.unpack_from(f"<{nparts}I", mm, off + 16) if p]
+    return length, f"v{version} parts=" + ",".join(f"0x{off + p:X}" for p in parts)
+
+def _cramfs(mm, off, e):
+    if off + 64 > len(mm) or mm[off + 16:off + 32] != b"Compressed ROMFS":
+        return None
+    size = struct.unpack_from(e + "I", mm, off + 4)[0]
+    if size < 64 or off + size > len(mm):
+        return None
+    return size, "big-endian" if e == ">" else ""
+
+def _ubi_ec_ok(mm, pos):
+    if pos + 64 > len(mm) or mm[pos:pos + 4] != b"UBI#":
+        return False
+    # UBI: crc32 seeded with 0xFFFFFFFF, no final xor
+    return (zlib.crc32(mm[pos:pos + 60]) ^ 0xFFFFFFFF) == struct.unpack_from(">I", mm, pos + 60)[0]
+
+def _ubi(mm, off, e):
+    if not _ubi_ec_ok(mm, off):
+        return None
+    nxt = mm.find(b"UBI#", off + 64)
+    while nxt != -1 and not _ubi_ec_ok(mm, nxt):
+        nxt = mm.find(b"UBI#", nxt + 4)
+    peb = nxt - off if nxt != -1 else len(mm) - off
+    pos = off
+    while _ubi_ec_ok(mm, pos) and pos + peb <= len(mm):
+        pos += peb
+    return pos - off, f"peb={peb} count={(pos - off) // peb}"
+
+_PARSERS = {"squashfs": _squashfs, "jffs2": _jffs2, "uimage": _uimage, "trx": _trx,
+            "cramfs": _cramfs, "ubi": _ubi}
+
+# -------------------------------------------------
+# Public API
+# -------------------------------------------------
+def scan_layout(path):
+    """
+    Return the layout table: [{'offset','end','length','type','info'}] sorted by offset.
+    Matches inside an already identified filesystem are ignored (magic bytes inside
+    compressed data); container headers (uImage/TRX) do not hide what they contain.
+    """
+    layout = []
+    if os.path.getsize(path) == 0:
+        return layout
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        claimed_end = 0
+        for off, kind, e in find_magics(mm):
+            if kind in FILESYSTEMS and off < claimed_end:
+                continue
+            res = _PARSERS[kind](mm, off, e)
+            if not res:
+                continue
+            length, info = res
+            layout.append({"offset": off, "end": off + length, "length": length,
+                           "type": kind, "info": info})
+            if kind in FILESYSTEMS:
+                claimed_end = off + length
+    return layout
+
+def format_layout(layout):
+    lines = [f"{'INDEX':<6} {'OFFSET':<12} {'END':<12} {'LENGTH':<10} {'TYPE':<9} INFO"]
+    for i, r in enumerate(layout):
+        lines.append(f"{i:<6} 0x{r['offset']:08X}   0x{r['end']:08X}   {r['length']:<10} {r['type']:<9} {r['info']}")
+    return lines
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Scan firmware image for filesystem / header signatures")
+    ap.add_argument("firmware")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--json", action="store_true")
+    g.add_argument("--tsv", action="store_true")
+    ap.add_argument("--save", metavar="DIR", help="also write DIR/layout.txt and DIR/layout.json")
+    a = ap.parse_args()
+    res = scan_layout(a.firmware)
+    if a.save:
+        os.makedirs(a.save, exist_ok=True)
+        with open(os.path.join(a.save, "layout.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(format_layout(res)) + "\n")
+        with open(os.path.join(a.save, "layout.json"), "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+    if a.json:
+        json.dump(res, sys.stdout, indent=2)
+        print()
+    elif a.tsv:
+        for r in res:
+            print(f"{r['offset']}\t{r['type']}\t{r['length']}\t{r['info']}")
+    else:
+        print("\n".join(format_layout(res)))
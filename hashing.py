@@ -0,0 +1,227 @@
+"""
+File hashing service: หลาย digest ใน pass เดียว + memo ตาม (dev, inode, size, mtime_ns, ctime_ns)
+
+- hash_file()     อ่านไฟล์ครั้งเดียว (mmap, ทีละ 4 MB) แล้ว update ทุก algorithm พร้อมกัน
+- HashService     จำผลต่อ (dev, inode, size, mtime_ns, ctime_ns) ในหน่วยความจำ และใน SQLite ถ้ากำหนด db_path
+                  ctime อยู่ใน key เพราะ inode ที่ถูกลบแล้วใช้ใหม่ได้ และ mtime ของ tree ที่แตกจาก image
+                  ตั้งเป็นเวลาใน image (ไฟล์ใหม่ขนาดเท่ากันจะได้ key เดิมถ้าไม่มี ctime – ctime ตั้งย้อนไม่ได้)
+                  ผลใหม่ลง disk เป็นชุด (commit ทันที ไม่ค้าง transaction ให้ process อื่นรอ lock)
+                  ไฟล์ที่ไม่เปลี่ยน (รวม hardlink ใน snapshot ที่แชร์ inode) จะไม่ถูกอ่านซ้ำทั้ง session
+                  hash_many() กระจายไฟล์ที่ยังไม่มีผลไปที่ thread pool (hashlib ปล่อย GIL ระหว่าง update)
+- default_service() service เดียวของทั้ง process ใช้โดย rootfs_manifest (diff / snapshot), size_cache,
+                  rebuild_squashfs (duplicates), analysis_cache และ fw_batch (report)
+
+  configure("workspaces/.hash_cache.sqlite")   # เปิด cache บน disk (hashing.cache ใน config.yaml)
+  file_digest(path)                            # sha256 hex
+  file_digests(path, ("sha256", "md5"))        # {"sha256": ..., "md5": ...} อ่านไฟล์ครั้งเดียว
+"""
+
+import os, mmap, atexit, sqlite3, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK = 4 * 1048576
+# ไฟล์เล็กอ่านตรง ๆ เร็วกว่าสร้าง mmap
+MMAP_MIN = 256 * 1024
+# แถวที่รอเขียนลง cache ระหว่าง hash_many (ไฟล์เดี่ยวเขียนทันที)
+FLUSH_ROWS = 512
+
+def hash_file(path, algorithms=("sha256",)):
+    """{algorithm: hexdigest} computed in one pass over the file."""
+    hashers = [hashlib.new(a) for a in algorithms]
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_MIN:
+            data = f.read()
+            for h in hashers:
+                h.update(data)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                for pos in range(0, size, CHUNK):
+                    chunk = view[pos:pos + CHUNK]
+                    for h in hashers:
+                        h.update(chunk)
+                    chunk.release()
+    return {a: h.hexdigest() for a, h in zip(algorithms, hashers)}
+
+def _stat_key(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+class HashService:
+    def __init__(self, db_path=None, workers=None):
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self._memo = {}           # stat key -> {alg: hex}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.db_path = db_path
+        self.conn = None
+        self._pending = []        # rows not written to the disk cache yet
+        self.hashed_files = self.hashed_bytes = 0
+        if db_path:
+            d = os.path.dirname(db_path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self.conn = sqlite3.connect(db_path, timeout=1.0, check_same_thread=False)
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS file_hash;
+                CREATE TABLE IF NOT EXISTS file_hash_v2(
+                    dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER,
+                    alg TEXT, digest TEXT,
+                    PRIMARY KEY(dev, ino, size, mtime_ns, ctime_ns, alg));
+            """)
+
+    def close(self):
+        if self.conn:
+            self.flush()
+            with self._db_lock:
+                self.conn.close()
+                self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _lookup(self, key, algorithms):
+        with self._lock:
+            known = self._memo.get(key)
+        if known and all(a in known for a in algorithms):
+            return {a: known[a] for a in algorithms}
+        if self.conn is not None:
+            with self._db_lock:
+                rows = self.conn.execute(
+                    "SELECT alg, digest FROM file_hash_v2 "
+                    "WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND ctime_ns=?",
+                    key).fetchall()
+            if rows:
+                with self._lock:
+                    known = self._memo.setdefault(key, {})
+                    known.update(rows)
+                if all(a in known for a in algorithms):
+                    return {a: known[a] for a in algorithms}
+        return None
+
+    def _store(self, key, digests, flush=True):
+        with self._lock:
+            self._memo.setdefault(key, {}).update(digests)
+            self.hashed_files += 1
+            self.hashed_bytes += key[2]
+        if self.conn is not None:
+            with self._db_lock:
+                self._pending.extend(key + (a, d) for a, d in digests.items())
+                full = len(self._pending) >= FLUSH_ROWS
+            if flush or full:
+                self.flush()
+
+    def digests(self, path, algorithms=("sha256",), st=None):
+        """{algorithm: hexdigest}; only algorithms not known for this stat key are computed."""
+        return self._digests(path, algorithms, st, flush=True)
+
+    def _digests(self, path, algorithms, st, flush):
+        st = st or os.stat(path)
+        key = _stat_key(st)
+        hit = self._lookup(key, algorithms)
+        if hit is not None:
+            return hit
+        with self._lock:
+            known = dict(self._memo.get(key, {}))
+        missing = tuple(a for a in algorithms if a not in known)
+        known.update(hash_file(path, missing))
+        self._store(key, {a: known[a] for a in missing}, flush)
+        return {a: known[a] for a in algorithms}
+
+    def digest(self, path, algorithm="sha256", st=None):
+        return self.digests(path, (algorithm,), st)[algorithm]
+
+    def hash_many(self, paths, algorithms=("sha256",), workers=None, errors=None):
+        """
+        {path: {algorithm: hexdigest}} for many files. Cached ones are answered directly;
+        the rest are hashed on a thread pool. Unreadable files map to None (or raise if errors="raise").
+        """
+        out = {}
+        todo = []
+        for p in paths:
+            try:
+                st = os.stat(p)
+            except OSError:
+                if errors == "raise":
+                    raise
+                out[p] = None
+                continue
+            hit = self._lookup(_stat_key(st), algorithms)
+            if hit is not None:
+                out[p] = hit
+            else:
+                todo.append((p, st))
+        if not todo:
+            return out
+        def one(item):
+            p, st = item
+            try:
+                return p, self._digests(p, algorithms, st, flush=False)
+            except OSError:
+                if errors == "raise":
+                    raise
+                return p, None
+        if len(todo) == 1:
+            p, res = one(todo[0])
+            out[p] = res
+        else:
+            with ThreadPoolExecutor(max_workers=workers or self.workers) as ex:
+                out.update(ex.map(one, todo))
+        self.flush()
+        return out
+
+    def flush(self):
+        """Write pending rows in one short transaction (the disk cache is best effort: a lock held by
+        another batch worker for longer than the timeout drops the rows, the memo keeps them)."""
+        if self.conn is None:
+            return
+        with self._db_lock:
+            rows, self._pending = self._pending, []
+            if not rows or self.conn is None:
+                return
+            try:
+                with self.conn:
+                    self.conn.executemany("INSERT OR REPLACE INTO file_hash_v2 VALUES (?,?,?,?,?,?,?)", rows)
+            except sqlite3.Error:
+                pass
+
+# -------------------------------------------------
+# Process-wide service
+# -------------------------------------------------
+_default = None
+_default_lock = threading.Lock()
+
+def configure(db_path=None, workers=None):
+    """(Re)create the process-wide service, optionally backed by an on-disk cache."""
+    global _default
+    with _default_lock:
+        if _default is not None:
+            _default.close()
+        _default = HashService(db_path, workers)
+    return _default
+
+def use_cache(db_path):
+    """Make sure the process-wide service uses db_path (keeps the memo if it already does)."""
+    svc = default_service()
+    return svc if svc.db_path == db_path else configure(db_path)
+
+@atexit.register
+def _close_default():
+    with _default_lock:
+        if _default is not None:
+            _default.close()
+
+def default_service():
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = HashService()
+        return _default
+
+def file_digest(path, algorithm="sha256", st=None):
+    return default_service().digest(path, algorithm, st)
+
+def file_digests(path, algorithms=("sha256",), st=None):
+    return default_service().digests(path, algorithms, st)
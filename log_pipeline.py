@@ -0,0 +1,143 @@
+"""
+Log pipeline: รับ log จากทุก thread แบบไม่บล็อก แล้วให้ GUI ดึงไปแสดงเป็นชุด ๆ
+
+  buf = LogBuffer(ring_lines=5000)
+  buf.set_file("workspaces/workbench.log")        # log เต็มทุกบรรทัด (ไม่ถูกตัด, ไม่กรอง level)
+  mark = buf.mark(); ...extract...; buf.set_file(ws + "/logs/workbench.log", replay_from=mark)
+  run_cmd(cmd, log_callback=buf)                    # run_cmd ส่งทั้ง chunk ผ่าน buf.write_lines()
+  QTimer ทุก ~100 ms:  for level, line in buf.drain(): ...   (หนึ่ง append ต่อ tick)
+
+- เก็บ history แบบ ring buffer (deque maxlen) สำหรับ re-render เมื่อเปลี่ยน level filter
+- level ของบรรทัดเดาจากข้อความ (classify) – output ดิบของ subprocess เป็น DEBUG
+- read_lines() อ่าน pipe ของ subprocess ทีละ 64 KB แทนทีละบรรทัด และยุบ progress bar ที่ใช้ '\\r'
+  เหลือสถานะสุดท้าย (mksquashfs / unsquashfs พิมพ์ progress หลายพันครั้ง); LineSplitter ใช้ร่วมกับ fmk_async
+"""
+
+import os, re, time, codecs, threading
+from collections import deque
+
+DEBUG, INFO, WARN, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARN: "WARN", ERROR: "ERROR"}
+LEVELS = {v: k for k, v in LEVEL_NAMES.items()}
+
+READ_CHUNK = 65536
+
+_ERROR_RE = re.compile(r"\b(error|failed|fail|fatal|traceback|cannot|ไม่สำเร็จ)\b|\[ERR\]", re.I)
+_WARN_RE = re.compile(r"\b(warn(ing)?|fallback|skipp?ed)\b|\[!\]|เตือน", re.I)
+
+def classify(line, default=INFO):
+    if _ERROR_RE.search(line):
+        return ERROR
+    if _WARN_RE.search(line):
+        return WARN
+    return default
+
+class LineSplitter:
+    """
+    Incremental bytes -> text lines (utf-8, invalid bytes replaced).
+    Carriage-return progress updates are collapsed to the last state of each line.
+    """
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._tail = ""
+
+    def feed(self, data):
+        text = self._decoder.decode(data)
+        if not text:
+            return []
+        parts = (self._tail + text).split("\n")
+        self._tail = parts.pop()
+        return [p.rstrip("\r").rsplit("\r", 1)[-1] for p in parts]
+
+    def finish(self):
+        tail = (self._tail + self._decoder.decode(b"", final=True)).rstrip("\r").rsplit("\r", 1)[-1]
+        self._tail = ""
+        return [tail] if tail else []
+
+def read_lines(stream, chunk=READ_CHUNK):
+    """Yield lists of text lines read from a binary pipe in large chunks (see LineSplitter)."""
+    fd = stream.fileno()
+    splitter = LineSplitter()
+    while True:
+        data = os.read(fd, chunk)
+        if not data:
+            break
+        lines = splitter.feed(data)
+        if lines:
+            yield lines
+    lines = splitter.finish()
+    if lines:
+        yield lines
+
+class LogBuffer:
+    """Thread-safe sink: callable with one message, or write_lines() for a batch."""
+
+    def __init__(self, ring_lines=5000, default_level=INFO):
+        self.default_level = default_level
+        self.history = deque(maxlen=ring_lines)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._file = None
+        self.file_path = None
+        self.count = 0            # lines written so far (for mark / replay)
+
+    def __call__(self, text, level=None):
+        self.write_lines(str(text).split("\n"), level)
+
+    write = __call__
+
+    def write_lines(self, lines, level=None):
+        if level is None:
+            items = [(classify(l, self.default_level), l) for l in lines]
+        else:
+            items = [(classify(l, level) if level < WARN else level, l) for l in lines]
+        stamp = time.strftime("%H:%M:%S")
+        with self._lock:
+            self._pending.extend(items)
+            self.history.extend((lv, l, stamp) for lv, l in items)
+            self.count += len(items)
+            if self._file is not None:
+                self._file.write(self._format(items, stamp))
+
+    @staticmethod
+    def _format(items, stamp):
+        return "".join(f"{stamp} {LEVEL_NAMES[lv]:<5} {l}\n" for lv, l in items)
+
+    def drain(self):
+        """Everything written since the last drain, as [(level, line)]."""
+        with self._lock:
+            out, self._pending = self._pending, []
+            if self._file is not None:
+                self._file.flush()
+        return out
+
+    def snapshot(self, min_level=DEBUG):
+        with self._lock:
+            return [(lv, l) for lv, l, _ in self.history if lv >= min_level]
+
+    def mark(self):
+        return self.count
+
+    def set_file(self, path, replay_from=None):
+        """
+        Stream every following line to path (appending); None stops file logging.
+        replay_from (a mark()) first copies the lines written since then, as far as the ring still holds them.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.file_path = path
+            if path:
+                d = os.path.dirname(path)
+                if d:
+                    os.makedirs(d, exist_ok=True)
+                self._file = open(path, "a", encoding="utf-8", buffering=1048576)
+                if replay_from is not None:
+                    n = min(self.count - replay_from, len(self.history))
+                    if n > 0:
+                        for lv, l, stamp in list(self.history)[-n:]:
+                            self._file.write(self._format(((lv, l),), stamp))
+
+    def close(self):
+        self.set_file(None)
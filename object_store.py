@@ -0,0 +1,316 @@
+"""
+Object store: เก็บไฟล์ของ rootfs ทุก workspace ครั้งเดียวตาม content (sha256) แล้วให้ workspace เป็น
+hardlink / reflink farm ชี้ไปที่ object – firmware ตระกูลเดียวกันใช้ busybox / libc / web UI ชุดเดียวกัน
+
+  store = ObjectStore("workspaces/.objects")
+  store.ingest_tree("workspaces/ws_a/rootfs")        # หลัง FMK extract: ไฟล์ที่มีอยู่แล้วกลายเป็น link
+  store.materialize_image(fw, offset, "ws_b/rootfs") # extract squashfs ตรงเข้า store (ไม่เขียนไฟล์ซ้ำเลย)
+  store.gc()                                          # ลบ object ที่ไม่มี tree ไหนอ้างถึงแล้ว
+
+  python object_store.py ingest workspaces/ws_a/rootfs
+  python object_store.py extract firmware.bin 0x120000 workspaces/ws_b/rootfs
+  python object_store.py gc | stats
+
+layout: <root>/objects/<2 hex>/<sha256>-<mode octal>   (mode อยู่ใน key เพราะ hardlink ใช้ inode ร่วมกัน)
+        <root>/store.sqlite   refs(tree, key, n) = จำนวนไฟล์ใน tree ที่ใช้ object นั้น
+gc: ลบ refs ของ tree ที่ไม่มีอยู่แล้ว จากนั้นลบ object ที่ไม่มี ref และไม่มี hardlink อื่น (st_nlink == 1)
+
+วิธี link ใช้ fs_utils.clone_file (reflink -> hardlink -> copy) – ถ้าเป็น hardlink ไฟล์ใน workspace ใช้ inode
+ร่วมกับ object: เขียนทับแบบ in-place จะกระทบทุก workspace จึงต้อง break_hardlink() ก่อน (patch_utils ทำให้แล้ว)
+และ mtime ของไฟล์ที่เนื้อหาเหมือนกันจะเป็นค่าเดียวกัน
+"""
+
+import os, sys, stat, time, errno, sqlite3, hashlib, argparse
+
+from fs_utils import clone_file
+from hashing import file_digest
+
+MEMORY_LIMIT = 16 * 1048576    # materialize: ไฟล์ที่เล็กกว่านี้ hash ใน memory ก่อน (ซ้ำ = ไม่เขียนเลย)
+OBJECT_BATCH = 256             # object ใหม่ที่รอบันทึกลง objects ก่อน commit (ไม่ถือ write lock ข้าม file I/O)
+
+class ObjectStore:
+    def __init__(self, root, methods=("reflink", "hardlink", "copy")):
+        self.root = root
+        self.methods = methods
+        self._clone_state = {}
+        self._new_objects = []     # (key, size, created) not in the objects table yet
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, "store.sqlite"), timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS objects(key TEXT PRIMARY KEY, size INTEGER, created REAL);
+            CREATE TABLE IF NOT EXISTS refs(tree TEXT, key TEXT, n INTEGER, PRIMARY KEY(tree, key));
+            CREATE INDEX IF NOT EXISTS refs_key ON refs(key);
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn:
+            self._flush_objects()
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    # ---------- objects ----------
+    @staticmethod
+    def key(digest, mode):
+        return f"{digest}-{stat.S_IMODE(mode):04o}"
+
+    def object_path(self, key):
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    def _record_object(self, key, size):
+        self._new_objects.append((key, size, time.time()))
+        if len(self._new_objects) >= OBJECT_BATCH:
+            self._flush_objects()
+
+    def _flush_objects(self):
+        """Write pending object rows in one short transaction (other workers only wait for that)."""
+        rows, self._new_objects = self._new_objects, []
+        if rows:
+            with self.conn:
+                self.conn.executemany("INSERT OR IGNORE INTO objects VALUES (?,?,?)", rows)
+
+    def _link_out(self, obj, dst):
+        """dst (must not exist) becomes a clone of object obj; returns the method used."""
+        return clone_file(obj, dst, self.methods, self._clone_state)
+
+    def _adopt(self, path, key, size):
+        """Make the existing file at path the object for key (zero copy when on the same filesystem)."""
+        obj = self.object_path(key)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        try:
+            os.link(path, obj)
+        except FileExistsError:
+            return False
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            tmp = os.path.join(self.root, "tmp", f"{key}.{os.getpid()}")
+            clone_file(path, tmp, ("reflink", "copy"))
+            try:
+                os.link(tmp, obj)
+            except FileExistsError:
+                return False
+            finally:
+                os.unlink(tmp)
+        self._record_object(key, size)
+        return True
+
+    def _replace_with_object(self, path, key):
+        tmp = f"{path}.objstore~"
+        self._link_out(self.object_path(key), tmp)
+        os.replace(tmp, path)
+
+    # ---------- trees ----------
+    def ingest_tree(self, tree_dir):
+        """
+        Deduplicate an extracted tree against the store: every regular file becomes a link to the
+        object holding its content (new content is adopted as a new object). Replaces the tree's refs.
+        Returns {"files", "new", "linked", "bytes_saved"}.
+        """
+        tree = os.path.abspath(tree_dir)
+        refs = {}
+        stats = {"files": 0, "new": 0, "linked": 0, "bytes_saved": 0}
+        for root, dirs, files in os.walk(tree):
+            for name in files:
+                path = os.path.join(root, name)
+                st = os.lstat(path)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                key = self.key(file_digest(path, st=st), st.st_mode)
+                obj = self.object_path(key)
+                stats["files"] += 1
+                refs[key] = refs.get(key, 0) + 1
+                try:
+                    ost = os.stat(obj)
+                except FileNotFoundError:
+                    ost = None
+                if ost is not None and (ost.st_dev, ost.st_ino) == (st.st_dev, st.st_ino):
+                    continue
+                if ost is None and self._adopt(path, key, st.st_size):
+                    stats["new"] += 1
+                    continue
+                self._replace_with_object(path, key)
+                stats["linked"] += 1
+                stats["bytes_saved"] += st.st_size
+        self._set_refs(tree, refs)
+        return stats
+
+    def materialize_image(self, image, offset, dest_dir, log_callback=None):
+        """
+        Extract the SquashFS v4 filesystem at offset of image into dest_dir (must not exist) straight
+        through the store: content already stored is only linked, new content is written once as an
+        object. Returns {"files", "new", "linked", "bytes_written", "bytes_saved"}.
+        """
+        from squashfs_reader import SquashFSImage
+        tree = os.path.abspath(dest_dir)
+        os.makedirs(tree)
+        refs = {}
+        dirs = []
+        stats = {"files": 0, "new": 0, "linked": 0, "bytes_written": 0, "bytes_saved": 0}
+        with SquashFSImage(image, offset) as img:
+            for rel, ino in img.walk():
+                path = os.path.join(tree, rel)
+                if ino.is_dir():
+                    os.mkdir(path)
+                    dirs.append((path, ino))
+                elif ino.is_symlink():
+                    os.symlink(ino.target, path)
+                elif ino.is_file():
+                    key, written = self._put_stream(img, ino)
+                    method = self._link_out(self.object_path(key), path)
+                    if method != "hardlink":
+                        os.utime(path, (ino.mtime, ino.mtime))
+                    refs[key] = refs.get(key, 0) + 1
+                    stats["files"] += 1
+                    stats["new" if written else "linked"] += 1
+                    stats["bytes_written" if written else "bytes_saved"] += ino.size
+                else:
+                    try:
+                        os.mknod(path, ino.st_mode, ino.rdev)
+                    except OSError as e:
+                        if log_callback:
+                            log_callback(f"[STORE] skip {rel}: {e}")
+            os.chmod(tree, img.root.mode)
+        for path, ino in reversed(dirs):
+            os.chmod(path, ino.mode)
+            os.utime(path, (ino.mtime, ino.mtime))
+        self._set_refs(tree, refs)
+        return stats
+
+    def _put_stream(self, img, ino):
+        """(key, written) for a file inode; content is written only if the store lacks it."""
+        if ino.size <= MEMORY_LIMIT:
+            data = b"".join(img.iter_file(ino))
+            key = self.key(hashlib.sha256(data).hexdigest(), ino.mode)
+            if os.path.exists(self.object_path(key)):
+                return key, False
+            return key, self._write_object(key, ino, [data])
+        # large file: stream to a temp object, hashing on the way
+        tmp = os.path.join(self.root, "tmp", f"stream.{os.getpid()}.{ino.number}")
+        h = hashlib.sha256()
+        with open(tmp, "wb") as f:
+            for chunk in img.iter_file(ino):
+                h.update(chunk)
+                f.write(chunk)
+        key = self.key(h.hexdigest(), ino.mode)
+        try:
+            if os.path.exists(self.object_path(key)):
+                return key, False
+            return key, self._write_object(key, ino, None, tmp)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _write_object(self, key, ino, chunks, src=None):
+        obj = self.object_path(key)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        tmp = src or os.path.join(self.root, "tmp", f"{key}.{os.getpid()}")
+        if chunks is not None:
+            with open(tmp, "wb") as f:
+                for c in chunks:
+                    f.write(c)
+        os.chmod(tmp, ino.mode)
+        os.utime(tmp, (ino.mtime, ino.mtime))
+        try:
+            os.link(tmp, obj)            # atomic publish; another process may have won the race
+        except FileExistsError:
+            return False
+        finally:
+            os.unlink(tmp)
+        self._record_object(key, ino.size)
+        return True
+
+    def _set_refs(self, tree, refs):
+        self._flush_objects()
+        with self.conn:
+            self.conn.execute("DELETE FROM refs WHERE tree=?", (tree,))
+            self.conn.executemany("INSERT INTO refs VALUES (?,?,?)",
+                                  ((tree, k, n) for k, n in refs.items()))
+
+    def release(self, tree_dir):
+        """Forget a tree's references (call before / after deleting it; gc() also notices)."""
+        with self.conn:
+            self.conn.execute("DELETE FROM refs WHERE tree=?", (os.path.abspath(tree_dir),))
+
+    # ---------- gc / stats ----------
+    def gc(self, dry_run=False):
+        """
+        Drop refs of trees that no longer exist, then delete objects nobody references and that
+        have no other hardlink. Returns {"trees_dropped", "objects_removed", "bytes_freed"}.
+        """
+        trees = [t for (t,) in self.conn.execute("SELECT DISTINCT tree FROM refs")]
+        gone = [t for t in trees if not os.path.isdir(t)]
+        live = {k for (k,) in self.conn.execute(
+            "SELECT DISTINCT key FROM refs WHERE tree NOT IN (%s)" % ",".join("?" * len(gone)), gone)}
+        removed, freed = [], 0
+        base = os.path.join(self.root, "objects")
+        for sub in os.listdir(base):
+            d = os.path.join(base, sub)
+            for key in os.listdir(d):
+                if key in live:
+                    continue
+                path = os.path.join(d, key)
+                st = os.lstat(path)
+                if st.st_nlink > 1:      # still hardlinked from a tree the store does not track
+                    continue
+                if not dry_run:
+                    os.unlink(path)
+                removed.append(key)
+                freed += st.st_size
+        if not dry_run:
+            with self.conn:
+                self.conn.executemany("DELETE FROM refs WHERE tree=?", ((t,) for t in gone))
+                self.conn.executemany("DELETE FROM objects WHERE key=?", ((k,) for k in removed))
+        return {"trees_dropped": len(gone), "objects_removed": len(removed), "bytes_freed": freed}
+
+    def stats(self):
+        """Stored bytes vs. the bytes the referencing trees would take without dedup."""
+        objects, stored = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+        trees, logical = self.conn.execute(
+            "SELECT COUNT(DISTINCT r.tree), COALESCE(SUM(r.n * o.size), 0) "
+            "FROM refs r JOIN objects o ON o.key = r.key").fetchone()
+        return {"objects": objects, "stored_bytes": stored, "trees": trees, "logical_bytes": logical}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Content-addressed object store for extracted rootfs trees")
+    ap.add_argument("--store", default=os.path.join("workspaces", ".objects"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("ingest", help="deduplicate extracted trees into the store")
+    p.add_argument("trees", nargs="+")
+    p = sub.add_parser("extract", help="extract a squashfs straight into a store-backed tree")
+    p.add_argument("image")
+    p.add_argument("offset", type=lambda s: int(s, 0))
+    p.add_argument("dest")
+    p = sub.add_parser("release", help="forget trees (e.g. before deleting them)")
+    p.add_argument("trees", nargs="+")
+    p = sub.add_parser("gc", help="remove unreferenced objects")
+    p.add_argument("--dry-run", action="store_true")
+    sub.add_parser("stats")
+    a = ap.parse_args(argv)
+
+    with ObjectStore(a.store) as store:
+        if a.cmd == "ingest":
+            for t in a.trees:
+                print(t, store.ingest_tree(t))
+        elif a.cmd == "extract":
+            print(a.dest, store.materialize_image(a.image, a.offset, a.dest,
+                                                  log_callback=lambda m: print(m, file=sys.stderr)))
+        elif a.cmd == "release":
+            for t in a.trees:
+                store.release(t)
+        elif a.cmd == "gc":
+            print(store.gc(a.dry_run))
+        else:
+            print(store.stats())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
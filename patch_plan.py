@@ -0,0 +1,109 @@
+"""
+Patch plan: แผน patch แบบ declarative (YAML / JSON) ใช้กับหลาย workspace / segment พร้อมกัน
+
+  python patch_plan.py harden.yaml workspaces/ -j 16 -o report.jsonl
+  python patch_plan.py harden.yaml workspaces/ws_a/rootfs --dry-run
+
+plan:
+  name: harden
+  ops:
+    - {op: root_password, password: ""}        # ล็อก root
+    - {op: serial_shell, device: ttyS0}
+    - {op: edit, path: etc/inetd.conf, delete: ["^telnet\\s"]}
+    - {op: file, path: etc/banner, source: files/banner, mode: "0644"}
+    - {op: remove, path: etc/init.d/S90telnet}
+
+รูปแบบ op ดู patch_utils.py – plan ถูก compile ครั้งเดียว (hash รหัสผ่าน, อ่าน source) แล้ว
+apply กับทุก target บน thread pool; แต่ละไฟล์ใน target ถูกอ่าน/เขียนอย่างมากครั้งเดียว
+target = rootfs directory ที่พบใต้ path ที่ให้ (workspace single / ทุก segment ของ multi-squash)
+report หนึ่งบรรทัด JSON ต่อ target: status, actions, written, removed, error, seconds
+"""
+
+import os, sys, json, time, argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import yaml
+
+from patch_utils import compile_ops, apply_ops, PatchError
+
+def load_plan(path):
+    """Returns (name, compiled ops); `source` paths are relative to the plan file."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            plan = yaml.safe_load(f)     # JSON is valid YAML
+    except (OSError, yaml.YAMLError) as e:
+        raise PatchError(f"อ่าน plan ไม่ได้: {e}")
+    if isinstance(plan, list):
+        plan = {"ops": plan}
+    if not isinstance(plan, dict) or not isinstance(plan.get("ops"), list):
+        raise PatchError("plan ต้องมี ops (list)")
+    name = plan.get("name") or os.path.splitext(os.path.basename(path))[0]
+    return name, compile_ops(plan["ops"], base_dir=os.path.dirname(os.path.abspath(path)))
+
+def find_targets(paths):
+    """rootfs directories under each path (a rootfs itself, a segment, or a whole workspace tree)."""
+    out = []
+    for p in paths:
+        p = os.path.normpath(p)
+        if os.path.basename(p) == "rootfs" or os.path.isdir(os.path.join(p, "etc")):
+            out.append(p)
+            continue
+        for root, dirs, _ in os.walk(p):
+            if "rootfs" in dirs:
+                out.append(os.path.join(root, "rootfs"))
+            # never descend into extracted trees or snapshots
+            dirs[:] = sorted(d for d in dirs if d not in ("rootfs", "rootfs_original"))
+    return out
+
+def apply_one(target, ops, dry_run=False):
+    t0 = time.perf_counter()
+    rec = {"target": os.path.abspath(target), "status": "ok"}
+    try:
+        rec.update(apply_ops(target, ops, dry_run))
+    except (PatchError, OSError) as e:
+        rec["status"] = "error"
+        rec["error"] = str(e)
+    rec["seconds"] = round(time.perf_counter() - t0, 4)
+    return rec
+
+def apply_plan(ops, targets, workers=None, dry_run=False):
+    """Yield one report record per target as it finishes (file I/O bound -> threads)."""
+    workers = max(1, workers or min(32, (os.cpu_count() or 1) * 4))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(apply_one, t, ops, dry_run) for t in targets]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Apply a YAML/JSON patch plan to many rootfs trees")
+    ap.add_argument("plan")
+    ap.add_argument("targets", nargs="+", help="workspace / segment / rootfs directories")
+    ap.add_argument("-j", "--workers", type=int, default=None)
+    ap.add_argument("-o", "--output", default="-", help="JSONL report path ('-' = stdout)")
+    ap.add_argument("--dry-run", action="store_true", help="report what would change, write nothing")
+    a = ap.parse_args(argv)
+
+    try:
+        name, ops = load_plan(a.plan)
+    except PatchError as e:
+        ap.error(str(e))
+    targets = find_targets(a.targets)
+    if not targets:
+        ap.error("no rootfs directories found")
+    counts = {"ok": 0, "error": 0}
+    t0 = time.perf_counter()
+    out = sys.stdout if a.output == "-" else open(a.output, "w", encoding="utf-8")
+    try:
+        for rec in apply_plan(ops, targets, a.workers, a.dry_run):
+            rec["plan"] = name
+            counts[rec["status"]] += 1
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"[PLAN] {name}: {len(targets)} targets ok={counts['ok']} error={counts['error']} "
+          f"in {time.perf_counter() - t0:.2f}s{' (dry run)' if a.dry_run else ''}", file=sys.stderr)
+    return 0 if counts["error"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
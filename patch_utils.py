@@ -6,155 +6,328 @@ Features:
 - Enable/disable (rudimentary) telnet / ftp services
 - Ensure serial shell (getty) line in /etc/inittab
 - Simple service script creation if inetd.conf absent
+- Generic file add / replace / line edit / remove
 - Safety: makes a backup copy of each modified file (.bak once)
+- Safety: breaks hardlinks to the rootfs_original snapshot before any write
+
+ทุก patch ถูก compile เป็น ops (compile_ops) แล้ว apply_ops รวมการแก้ของทุก op ต่อไฟล์:
+แต่ละไฟล์ถูกอ่านและเขียนอย่างมากหนึ่งครั้งต่อการ apply (ไม่ว่าจะมีกี่ op แตะไฟล์เดียวกัน)
+op format (dict, จาก YAML/JSON ผ่าน patch_plan.py ได้):
+  {op: root_password, password: "..."}          "" = ล็อกด้วย !
+  {op: serial_shell, device: ttyS0}
+  {op: telnet} / {op: ftp}
+  {op: file, path: etc/banner, content: "..." | source: host/file, mode: "0644", overwrite: true}
+  {op: edit, path: etc/profile, sub: [[regex, repl], ...], delete: [regex, ...],
+             ensure: [line, ...], append: "text", create: false}
+  {op: remove, path: etc/init.d/S50httpd}
 
 NOTE:
 These patches assume a BusyBox style environment.
 Adjust for target firmware specifics if needed.
 """
 
-import os, shutil, stat
+import os, re, shutil
 from passlib.hash import sha512_crypt
+from fs_utils import break_hardlink
 
 class PatchError(Exception):
     pass
 
 def _safe_backup(path):
+    # rootfs_original may share this inode (hardlink snapshot) -> write to a private copy
+    break_hardlink(path)
     if os.path.isfile(path) and not os.path.isfile(path + ".bak"):
         try:
             shutil.copy2(path, path + ".bak")
         except Exception:
             pass
 
+# -------------------------------------------------
+# Text transforms (pure: text in -> text out)
+# -------------------------------------------------
+TELNET_LINE = "telnet stream tcp nowait root /bin/busybox busybox telnetd"
+FTP_LINE = "ftp stream tcp nowait root /bin/busybox busybox ftpd -w /"
+
+def root_password_hash(new_password):
+    # rounds can be tuned
+    return "!" if new_password == "" else sha512_crypt.hash(new_password, rounds=5000)
+
+def _set_root_hash(text, new_hash):
+    lines = text.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if line.startswith("root:"):
+            parts = line.rstrip("\n").split(":")
+            if len(parts) < 2:
+                raise PatchError("รูปแบบบรรทัด root ใน shadow ผิดปกติ")
+            parts[1] = new_hash
+            lines[i] = ":".join(parts) + "\n"
+            return "".join(lines)
+    raise PatchError("ไม่พบ user root ใน shadow")
+
+def _append(text, extra):
+    if text and not text.endswith("\n"):
+        text += "\n"
+    return text + extra
+
+def _service_script(label, daemon):
+    return ("#!/bin/sh\n"
+            f"# Auto-added {label} start script\n"
+            f"echo 'Starting {daemon}'\n")
+
+# -------------------------------------------------
+# Ops
+# -------------------------------------------------
+def _mode(value):
+    if value is None:
+        return None
+    return int(value, 8) if isinstance(value, str) else int(value)
+
+def _rel(path):
+    rel = os.path.normpath(str(path).lstrip("/"))
+    if rel == "." or rel.startswith(".."):
+        raise PatchError(f"path ไม่อยู่ใน rootfs: {path}")
+    return rel
+
+def compile_ops(ops, base_dir="."):
+    """
+    Validate and normalize ops once (password hashed, source files read) so the same
+    compiled list can be applied to any number of rootfs trees.
+    """
+    out = []
+    for i, op in enumerate(ops or []):
+        if isinstance(op, str):
+            op = {"op": op}
+        kind = op.get("op")
+        o = {"op": kind}
+        if kind == "root_password":
+            o["hash"] = op["hash"] if "hash" in op else root_password_hash(str(op.get("password", "")))
+        elif kind == "serial_shell":
+            o["device"] = op.get("device", "ttyS0")
+        elif kind in ("telnet", "ftp"):
+            pass
+        elif kind == "file":
+            o["path"] = _rel(op["path"])
+            if "source" in op:
+                with open(os.path.join(base_dir, op["source"]), "rb") as f:
+                    o["content"] = f.read().decode("utf-8", "surrogateescape")
+            else:
+                o["content"] = str(op.get("content", ""))
+            o["mode"] = _mode(op.get("mode"))
+            o["overwrite"] = bool(op.get("overwrite", True))
+        elif kind == "edit":
+            o["path"] = _rel(op["path"])
+            o["sub"] = [(re.compile(p, re.M), r) for p, r in op.get("sub", [])]
+            o["delete"] = [re.compile(p) for p in op.get("delete", [])]
+            o["ensure"] = [str(l) for l in op.get("ensure", [])]
+            o["append"] = op.get("append")
+            o["create"] = bool(op.get("create", False))
+        elif kind == "remove":
+            o["path"] = _rel(op["path"])
+        else:
+            raise PatchError(f"op #{i}: ไม่รู้จัก op '{kind}'")
+        out.append(o)
+    return out
+
+class _File:
+    """One rootfs file: read at most once, written at most once."""
+    __slots__ = ("path", "orig", "text", "mode", "loaded", "remove")
+
+    def __init__(self, path):
+        self.path = path
+        self.loaded = False
+        self.mode = None
+        self.remove = False
+
+    def load(self):
+        if not self.loaded:
+            self.loaded = True
+            self.orig = None
+            if os.path.isfile(self.path):
+                with open(self.path, "rb") as f:
+                    self.orig = f.read().decode("utf-8", "surrogateescape")
+            self.text = self.orig
+        return self
+
+    @property
+    def exists(self):
+        return self.load().text is not None
+
+class _Batch:
+    def __init__(self, rootfs_dir):
+        self.root = rootfs_dir
+        self.real_root = os.path.realpath(rootfs_dir)
+        self.files = {}
+        self.actions = []
+
+    def file(self, rel, follow=True):
+        f = self.files.get(rel)
+        if f is None:
+            path = os.path.join(self.root, rel)
+            real = os.path.realpath(path if follow else os.path.dirname(path))
+            # a symlink (e.g. etc -> /tmp/etc) must not send writes outside the rootfs
+            if os.path.commonpath([real, self.real_root]) != self.real_root:
+                raise PatchError(f"{rel} ชี้ออกนอก rootfs ({real})")
+            f = self.files[rel] = _File(path)
+        return f
+
+    def service(self, name, label, line, keyword, script, daemon, cmd):
+        inetd = self.file(os.path.join("etc", "inetd.conf"))
+        if inetd.exists:
+            if keyword(inetd.text):
+                return
+            inetd.text = _append(inetd.text, "\n# Added by patch_utils\n" + line + "\n")
+        else:
+            # fallback: create simple rc script
+            f = self.file(os.path.join("etc", "init.d", script))
+            if f.exists or os.path.lexists(f.path):
+                return
+            f.text = _service_script(label, daemon) + cmd
+            f.mode = 0o755
+        self.actions.append(f"{name}_enabled")
+
+    def apply(self, o):
+        kind = o["op"]
+        if kind == "root_password":
+            f = self.file(os.path.join("etc", "shadow"))
+            if not f.exists:
+                raise PatchError("ไม่พบไฟล์ shadow")
+            text = _set_root_hash(f.text, o["hash"])
+            if text != f.text:
+                f.text = text
+                self.actions.append("root_password_set")
+        elif kind == "serial_shell":
+            device = o["device"]
+            line = f"{device}::respawn:/sbin/getty -L {device} 115200 vt100\n"
+            f = self.file(os.path.join("etc", "inittab"))
+            if not f.exists:
+                # Create minimal inittab
+                f.text = "# Generated by patch_utils\n" + line
+            elif device in f.text and "getty" in f.text:
+                return  # already present
+            else:
+                f.text = _append(f.text, line)
+            self.actions.append("serial_shell_added")
+        elif kind == "telnet":
+            self.service("telnet", "telnet", TELNET_LINE, lambda t: "telnet" in t, "S90telnet", "telnetd",
+                         "(/bin/busybox telnetd || /usr/sbin/telnetd) &\n")
+        elif kind == "ftp":
+            self.service("ftp", "FTP", FTP_LINE, lambda t: "ftp " in t or "ftp\t" in t, "S91ftp", "ftpd",
+                         "(/bin/busybox ftpd -w / || /usr/sbin/ftpd -w /) &\n")
+        elif kind == "file":
+            f = self.file(o["path"])
+            if f.exists and not o["overwrite"]:
+                return
+            mode_differs = o["mode"] is not None and (
+                f.orig is None or os.stat(f.path).st_mode & 0o7777 != o["mode"])
+            if f.text != o["content"] or mode_differs:
+                f.text = o["content"]
+                f.mode = o["mode"]
+                self.actions.append(f"file:{o['path']}")
+        elif kind == "edit":
+            f = self.file(o["path"])
+            created = not f.exists
+            if created:
+                if not o["create"]:
+                    raise PatchError(f"ไม่พบไฟล์ {o['path']}")
+                f.text = ""
+            text = f.text
+            for rx, repl in o["sub"]:
+                text = rx.sub(repl, text)
+            if o["delete"]:
+                text = "".join(l for l in text.splitlines(keepends=True)
+                               if not any(rx.search(l) for rx in o["delete"]))
+            present = set(text.splitlines())
+            for line in o["ensure"]:
+                if line not in present:
+                    text = _append(text, line + "\n")
+                    present.add(line)
+            if o["append"]:
+                text = _append(text, o["append"])
+            if text != f.text or created:
+                f.text = text
+                self.actions.append(f"edit:{o['path']}")
+        elif kind == "remove":
+            f = self.file(o["path"], follow=False)
+            if os.path.lexists(f.path) and not os.path.isdir(f.path):
+                f.load()
+                f.text = None
+                f.remove = True
+                self.actions.append(f"remove:{o['path']}")
+
+    def commit(self, dry_run=False):
+        """Write every changed file once; returns (written, removed) rel paths."""
+        written, removed = [], []
+        for rel, f in sorted(self.files.items()):
+            if f.remove and f.text is None:
+                removed.append(rel)
+                if not dry_run and os.path.lexists(f.path):
+                    os.remove(f.path)
+                continue
+            if not f.loaded or f.text is None or (f.text == f.orig and f.mode is None):
+                continue
+            written.append(rel)
+            if dry_run:
+                continue
+            if f.orig is not None:
+                _safe_backup(f.path)
+            else:
+                os.makedirs(os.path.dirname(f.path), exist_ok=True)
+            if f.text != f.orig:
+                with open(f.path, "wb") as out:
+                    out.write(f.text.encode("utf-8", "surrogateescape"))
+            if f.mode is not None:
+                os.chmod(f.path, f.mode)
+        return written, removed
+
+def apply_ops(rootfs_dir, ops, dry_run=False):
+    """
+    Apply compiled ops to one rootfs. All edits are staged in memory first, so a failing op
+    leaves the tree untouched. Returns {"actions", "written", "removed"}.
+    """
+    if not os.path.isdir(rootfs_dir):
+        raise PatchError(f"ไม่พบ rootfs directory: {rootfs_dir}")
+    batch = _Batch(rootfs_dir)
+    for o in ops:
+        batch.apply(o)
+    written, removed = batch.commit(dry_run)
+    return {"actions": batch.actions, "written": written, "removed": removed}
+
+# -------------------------------------------------
+# Single-purpose helpers (each one a one-op batch)
+# -------------------------------------------------
 def patch_root_password(rootfs_dir, new_password: str):
-    shadow = os.path.join(rootfs_dir, "etc", "shadow")
-    if not os.path.isfile(shadow):
-        raise PatchError("ไม่พบไฟล์ shadow")
-    _safe_backup(shadow)
-
-    if new_password == "":
-        new_hash = "!"
-    else:
-        # rounds can be tuned
-        new_hash = sha512_crypt.hash(new_password, rounds=5000)
-
-    lines = []
-    found = False
-    with open(shadow, "r", encoding="utf-8", errors="ignore") as f:
-        for line in f:
-            if line.startswith("root:"):
-                parts = line.rstrip("\n").split(":")
-                if len(parts) < 2:
-                    raise PatchError("รูปแบบบรรทัด root ใน shadow ผิดปกติ")
-                parts[1] = new_hash
-                line = ":".join(parts) + "\n"
-                found = True
-            lines.append(line)
-    if not found:
-        raise PatchError("ไม่พบ user root ใน shadow")
-
-    with open(shadow, "w", encoding="utf-8") as f:
-        f.writelines(lines)
+    apply_ops(rootfs_dir, compile_ops([{"op": "root_password", "password": new_password}]))
     return True
 
 def ensure_serial_shell(rootfs_dir, device="ttyS0"):
-    inittab = os.path.join(rootfs_dir, "etc", "inittab")
-    line_template = f"{device}::respawn:/sbin/getty -L {device} 115200 vt100\n"
-    if not os.path.isfile(inittab):
-        # Create minimal inittab
-        os.makedirs(os.path.dirname(inittab), exist_ok=True)
-        with open(inittab, "w", encoding="utf-8") as f:
-            f.write("# Generated by patch_utils\n")
-            f.write(line_template)
-        return True
-
-    with open(inittab, "r", encoding="utf-8", errors="ignore") as f:
-        content = f.read()
-    if device in content and "getty" in content:
-        return False  # already present
-    _safe_backup(inittab)
-    with open(inittab, "a", encoding="utf-8") as f:
-        f.write(line_template)
-    return True
+    return bool(apply_ops(rootfs_dir, compile_ops([{"op": "serial_shell", "device": device}]))["actions"])
 
 def enable_telnet(rootfs_dir):
     """
     Try to enable telnet via /etc/inetd.conf if present, otherwise create init script.
     """
-    etc_dir = os.path.join(rootfs_dir, "etc")
-    inetd = os.path.join(etc_dir, "inetd.conf")
-    # line variants
-    candidates = [
-        "telnet stream tcp nowait root /bin/busybox busybox telnetd",
-        "telnet stream tcp nowait root /usr/sbin/telnetd telnetd"
-    ]
-    os.makedirs(etc_dir, exist_ok=True)
-    if os.path.isfile(inetd):
-        with open(inetd, "r", encoding="utf-8", errors="ignore") as f:
-            txt = f.read()
-        if "telnet" in txt:
-            return False
-        _safe_backup(inetd)
-        with open(inetd, "a", encoding="utf-8") as f:
-            f.write("\n# Added by patch_utils\n" + candidates[0] + "\n")
-        return True
-    # fallback: create simple rc script
-    initd = os.path.join(rootfs_dir, "etc", "init.d")
-    os.makedirs(initd, exist_ok=True)
-    script = os.path.join(initd, "S90telnet")
-    if not os.path.exists(script):
-        with open(script, "w", encoding="utf-8") as f:
-            f.write("#!/bin/sh\n")
-            f.write("# Auto-added telnet start script\n")
-            f.write("echo 'Starting telnetd'\n")
-            f.write("(/bin/busybox telnetd || /usr/sbin/telnetd) &\n")
-        os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
-        return True
-    return False
+    return bool(apply_ops(rootfs_dir, compile_ops(["telnet"]))["actions"])
 
 def enable_ftp(rootfs_dir):
     """
     Rudimentary attempt. If inetd.conf exists append; else create script.
     """
-    etc_dir = os.path.join(rootfs_dir, "etc")
-    inetd = os.path.join(etc_dir, "inetd.conf")
-    candidates = [
-        "ftp stream tcp nowait root /bin/busybox busybox ftpd -w /",
-        "ftp stream tcp nowait root /usr/sbin/ftpd ftpd -w /"
-    ]
-    os.makedirs(etc_dir, exist_ok=True)
-    if os.path.isfile(inetd):
-        with open(inetd, "r", encoding="utf-8", errors="ignore") as f:
-            txt = f.read()
-        if "ftp " in txt or "ftp\t" in txt:
-            return False
-        _safe_backup(inetd)
-        with open(inetd, "a", encoding="utf-8") as f:
-            f.write("\n# Added by patch_utils\n" + candidates[0] + "\n")
-        return True
-    initd = os.path.join(rootfs_dir, "etc", "init.d")
-    os.makedirs(initd, exist_ok=True)
-    script = os.path.join(initd, "S91ftp")
-    if not os.path.exists(script):
-        with open(script, "w", encoding="utf-8") as f:
-            f.write("#!/bin/sh\n")
-            f.write("# Auto-added FTP start script\n")
-            f.write("echo 'Starting ftpd'\n")
-            f.write("(/bin/busybox ftpd -w / || /usr/sbin/ftpd -w /) &\n")
-        os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
-        return True
-    return False
+    return bool(apply_ops(rootfs_dir, compile_ops(["ftp"]))["actions"])
 
-def patch_services(rootfs_dir, ensure_serial=True, enable_telnet_flag=False, enable_ftp_flag=False,
-                   serial_device="ttyS0"):
-    actions = []
+def service_ops(ensure_serial=True, enable_telnet_flag=False, enable_ftp_flag=False, serial_device="ttyS0",
+                root_password=None):
+    ops = []
+    if root_password is not None:
+        ops.append({"op": "root_password", "password": root_password})
     if ensure_serial:
-        if ensure_serial_shell(rootfs_dir, serial_device):
-            actions.append("serial_shell_added")
+        ops.append({"op": "serial_shell", "device": serial_device})
     if enable_telnet_flag:
-        if enable_telnet(rootfs_dir):
-            actions.append("telnet_enabled")
+        ops.append({"op": "telnet"})
     if enable_ftp_flag:
-        if enable_ftp(rootfs_dir):
-            actions.append("ftp_enabled")
-    return actions
\ No newline at end of file
+        ops.append({"op": "ftp"})
+    return ops
+
+def patch_services(rootfs_dir, ensure_serial=True, enable_telnet_flag=False, enable_ftp_flag=False,
+                   serial_device="ttyS0"):
+    ops = service_ops(ensure_serial, enable_telnet_flag, enable_ftp_flag, serial_device)
+    return apply_ops(rootfs_dir, compile_ops(ops))["actions"]
@@ -0,0 +1,15 @@
+"""
+multiprocessing context ร่วมของทุก process pool (SquashFSBuilder, AI ALL, Fit to Span, search index)
+
+forkserver: ไม่ fork process ของ GUI ที่มีหลาย thread (Qt, fs_index, log) โดยตรง – fork จาก process
+ที่มีหลาย thread อาจ copy lock ที่ thread อื่นถืออยู่ไปค้างใน child; ไม่มี forkserver ใช้ spawn
+
+  ProcessPoolExecutor(workers, mp_context=pool_context())
+  pool_context().Pool(workers, initializer=...)
+"""
+
+import multiprocessing
+
+def pool_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
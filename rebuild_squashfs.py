@@ -1,37 +1,764 @@
 """
-Skeleton (Future Work): Pure Python SquashFS Rebuilder
+Pure Python SquashFS (v4) Builder
 
 เป้าหมาย:
 - อ่านโครงสร้าง directory + file data จาก rootfs directory
-- เขียน SquashFS image (v4) โดยใช้ pure python (หรือ binding library)
-- รองรับ compression (gzip/xz/lzma) ผ่าน python-lzma / gzip module
-- รักษา ownership/permissions (อาจ map ทุกไฟล์เป็น root:root หากไม่สำคัญ)
-- รองรับ blocksize config
+- เขียน SquashFS image (v4, little-endian) แบบ in-process ไม่ต้องเรียก mksquashfs
+- รองรับ compression gzip / xz / lzma ผ่าน stdlib (zlib / lzma)
+- บีบอัด data blocks และ fragment blocks ขนานกันผ่าน process pool (ใช้ได้ทุก core)
+- รองรับ blocksize config (FS_BLOCKSIZE) และ FS_COMPRESSION จาก config.log
 
-สถานะ: ยังไม่ implement — ใช้เป็นจุดเริ่มต้นออกแบบ
+โครงสร้าง image ที่เขียน (ลำดับเดียวกับ mksquashfs):
+  superblock | data blocks + fragment blocks | inode table | directory table |
+  fragment table | export table | id table | (pad 4K)
 
-แนะนำลำดับงาน:
-1. Enumerate files -> build inode table
-2. Chunk file data เป็น blocks -> compress -> build data block descriptors
-3. Generate metadata (superblock, inode table, directory table, fragment table, export table)
-4. เขียน superblock (ต้องมี offset ของตารางต่างๆ)
-5. ทดสอบ mount ด้วย unsquashfs หรือ mount -t squashfs (loop)
+ค่าเริ่มต้นเลียนแบบ mksquashfs:
+- fragment เฉพาะไฟล์ที่เล็กกว่า block size (always_fragments=False)
+- ตรวจไฟล์ซ้ำ (duplicates) แล้วใช้ data blocks ร่วมกัน
+- block ที่เป็นศูนย์ทั้งหมดเขียนเป็น sparse block
+- มี export table (NFS), ไม่มี xattrs
+- all_root=True (ตรงกับ -all-root ที่ estimate_squashfs_size ใช้)
+
+ตรวจผลลัพธ์ได้ด้วย unsquashfs -s / -l:
+  python rebuild_squashfs.py rootfs/ out.sqsh -b 131072 -comp xz
+  unsquashfs -s out.sqsh
 
 อ้างอิง spec:
-- Documentation/filesystems/squashfs.txt (Linux kernel)
+- Documentation/filesystems/squashfs.rst (Linux kernel)
 - squashfs-tools source code (mksquashfs.c)
-
-เมื่อสุกงอม สามารถ plug แทน estimate_squashfs_size() และ build pipeline
 """
 
+import os, re, stat, struct, time, zlib, lzma, hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from hashing import default_service, file_digest
+from proc_pool import pool_context
+
+class SquashFSError(Exception):
+    pass
+
+SQUASHFS_MAGIC = 0x73717368
+SUPERBLOCK_SIZE = 96
+METADATA_SIZE = 8192
+NO_TABLE = 0xFFFFFFFFFFFFFFFF
+NO_FRAGMENT = 0xFFFFFFFF
+
+COMPRESSION_IDS = {"gzip": 1, "lzma": 2, "xz": 4}
+DEFAULT_LEVELS = {"gzip": 9, "lzma": 5, "xz": 6}
+
+DATA_UNCOMPRESSED = 1 << 24
+METADATA_UNCOMPRESSED = 1 << 15
+
+# superblock flags
+FLAG_DUPLICATES = 0x0040
+FLAG_EXPORTABLE = 0x0080
+FLAG_NO_XATTRS = 0x0200
+FLAG_NO_FRAGMENTS = 0x0010
+FLAG_ALWAYS_FRAGMENTS = 0x0020
+
+# inode types (basic / extended)
+DIR_TYPE, FILE_TYPE, SYMLINK_TYPE, BLKDEV_TYPE, CHRDEV_TYPE, FIFO_TYPE, SOCKET_TYPE = range(1, 8)
+LDIR_TYPE, LREG_TYPE = 8, 9
+
+# work unit size sent to the pool (bytes of file data per task)
+CHUNK_BYTES = 2 * 1024 * 1024
+
+# FS_ARGS tokens the builder can honor; anything else -> fallback to mksquashfs
+_SUPPORTED_ARGS = {
+    "-noappend": {}, "-all-root": {}, "-root-owned": {}, "-le": {},
+    "-nopad": {"pad": False},
+    "-no-fragments": {"fragments": False},
+    "-always-use-fragments": {"always_fragments": True},
+    "-no-duplicates": {"duplicates": False},
+    "-no-exports": {"exportable": False},
+    "-no-xattrs": {},
+}
+
+# -------------------------------------------------
+# Compression (top-level so the process pool can pickle it)
+# -------------------------------------------------
+def compress_block(data, compression, block_size, level=None):
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+    if compression == "gzip":
+        return zlib.compress(data, level)
+    if compression == "xz":
+        return lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC32,
+                             filters=[{"id": lzma.FILTER_LZMA2, "preset": level,
+                                       "dict_size": max(block_size, 8192)}])
+    if compression == "lzma":
+        out = bytearray(lzma.compress(data, format=lzma.FORMAT_ALONE,
+                                      filters=[{"id": lzma.FILTER_LZMA1, "preset": level,
+                                                "dict_size": max(block_size, 8192)}]))
+        # squashfs lzma wrapper stores the real uncompressed size in the lzma_alone header
+        out[5:13] = struct.pack("<Q", len(data))
+        return bytes(out)
+    raise SquashFSError(f"Unsupported compression: {compression}")
+
+def _pack_block(raw, compression, block_size, level):
+    if len(raw) == block_size and raw.count(0) == block_size:
+        return 0, b""  # sparse
+    comp = compress_block(raw, compression, block_size, level)
+    if len(comp) < len(raw):
+        return len(comp), comp
+    return len(raw) | DATA_UNCOMPRESSED, raw
+
+def _compress_chunk(path, offset, length, compression, block_size, level):
+    out = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length > 0:
+            raw = f.read(min(block_size, length))
+            if not raw:
+                break
+            length -= len(raw)
+            out.append(_pack_block(raw, compression, block_size, level))
+    return out
+
+def _compress_fragment(data, compression, block_size, level):
+    comp = compress_block(data, compression, block_size, level)
+    if len(comp) < len(data):
+        return len(comp), comp
+    return len(data) | DATA_UNCOMPRESSED, data
+
+class _InlineExecutor:
+    """Executor stand-in for workers<=1 (no process pool)."""
+    def submit(self, fn, *args):
+        fut = Future()
+        fut.set_result(fn(*args))
+        return fut
+    def shutdown(self, wait=True):
+        pass
+
+# -------------------------------------------------
+# Tree / metadata helpers
+# -------------------------------------------------
+class _Entry:
+    __slots__ = ("name", "path", "st", "children", "number", "ref_block", "ref_offset",
+                 "start_block", "blocks", "fragment", "frag_offset", "sparse", "dup_of",
+                 "disk_bytes")
+    def __init__(self, name, path, st):
+        self.name = name
+        self.path = path
+        self.st = st
+        self.children = None
+        self.number = 0
+        self.ref_block = 0
+        self.ref_offset = 0
+        self.start_block = 0
+        self.blocks = []
+        self.fragment = NO_FRAGMENT
+        self.frag_offset = 0
+        self.sparse = 0
+        self.dup_of = None
+        self.disk_bytes = 0
+
+    @property
+    def basic_type(self):
+        m = self.st.st_mode
+        if stat.S_ISDIR(m): return DIR_TYPE
+        if stat.S_ISREG(m): return FILE_TYPE
+        if stat.S_ISLNK(m): return SYMLINK_TYPE
+        if stat.S_ISBLK(m): return BLKDEV_TYPE
+        if stat.S_ISCHR(m): return CHRDEV_TYPE
+        if stat.S_ISFIFO(m): return FIFO_TYPE
+        return SOCKET_TYPE
+
+class _MetadataWriter:
+    """Packs a byte stream into 8 KB metadata blocks with a 2-byte length header each."""
+    def __init__(self, compress):
+        self.compress = compress
+        self.buf = bytearray()
+        self.out = bytearray()
+        self.block_starts = []
+
+    def position(self):
+        return len(self.out), len(self.buf)
+
+    def add(self, data):
+        self.buf += data
+        while len(self.buf) >= METADATA_SIZE:
+            self._emit(bytes(self.buf[:METADATA_SIZE]))
+            del self.buf[:METADATA_SIZE]
+
+    def finish(self):
+        if self.buf:
+            self._emit(bytes(self.buf))
+            self.buf = bytearray()
+        return bytes(self.out)
+
+    def _emit(self, raw):
+        self.block_starts.append(len(self.out))
+        comp = self.compress(raw)
+        if len(comp) < len(raw):
+            self.out += struct.pack("<H", len(comp)) + comp
+        else:
+            self.out += struct.pack("<H", len(raw) | METADATA_UNCOMPRESSED) + raw
+
+class _Output:
+    """Sequential image writer; path=None only counts bytes (size prediction)."""
+    def __init__(self, path):
+        self.pos = 0
+        self.f = open(path, "wb") if path else None
+
+    def write(self, data, size=None):
+        """data=None (cached block sizes, count-only mode) advances by size."""
+        if data is None:
+            self.pos += size
+            return
+        if self.f:
+            self.f.write(data)
+        self.pos += len(data)
+
+    def write_at(self, offset, data):
+        if self.f:
+            self.f.seek(offset)
+            self.f.write(data)
+            self.f.seek(self.pos)
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+def _encode_dev(rdev):
+    major, minor = os.major(rdev), os.minor(rdev)
+    return (minor & 0xff) | (major << 8) | ((minor & ~0xff) << 12)
+
+# -------------------------------------------------
+# Builder
+# -------------------------------------------------
 class SquashFSBuilder:
-    def __init__(self, root_dir, block_size=131072, compression="xz"):
+    def __init__(self, root_dir, block_size=131072, compression="xz", level=None,
+                 workers=None, all_root=True, fragments=True, always_fragments=False,
+                 duplicates=True, exportable=True, pad=True, mkfs_time=None, cache=None, reuse=None):
+        if compression not in COMPRESSION_IDS:
+            raise SquashFSError(f"Unsupported compression: {compression}")
+        if block_size < 4096 or block_size > 1048576 or block_size & (block_size - 1):
+            raise SquashFSError(f"Invalid block size: {block_size}")
         self.root_dir=root_dir
         self.block_size=block_size
         self.compression=compression
+        self.level=level
+        self.workers=workers or os.cpu_count() or 1
+        self.all_root=all_root
+        self.fragments=fragments
+        self.always_fragments=always_fragments
+        self.duplicates=duplicates
+        self.exportable=exportable
+        self.pad=pad
+        self.mkfs_time=int(time.time()) if mkfs_time is None else mkfs_time
+        self.cache=cache          # size_cache.SizeCache (optional, see build(None))
+        self.reuse=reuse          # BlockReuse: compressed blocks of unchanged files from the original image
+        self.bytes_used=0
+        self.inode_count=0
+        self.attribution={}
+        self.cached_bytes=0
+        self.compressed_bytes=0
+        self.reused_bytes=0
+
+    @classmethod
+    def from_meta(cls, root_dir, meta, **overrides):
+        """
+        Builder configured from parse_config() meta (FS_BLOCKSIZE / FS_COMPRESSION / FS_ARGS).
+        Raises SquashFSError if the image needs something this builder cannot produce
+        (squashfs 3.x, big-endian, unknown mksquashfs options, lzo/lz4/zstd ...).
+        """
+        fs_type = str(meta.get("FS_TYPE", "squashfs")).lower()
+        if "squashfs" not in fs_type:
+            raise SquashFSError(f"Not a squashfs filesystem: {fs_type}")
+        mkfs = str(meta.get("MKFS", ""))
+        ver = _mkfs_major_version(mkfs)
+        if ver is not None and ver < 4:
+            raise SquashFSError(f"squashfs {ver}.x is not supported (v4 only)")
+        kwargs = {}
+        comp = str(meta.get("FS_COMPRESSION", "") or "gzip").lower()
+        if comp not in COMPRESSION_IDS:
+            raise SquashFSError(f"Unsupported compression: {comp}")
+        kwargs["compression"] = comp
+        bs = meta.get("FS_BLOCKSIZE")
+        if bs:
+            try:
+                kwargs["block_size"] = int(str(bs).split()[-1], 0)
+            except ValueError:
+                raise SquashFSError(f"Invalid FS_BLOCKSIZE: {bs}")
+        tokens = str(meta.get("FS_ARGS", "")).split()
+        i = 0
+        while i < len(tokens):
+            t = tokens[i]
+            if t == "-b" and i + 1 < len(tokens):
+                kwargs["block_size"] = int(tokens[i + 1], 0); i += 2; continue
+            if t == "-comp" and i + 1 < len(tokens):
+                if tokens[i + 1] not in COMPRESSION_IDS:
+                    raise SquashFSError(f"Unsupported compression: {tokens[i + 1]}")
+                kwargs["compression"] = tokens[i + 1]; i += 2; continue
+            if t not in _SUPPORTED_ARGS:
+                raise SquashFSError(f"Unsupported mksquashfs option: {t}")
+            kwargs.update(_SUPPORTED_ARGS[t])
+            i += 1
+        kwargs.update(overrides)
+        return cls(root_dir, **kwargs)
+
+    # ---------- scan ----------
+    def _scan(self):
+        root = _Entry(b"", self.root_dir, os.lstat(self.root_dir))
+        if not stat.S_ISDIR(root.st.st_mode):
+            raise SquashFSError(f"Not a directory: {self.root_dir}")
+        stack = [root]
+        ordered = []
+        while stack:
+            d = stack.pop()
+            ordered.append(d)
+            children = []
+            with os.scandir(d.path) as it:
+                for de in it:
+                    children.append(_Entry(os.fsencode(de.name), de.path, de.stat(follow_symlinks=False)))
+            children.sort(key=lambda e: e.name)
+            d.children = children
+            stack.extend(reversed([c for c in children if stat.S_ISDIR(c.st.st_mode)]))
+        # pre-order inode numbers (root = 1)
+        n = 0
+        for d in ordered:
+            if d is root:
+                n += 1; d.number = n
+            for c in d.children:
+                if not stat.S_ISDIR(c.st.st_mode):
+                    n += 1; c.number = n
+            for c in d.children:
+                if stat.S_ISDIR(c.st.st_mode):
+                    n += 1; c.number = n
+        self.inode_count = n
+        return root, ordered
 
+    def _regular_files(self, ordered):
+        files = []
+        for d in ordered:
+            files.extend(c for c in d.children if stat.S_ISREG(c.st.st_mode))
+        return files
+
+    def _digest(self, e):
+        return file_digest(e.path, st=e.st)
+
+    def _mark_duplicates(self, files):
+        by_size = {}
+        for e in files:
+            if e.st.st_size:
+                by_size.setdefault(e.st.st_size, []).append(e)
+        groups = [g for g in by_size.values() if len(g) > 1]
+        # hash all candidates up front on the shared service's thread pool
+        default_service().hash_many([e.path for g in groups for e in g])
+        for group in groups:
+            seen = {}
+            for e in group:
+                first = seen.setdefault(self._digest(e), e)
+                if first is not e:
+                    e.dup_of = first
+
+    # ---------- data ----------
+    def _reusable_fragments(self, files, reuse):
+        """
+        {original fragment index: None} for the fragment blocks of the original image whose
+        every tail belongs to an unchanged file that is still a fragment tail here: such a block
+        is copied as it is (offsets inside it stay valid) instead of being repacked.
+        """
+        bs = self.block_size
+        covered = {}
+        for e in files:
+            size = e.st.st_size
+            if e.dup_of is not None or not (size % bs and (self.always_fragments or size < bs)):
+                continue
+            orig = reuse.inode(os.path.relpath(e.path, self.root_dir), size)
+            if orig is not None and orig.fragment != NO_FRAGMENT:
+                covered.setdefault(orig.fragment, set()).add((orig.frag_offset, size % bs))
+        return {i: None for i, tails in covered.items() if tails == reuse.fragment_tails.get(i)}
+
+    def _write_data(self, files, out, progress_cb):
+        bs = self.block_size
+        args = (self.compression, bs, self.level)
+        profile = (bs, self.compression, self.level)
+        # cached block sizes can only stand in for real data when nothing is written
+        use_cache = self.cache is not None and out.f is None
+        reuse = self.reuse if self.reuse is not None and self.reuse.compatible(self) else None
+        reuse_frags = self._reusable_fragments(files, reuse) if reuse and self.fragments else {}
+        total = sum(e.st.st_size for e in files if e.dup_of is None)
+        done = 0
+        frag_entries = []     # [start, size_word]
+        frag_members = []     # per fragment block: [(entry, tail_len)]
+        frag_buf = bytearray()
+        frag_open = None      # index reserved for the block frag_buf becomes
+        pending = deque()
+        window = max(4, self.workers * 4)
+        executor = (ProcessPoolExecutor(self.workers, mp_context=pool_context()) if self.workers > 1
+                    else _InlineExecutor())
+
+        def ready(result):
+            fut = Future()
+            fut.set_result(result)
+            return fut
+
+        def drain(limit):
+            nonlocal done
+            while pending and (len(pending) > limit or pending[0][2].done()):
+                kind, target, fut = pending.popleft()
+                if kind == "frag":
+                    index, key = target
+                    size_word, payload = fut.result()
+                    frag_entries[index] = [out.pos, size_word]
+                    out.write(payload, size_word & ~DATA_UNCOMPRESSED)
+                    if key and self.cache is not None:
+                        self.cache.put_fragment(key, profile, size_word)
+                    continue
+                entry, first, key = target
+                if first:
+                    entry.start_block = out.pos
+                for size_word, payload in fut.result():
+                    if size_word == 0:
+                        entry.sparse += bs
+                    entry.blocks.append(size_word)
+                    entry.disk_bytes += size_word & ~DATA_UNCOMPRESSED
+                    out.write(payload, size_word & ~DATA_UNCOMPRESSED)
+                    done += bs
+                if key and self.cache is not None:
+                    self.cache.put_blocks(key, profile, entry.blocks)
+                if progress_cb:
+                    progress_cb(min(done, total), total)
+
+        def new_fragment():
+            frag_entries.append(None)
+            frag_members.append([])
+            return len(frag_entries) - 1
+
+        def flush_fragment():
+            nonlocal frag_open
+            data = bytes(frag_buf)
+            key = hashlib.sha256(data).hexdigest() if self.cache is not None else None
+            word = self.cache.get_fragment(key, profile) if use_cache else None
+            if word is not None:
+                self.cached_bytes += len(data)
+                pending.append(("frag", (frag_open, None), ready((word, None))))
+            else:
+                self.compressed_bytes += len(data)
+                pending.append(("frag", (frag_open, key),
+                                executor.submit(_compress_fragment, data, *args)))
+            frag_buf.clear()
+            frag_open = None
+
+        try:
+            for e in files:
+                if e.dup_of is not None:
+                    continue
+                size = e.st.st_size
+                use_frag = self.fragments and size % bs and (self.always_fragments or size < bs)
+                data_len = size - size % bs if use_frag else size
+                orig = reuse.inode(os.path.relpath(e.path, self.root_dir), size) if reuse else None
+                start = 0
+                if data_len and orig is not None:
+                    # unchanged file: its blocks go into the new image verbatim (sizes only when predicting)
+                    count = min(len(orig.block_sizes), -(-data_len // bs))
+                    blocks = ([(w, None) for w in orig.block_sizes[:count]] if out.f is None
+                              else reuse.image.raw_blocks(orig, count))
+                    pending.append(("data", (e, True, None), ready(blocks)))
+                    start = min(count * bs, data_len)
+                    self.reused_bytes += start
+                if start < data_len:
+                    key = self._digest(e) if self.cache is not None and not start else None
+                    words = self.cache.get_blocks(key, profile) if use_cache and key else None
+                    if words is not None:
+                        self.cached_bytes += data_len
+                        pending.append(("data", (e, True, None), ready([(w, None) for w in words])))
+                    else:
+                        self.compressed_bytes += data_len - start
+                        per_task = max(bs, CHUNK_BYTES // bs * bs)
+                        off = start
+                        while off < data_len:
+                            n = min(per_task, data_len - off)
+                            last = off + n >= data_len
+                            pending.append(("data", (e, off == 0, key if last else None),
+                                            executor.submit(_compress_chunk, e.path, off, n, *args)))
+                            off += n
+                if use_frag and orig is not None and orig.fragment in reuse_frags:
+                    # tail sits in an original fragment block that is kept whole
+                    index = reuse_frags[orig.fragment]
+                    if index is None:
+                        index = reuse_frags[orig.fragment] = new_fragment()
+                        word, raw = reuse.image.raw_fragment(orig.fragment)
+                        pending.append(("frag", (index, None),
+                                        ready((word, raw if out.f is not None else None))))
+                    e.fragment, e.frag_offset = index, orig.frag_offset
+                    frag_members[index].append((e, size - data_len))
+                    self.reused_bytes += size - data_len
+                    done += size - data_len
+                elif use_frag:
+                    with open(e.path, "rb") as f:
+                        f.seek(data_len)
+                        tail = f.read(size - data_len)
+                    if len(frag_buf) + len(tail) > bs:
+                        flush_fragment()
+                    if frag_open is None:
+                        frag_open = new_fragment()
+                    e.fragment = frag_open
+                    e.frag_offset = len(frag_buf)
+                    frag_members[frag_open].append((e, len(tail)))
+                    frag_buf += tail
+                    done += len(tail)
+                drain(window)
+            if frag_buf:
+                flush_fragment()
+            drain(0)
+        finally:
+            executor.shutdown(wait=True)
+        # fragment blocks are shared: attribute their on-disk size pro rata to the tails
+        for (start, word), members in zip(frag_entries, frag_members):
+            used = sum(n for _, n in members) or 1
+            for e, n in members:
+                e.disk_bytes += (word & ~DATA_UNCOMPRESSED) * n // used
+        for e in files:
+            src = e.dup_of
+            if src is not None:
+                e.start_block, e.blocks, e.sparse = src.start_block, src.blocks, src.sparse
+                e.fragment, e.frag_offset = src.fragment, src.frag_offset
+        return frag_entries
+
+    # ---------- inodes / directories ----------
+    def _id_index(self, ids, value):
+        if value not in ids:
+            ids[value] = len(ids)
+        return ids[value]
+
+    def _inode_header(self, e, itype, ids):
+        uid = 0 if self.all_root else e.st.st_uid
+        gid = 0 if self.all_root else e.st.st_gid
+        return struct.pack("<HHHHII", itype, e.st.st_mode & 0xFFF,
+                           self._id_index(ids, uid), self._id_index(ids, gid),
+                           int(e.st.st_mtime) & 0xFFFFFFFF, e.number)
+
+    def _write_inode(self, e, inodes, ids, exports):
+        e.ref_block, e.ref_offset = inodes.position()
+        t = e.basic_type
+        m = e.st
+        if t == FILE_TYPE:
+            size = m.st_size
+            blocks = struct.pack(f"<{len(e.blocks)}I", *e.blocks)
+            if size < 1 << 32 and e.start_block < 1 << 32:
+                data = self._inode_header(e, FILE_TYPE, ids) + struct.pack(
+                    "<IIII", e.start_block, e.fragment, e.frag_offset, size) + blocks
+            else:
+                data = self._inode_header(e, LREG_TYPE, ids) + struct.pack(
+                    "<QQQIIII", e.start_block, size, e.sparse, 1, e.fragment,
+                    e.frag_offset, 0xFFFFFFFF) + blocks
+        elif t == SYMLINK_TYPE:
+            target = os.fsencode(os.readlink(e.path))
+            data = self._inode_header(e, t, ids) + struct.pack("<II", 1, len(target)) + target
+        elif t in (BLKDEV_TYPE, CHRDEV_TYPE):
+            data = self._inode_header(e, t, ids) + struct.pack("<II", 1, _encode_dev(m.st_rdev))
+        else:
+            data = self._inode_header(e, t, ids) + struct.pack("<I", 1)
+        inodes.add(data)
+        exports[e.number - 1] = (e.ref_block << 16) | e.ref_offset
+
+    def _dir_listing(self, children):
+        out = bytearray()
+        i = 0
+        while i < len(children):
+            first = children[i]
+            run = [first]
+            j = i + 1
+            while (j < len(children) and len(run) < 256
+                   and children[j].ref_block == first.ref_block
+                   and -32768 <= children[j].number - first.number <= 32767):
+                run.append(children[j]); j += 1
+            out += struct.pack("<III", len(run) - 1, first.ref_block, first.number)
+            for c in run:
+                out += struct.pack("<HhHH", c.ref_offset, c.number - first.number,
+                                   c.basic_type, len(c.name) - 1) + c.name
+            i = j
+        return bytes(out)
+
+    def _write_dir(self, d, parent_number, inodes, dirs, ids, exports):
+        subdirs = 0
+        for c in d.children:
+            if stat.S_ISDIR(c.st.st_mode):
+                subdirs += 1
+                self._write_dir(c, d.number, inodes, dirs, ids, exports)
+            else:
+                self._write_inode(c, inodes, ids, exports)
+        start_block, offset = dirs.position()
+        listing = self._dir_listing(d.children)
+        dirs.add(listing)
+        file_size = len(listing) + 3
+        nlink = 2 + subdirs
+        d.ref_block, d.ref_offset = inodes.position()
+        if file_size <= 0xFFFF:
+            data = self._inode_header(d, DIR_TYPE, ids) + struct.pack(
+                "<IIHHI", start_block, nlink, file_size, offset, parent_number)
+        else:
+            data = self._inode_header(d, LDIR_TYPE, ids) + struct.pack(
+                "<IIIIHHI", nlink, file_size, start_block, parent_number, 0, offset, 0xFFFFFFFF)
+        inodes.add(data)
+        exports[d.number - 1] = (d.ref_block << 16) | d.ref_offset
+
+    def _write_table(self, out, raw, compress):
+        """Write a lookup table (metadata blocks + u64 index); returns the index position."""
+        mw = _MetadataWriter(compress)
+        mw.add(raw)
+        start = out.pos
+        out.write(mw.finish())
+        index_pos = out.pos
+        out.write(b"".join(struct.pack("<Q", start + s) for s in mw.block_starts))
+        return index_pos
+
+    # ---------- public ----------
     def build(self, out_file, progress_cb=None):
-        raise NotImplementedError("Pure Python SquashFS build not implemented yet.")
+        """
+        Write the image to out_file (None = size prediction only, nothing written).
+        progress_cb(done_bytes, total_bytes) is called as data blocks are written.
+        Returns the final image size in bytes (including 4K padding unless pad=False).
+
+        With a cache, compressed block sizes are stored per file digest; in size prediction
+        mode (out_file=None) cached files and fragment blocks are not recompressed.
+        With reuse (BlockReuse), data blocks of unchanged files are copied from the original
+        image as they are, and so are original fragment blocks whose tails all belong to unchanged
+        files; only changed / new files and the fragment blocks holding their tails are compressed.
+        After build, self.attribution maps rel path -> on-disk bytes (data blocks plus a
+        pro-rata share of its fragment block; duplicates cost 0) and "(metadata)" holds the
+        superblock, inode/directory/fragment/export/id tables and padding.
+        """
+        bs = self.block_size
+        compress = lambda raw: compress_block(raw, self.compression, bs, self.level)
+        root, ordered = self._scan()
+        files = self._regular_files(ordered)
+        if self.duplicates:
+            self._mark_duplicates(files)
+
+        out = _Output(out_file)
+        try:
+            out.write(b"\0" * SUPERBLOCK_SIZE)
+            frag_entries = self._write_data(files, out, progress_cb)
+
+            ids = {}
+            exports = [0] * self.inode_count
+            inodes = _MetadataWriter(compress)
+            dirs = _MetadataWriter(compress)
+            self._write_dir(root, self.inode_count + 1, inodes, dirs, ids, exports)
+            root_ref = (root.ref_block << 16) | root.ref_offset
+
+            inode_table_start = out.pos
+            out.write(inodes.finish())
+            directory_table_start = out.pos
+            out.write(dirs.finish())
+            fragment_table_start = self._write_table(
+                out, b"".join(struct.pack("<QII", s, w, 0) for s, w in frag_entries), compress)
+            lookup_table_start = NO_TABLE
+            if self.exportable:
+                lookup_table_start = self._write_table(
+                    out, struct.pack(f"<{len(exports)}Q", *exports), compress)
+            id_list = sorted(ids, key=ids.get)
+            id_table_start = self._write_table(out, struct.pack(f"<{len(id_list)}I", *id_list), compress)
+            self.bytes_used = out.pos
+
+            if self.pad and out.pos % 4096:
+                out.write(b"\0" * (4096 - out.pos % 4096))
+
+            flags = FLAG_NO_XATTRS
+            if self.duplicates: flags |= FLAG_DUPLICATES
+            if self.exportable: flags |= FLAG_EXPORTABLE
+            if not self.fragments: flags |= FLAG_NO_FRAGMENTS
+            if self.always_fragments: flags |= FLAG_ALWAYS_FRAGMENTS
+            sb = struct.pack("<IIIIIHHHHHHQQQQQQQQ",
+                             SQUASHFS_MAGIC, self.inode_count, self.mkfs_time & 0xFFFFFFFF, bs,
+                             len(frag_entries), COMPRESSION_IDS[self.compression],
+                             bs.bit_length() - 1, flags, len(id_list), 4, 0,
+                             root_ref, self.bytes_used, id_table_start, NO_TABLE,
+                             inode_table_start, directory_table_start,
+                             fragment_table_start, lookup_table_start)
+            out.write_at(0, sb)
+            self.attribution = {os.path.relpath(e.path, self.root_dir): e.disk_bytes for e in files}
+            self.attribution["(metadata)"] = out.pos - sum(e.disk_bytes for e in files)
+            return out.pos
+        finally:
+            out.close()
+
+class BlockReuse:
+    """
+    Unchanged files of an original SquashFS v4 image, whose compressed data blocks (and fragment
+    blocks holding only their tails) a rebuild copies verbatim instead of recompressing
+    (SquashFSBuilder(reuse=...)).
+
+    "Unchanged" comes from the rootfs manifests: a file whose current digest equals its digest in
+    rootfs_original (the tree extracted from this very image) has the same bytes as the image.
+    Only usable when the new build has the same block size and compression as the image.
+    """
+    def __init__(self, image, unchanged, fragment_tails=None):
+        self.image = image            # squashfs_reader.SquashFSImage
+        self.unchanged = unchanged    # {rel path: Inode}
+        self.fragment_tails = fragment_tails or {}   # {fragment index: {(offset, length)}} of every file
+
+    @classmethod
+    def from_image(cls, image, offset, root_dir, original_dir=None):
+        """
+        image: path or buffer holding the original filesystem at offset; root_dir: the (patched)
+        rootfs about to be built; original_dir: its snapshot (default: <root_dir>/../rootfs_original).
+        """
+        from squashfs_reader import SquashFSImage
+        from rootfs_manifest import manifest_path, load_manifest, update_manifest, SIZE, DIGEST
+        original_dir = original_dir or os.path.join(os.path.dirname(os.path.normpath(root_dir)),
+                                                    "rootfs_original")
+        if not os.path.isdir(original_dir):
+            raise SquashFSError(f"no snapshot to compare against: {original_dir}")
+        orig = load_manifest(manifest_path(original_dir)) or update_manifest(original_dir)
+        cur = update_manifest(root_dir)
+        img = SquashFSImage(image, offset)
+        unchanged = {}
+        tails = {}
+        try:
+            for rel, ino in img.walk():
+                if not ino.is_file():
+                    continue
+                if ino.fragment != NO_FRAGMENT:
+                    tails.setdefault(ino.fragment, set()).add((ino.frag_offset, ino.size % img.block_size))
+                o, c = orig.get(rel), cur.get(rel)
+                if (o and c and o[DIGEST] and o[DIGEST] == c[DIGEST]
+                        and o[SIZE] == c[SIZE] == ino.size):
+                    unchanged[rel] = ino
+        except Exception:
+            img.close()
+            raise
+        return cls(img, unchanged, tails)
+
+    def compatible(self, builder):
+        return (self.image.block_size == builder.block_size
+                and self.image.compression == builder.compression)
+
+    def inode(self, rel, size):
+        ino = self.unchanged.get(rel)
+        return ino if ino is not None and ino.size == size else None
+
+    def close(self):
+        self.image.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _mkfs_major_version(mkfs_path):
+    """Major squashfs-tools version from an FMK MKFS path (e.g. src/squashfs-3.0/mksquashfs)."""
+    m = re.search(r"squashfs-?(\d)", mkfs_path or "")
+    return int(m.group(1)) if m else None
 
 if __name__ == "__main__":
-    print("Pure Python SquashFS builder skeleton (ยังไม่พร้อมใช้งาน)")
\ No newline at end of file
+    import argparse
+    ap = argparse.ArgumentParser(description="Pure Python SquashFS v4 builder")
+    ap.add_argument("root_dir")
+    ap.add_argument("out_file")
+    ap.add_argument("-b", dest="block_size", type=int, default=131072)
+    ap.add_argument("-comp", dest="compression", default="xz", choices=sorted(COMPRESSION_IDS))
+    ap.add_argument("-j", dest="workers", type=int, default=None)
+    ap.add_argument("-nopad", action="store_true")
+    ap.add_argument("-no-fragments", dest="no_fragments", action="store_true")
+    a = ap.parse_args()
+    b = SquashFSBuilder(a.root_dir, block_size=a.block_size, compression=a.compression,
+                        workers=a.workers, pad=not a.nopad, fragments=not a.no_fragments)
+    size = b.build(a.out_file)
+    print(f"{a.out_file}: {size} bytes ({b.inode_count} inodes, bytes_used={b.bytes_used})")
@@ -0,0 +1,221 @@
+"""
+Rootfs manifest: per-file (size, mode, mtime_ns, inode, digest) stored beside the tree.
+
+  <segment>/rootfs_original.manifest.json   เขียนครั้งเดียวตอน snapshot
+  <segment>/rootfs.manifest.json            สถานะล่าสุดของ rootfs (อัปเดตทุกครั้งที่ diff)
+
+update_manifest() เดิน tree ด้วย os.scandir แล้ว hash ใหม่เฉพาะไฟล์ที่ stat tuple เปลี่ยน
+(ผ่าน hashing.default_service().hash_many — thread pool + memo ตาม inode ร่วมกับ builder / size cache)
+ที่เหลือใช้ digest เดิมจาก manifest
+symlink เก็บ digest เป็น "symlink:<target>"
+iter_changes() ให้ผลแบบเดียวกับ diff_manifests แต่ทยอยส่งเป็นชุดระหว่าง hash (Diff Viewer แสดงได้ทันที)
+ถ้า tree มี fs_index เปิดอยู่ (GUI) จะ stat เฉพาะ path ที่ inotify รายงานว่าเปลี่ยนตั้งแต่ manifest ถูกบันทึกครั้งก่อน
+"""
+
+import os, stat, json
+
+import fs_index
+from hashing import default_service
+
+MANIFEST_VERSION = 1
+# entry layout: [size, mode, mtime_ns, inode, digest]
+SIZE, MODE, MTIME_NS, INODE, DIGEST = range(5)
+
+def manifest_path(tree_dir):
+    return os.path.normpath(tree_dir) + ".manifest.json"
+
+def scan_tree(root_dir):
+    """{rel_path: os.stat_result} for every non-directory entry (symlinks not followed)."""
+    out = {}
+    stack = [root_dir]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except OSError:
+            continue
+        with it:
+            for de in it:
+                try:
+                    st = de.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append(de.path)
+                else:
+                    out[os.path.relpath(de.path, root_dir)] = st
+    return out
+
+def _stat_tuple(st):
+    return [st.st_size, st.st_mode, st.st_mtime_ns, st.st_ino]
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != MANIFEST_VERSION:
+        return None
+    return data.get("files", {})
+
+def save_manifest(path, files):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def _stats(root_dir, only):
+    if only is None:
+        return scan_tree(root_dir).items()
+    out = []
+    for rel in only:
+        try:
+            st = os.lstat(os.path.join(root_dir, rel))
+        except OSError:
+            continue
+        if not stat.S_ISDIR(st.st_mode):
+            out.append((rel, st))
+    return out
+
+def _plan(root_dir, previous, only=None):
+    """
+    Stat pass: (files, to_hash, changed) — entries in to_hash still have digest None.
+    only = rel paths that may differ from previous (the rest is taken as is), None = scan everything.
+    """
+    files = {} if only is None else {rel: e for rel, e in previous.items() if rel not in only}
+    to_hash = []
+    changed = False
+    for rel, st in _stats(root_dir, only):
+        entry = _stat_tuple(st)
+        old = previous.get(rel)
+        if old and old[:DIGEST] == entry:
+            entry.append(old[DIGEST])
+            files[rel] = entry
+            continue
+        changed = True
+        if stat.S_ISLNK(st.st_mode):
+            entry.append("symlink:" + os.readlink(os.path.join(root_dir, rel)))
+        elif stat.S_ISREG(st.st_mode):
+            entry.append(None)
+            to_hash.append(rel)
+        else:
+            entry.append(f"special:{st.st_rdev}")
+        files[rel] = entry
+    return files, to_hash, changed
+
+def _index_changes(root_dir, mpath):
+    """
+    (only, token): paths changed since the saved manifest according to the open fs_index
+    (None = unknown, scan everything) and a token for _index_saved() once mpath is current.
+    """
+    idx = fs_index.get_index(root_dir)
+    if idx is None:
+        return None, None
+    token = (idx, idx.mark())
+    seen = idx.marks.get(mpath)
+    try:
+        mtime = os.stat(mpath).st_mtime_ns
+    except OSError:
+        return None, token
+    if seen is None or seen[1] != mtime:     # written by someone else (another process / no index)
+        return None, token
+    return idx.changed_since(seen[0]), token
+
+def _index_saved(mpath, token):
+    if token is not None:
+        idx, mark = token
+        try:
+            idx.marks[mpath] = (mark, os.stat(mpath).st_mtime_ns)
+        except OSError:
+            pass
+
+def _hash_into(files, root_dir, rels, workers=None):
+    paths = {os.path.join(root_dir, rel): rel for rel in rels}
+    for path, digests in default_service().hash_many(paths, workers=workers).items():
+        files[paths[path]][DIGEST] = digests and digests["sha256"]
+
+def update_manifest(root_dir, previous=None, workers=None, save=True):
+    """
+    Return a fresh manifest for root_dir. Entries whose stat tuple matches `previous`
+    (default: the saved manifest) keep their digest; the rest are hashed on a thread pool.
+    """
+    mpath = manifest_path(root_dir)
+    only, token = _index_changes(root_dir, mpath)
+    if previous is None:
+        previous = load_manifest(mpath) or {}
+    else:
+        only = None            # caller's own baseline: the index bookmark does not apply to it
+    if not previous:
+        only = None
+    files, to_hash, changed = _plan(root_dir, previous, only)
+    if to_hash:
+        _hash_into(files, root_dir, to_hash, workers)
+    dirty = changed or files.keys() != previous.keys()
+    if save and dirty:
+        save_manifest(mpath, files)
+    if save or not dirty:
+        _index_saved(mpath, token)
+    return files
+
+def iter_changes(orig, root_dir, batch=256, workers=None, should_stop=None, save=True):
+    """
+    Streaming diff_manifests(orig, <root_dir>): yields lists of (kind, rel) with kind in
+    added / removed / modified. Everything decidable from stat data comes first; files that
+    need hashing are hashed `batch` at a time (ones that exist in orig first) and reported as
+    they finish. The refreshed manifest is saved at the end unless should_stop() cut the scan short.
+    """
+    mpath = manifest_path(root_dir)
+    only, token = _index_changes(root_dir, mpath)
+    previous = load_manifest(mpath) or {}
+    files, to_hash, changed = _plan(root_dir, previous, only if previous else None)
+    pending = set(to_hash)
+    known = [("removed", rel) for rel in sorted(orig.keys() - files.keys())]
+    known += [("added", rel) for rel in sorted(files.keys() - orig.keys())]
+    known += [("modified", rel) for rel in sorted(orig.keys() & files.keys())
+              if rel not in pending and _differs(orig[rel], files[rel])]
+    for i in range(0, len(known), batch):
+        yield known[i:i + batch]
+    to_hash.sort(key=lambda rel: (rel not in orig, rel))
+    for i in range(0, len(to_hash), batch):
+        if should_stop and should_stop():
+            return
+        chunk = to_hash[i:i + batch]
+        _hash_into(files, root_dir, chunk, workers)
+        found = [("modified", rel) for rel in chunk if rel in orig and _differs(orig[rel], files[rel])]
+        if found:
+            yield found
+    dirty = changed or files.keys() != previous.keys()
+    if save and dirty:
+        save_manifest(mpath, files)
+    if save or not dirty:
+        _index_saved(mpath, token)
+
+def snapshot_manifests(rootfs_dir, snapshot_dir, workers=None):
+    """
+    Called right after cloning rootfs -> snapshot: hash rootfs once, then record the same
+    digests against the snapshot's own stat data (no second read of the content).
+    Device nodes / fifos the clone could not mknod (unprivileged) are recorded from rootfs
+    as they are, so they do not show up as "added" in every diff.
+    """
+    current = update_manifest(rootfs_dir, previous={}, workers=workers)
+    snap = {}
+    for rel, st in scan_tree(snapshot_dir).items():
+        cur = current.get(rel)
+        if cur is not None:
+            snap[rel] = _stat_tuple(st) + [cur[DIGEST]]
+    for rel, cur in current.items():
+        if rel not in snap and str(cur[DIGEST]).startswith("special:"):
+            snap[rel] = cur
+    save_manifest(manifest_path(snapshot_dir), snap)
+    return snap
+
+def diff_manifests(orig, cur):
+    """(added, removed, modified) sets of rel paths; modified = size or digest differs."""
+    added = cur.keys() - orig.keys()
+    removed = orig.keys() - cur.keys()
+    modified = [rel for rel in orig.keys() & cur.keys() if _differs(orig[rel], cur[rel])]
+    return set(added), set(removed), modified
+
+def _differs(a, b):
+    return a[SIZE] != b[SIZE] or a[DIGEST] != b[DIGEST]
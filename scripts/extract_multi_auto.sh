@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 #
-# Auto carve & extract multiple filesystems (SquashFS / JFFS2) from a firmware image.
-# Fallback script when FMK extract fails or when you want deterministic carving based on binwalk.
+# Auto carve & extract multiple filesystems (SquashFS / JFFS2 / CramFS / UBI) from a firmware image.
+# Fallback script when FMK extract fails or when you want deterministic carving based on a signature scan.
 #
 # Usage:
 #   scripts/extract_multi_auto.sh <firmware.bin> [OUTPUT_DIR]
@@ -9,25 +9,26 @@
 # If OUTPUT_DIR is omitted it will create: workspaces/auto_ws_YYYYmmdd_HHMMSS
 #
 # Requirements:
-#   - binwalk (system: apt install binwalk)
+#   - python3 + numpy (fw_scan.py, native mmap signature scanner; binwalk is no longer needed)
 #   - unsquashfs (squashfs-tools)
 #   - jefferson (optional, for JFFS2) -> pip install jefferson
 #
 # What it does:
-#   1. Runs binwalk once and stores scan output.
-#   2. Parses offsets of "Squashfs filesystem" and "JFFS2 filesystem".
+#   1. Runs fw_scan.py once and stores the layout table (layout.txt / layout.json).
+#   2. Takes offsets + exact lengths from the filesystem headers
+#      (squashfs bytes_used, cramfs size, jffs2 node walk, UBI PEB count).
 #   3. For each filesystem:
-#        - Carves region from its offset up to (next_offset OR EOF)
+#        - Carves exactly [offset, offset+length)
 #        - Tries to extract:
 #            * Squashfs -> unsquashfs -d <dir>
 #            * JFFS2   -> jefferson -d <dir>  (if installed)
+#            * CramFS / UBI -> carved only
 #   4. Saves carved filesystem blobs + extracted directories inside OUTPUT_DIR.
 #
 # Notes:
-#   - Length estimation uses "next FS offset - current offset" heuristic; padding between
-#     partitions is included. That is usually fine for read-only inspection.
+#   - Padding between partitions / trailing partitions are no longer included in a carve.
+#   - Carving uses fs_utils.py (copy_file_range / sendfile), not dd bs=1.
 #   - If unsquashfs fails due to special compression (LZMA patched), install 'sasquatch'.
-#   - Adjust/extend TYPES pattern below if you want to support UBIFS, cramfs, etc.
 #
 set -euo pipefail
 
@@ -42,59 +43,65 @@ if [ ! -f "$FW" ]; then
   exit 2
 fi
 
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+SCANNER="$SCRIPT_DIR/../fw_scan.py"
+FSUTILS="$SCRIPT_DIR/../fs_utils.py"
+PYTHON="${PYTHON:-python3}"
+
 # Allow relative output path from current working dir
 OUTDIR="${2:-workspaces/auto_ws_$(date +%Y%m%d_%H%M%S)}"
 mkdir -p "$OUTDIR"
 
-SCAN="$OUTDIR/binwalk_scan.txt"
+SCAN="$OUTDIR/layout.txt"
+TSV="$OUTDIR/layout.tsv"
 
-echo "[*] Running binwalk scan..."
-if ! command -v binwalk >/dev/null 2>&1; then
-  echo "[ERR] binwalk not found. Install with: sudo apt install -y binwalk" >&2
+echo "[*] Running signature scan (fw_scan.py)..."
+if ! "$PYTHON" "$SCANNER" "$FW" --tsv --save "$OUTDIR" > "$TSV"; then
+  echo "[ERR] fw_scan.py failed (need python3 + numpy: pip install numpy)" >&2
   exit 3
 fi
-binwalk "$FW" > "$SCAN"
 
-# Arrays to store filesystem offsets and types
-declare -a OFFS TYPES
+# Arrays to store filesystem offsets, lengths and types
+declare -a OFFS LENS TYPES
 
-# Parse relevant lines
-# Customize this grep if you want more FS types (e.g. "UBI image", "CramFS filesystem")
-while read -r line; do
-  # Match lines like: 2359296       0x240000        Squashfs filesystem, ...
-  if [[ "$line" =~ ^[[:space:]]*([0-9]+)[[:space:]]+0x[0-9A-Fa-f]+[[:space:]]+(Squashfs\ filesystem|JFFS2\ filesystem) ]]; then
-    OFFS+=("${BASH_REMATCH[1]}")
-    case "${BASH_REMATCH[2]}" in
-      Squashfs\ filesystem) TYPES+=("Squashfs");;
-      JFFS2\ filesystem)    TYPES+=("JFFS2");;
-    esac
-  fi
-done < <(grep -E "Squashfs filesystem|JFFS2 filesystem" "$SCAN")
+while IFS=$'\t' read -r off type len info; do
+  case "$type" in
+    squashfs) TYPES+=("Squashfs");;
+    jffs2)    TYPES+=("JFFS2");;
+    cramfs)   TYPES+=("CramFS");;
+    ubi)      TYPES+=("UBI");;
+    *) continue;;
+  esac
+  OFFS+=("$off")
+  LENS+=("$len")
+done < "$TSV"
 
 COUNT=${#OFFS[@]}
 if [ "$COUNT" -eq 0 ]; then
-  echo "[!] No SquashFS or JFFS2 signatures found. (See $SCAN)"
+  echo "[!] No filesystem signatures found. (See $SCAN)"
   exit 4
 fi
 
 SIZE=$(stat -c%s "$FW")
 echo "[*] Found $COUNT filesystem signatures"
-printf "%-10s %-12s %-8s\n" "INDEX" "OFFSET(dec)" "TYPE"
+printf "%-10s %-12s %-12s %-8s\n" "INDEX" "OFFSET(dec)" "LENGTH" "TYPE"
 for i in "${!OFFS[@]}"; do
-  printf "%-10s %-12s %-8s\n" "$i" "${OFFS[$i]}" "${TYPES[$i]}"
+  printf "%-10s %-12s %-12s %-8s\n" "$i" "${OFFS[$i]}" "${LENS[$i]}" "${TYPES[$i]}"
 done
 
-# Carve each filesystem using offset to next FS (or EOF for last)
+# copy_file_range/sendfile carve (constant memory, no per-byte syscalls)
+carve() {
+  "$PYTHON" "$FSUTILS" carve "$FW" "$1" "$2" "$3"
+}
+
+# Carve each filesystem using the exact length from its header
 for i in "${!OFFS[@]}"; do
   start=${OFFS[$i]}
   type=${TYPES[$i]}
-
-  if [ $((i+1)) -lt "$COUNT" ]; then
-    end=${OFFS[$((i+1))]}
-  else
-    end=$SIZE
+  length=${LENS[$i]}
+  if [ "$length" -le 0 ] || [ $((start + length)) -gt "$SIZE" ]; then
+    length=$(( SIZE - start ))
   fi
-  length=$(( end - start ))
 
   printf "\n[*] Carving %s index=%02d offset=0x%X (dec %d) length=%d (0x%X)\n" \
          "$type" "$i" "$start" "$start" "$length" "$length"
@@ -102,7 +109,7 @@ for i in "${!OFFS[@]}"; do
   case "$type" in
     Squashfs)
       outfs="$OUTDIR/rootfs_${i}.sqsh"
-      dd if="$FW" of="$outfs" bs=1 skip="$start" count="$length" status=none
+      carve "$outfs" "$start" "$length"
       # Try unsquashfs
       if command -v unsquashfs >/dev/null 2>&1; then
         if unsquashfs -d "$OUTDIR/rootfs_${i}" "$outfs" >/dev/null 2>&1; then
@@ -116,7 +123,7 @@ for i in "${!OFFS[@]}"; do
       ;;
     JFFS2)
       outfs="$OUTDIR/jffs2_${i}.bin"
-      dd if="$FW" of="$outfs" bs=1 skip="$start" count="$length" status=none
+      carve "$outfs" "$start" "$length"
       if command -v jefferson >/dev/null 2>&1; then
         if jefferson -d "$OUTDIR/jffs2_${i}" "$outfs" >/dev/null 2>&1; then
           echo "    -> jefferson OK (jffs2_${i})"
@@ -127,6 +134,11 @@ for i in "${!OFFS[@]}"; do
         echo "    -> jefferson not installed (pip install jefferson)"
       fi
       ;;
+    CramFS|UBI)
+      outfs="$OUTDIR/$(echo "$type" | tr 'A-Z' 'a-z')_${i}.bin"
+      carve "$outfs" "$start" "$length"
+      echo "    -> carved only ($outfs); extract with cramfsck -x / ubireader_extract_files"
+      ;;
     *)
       echo "    -> Unknown type logic not implemented: $type"
       ;;
@@ -135,5 +147,5 @@ done
 
 echo
 echo "[*] Finished. Artifacts in: $OUTDIR"
-echo "[*] Scan file saved at: $SCAN"
+echo "[*] Layout saved at: $SCAN (+ layout.json)"
 echo "[*] Tip: diff rootfs directories to identify differences."
@@ -0,0 +1,309 @@
+"""
+Inverted index ของทุก rootfs ที่ extract แล้ว (SQLite FTS5): path, soname / NEEDED ของ ELF, version string
+และ token ของไฟล์ข้อความ -> ค้นทั้ง corpus ได้ในระดับ ms แทนการ grep ทีละ workspace
+
+  python search_index.py index workspaces/*/rootfs workspaces/*/*/rootfs
+  python search_index.py query busybox --kind version          # "BusyBox v1.24.1" ทุก tree
+  python search_index.py query libssl.so --kind needed         # binary ที่ link กับ libssl
+  python search_index.py query dropbear --kind path            # path ที่มี "dropbear" (substring)
+  python search_index.py query telnetd                          # ทุกชนิด
+  python search_index.py prune                                  # ลบ tree ที่ถูกลบไปแล้ว
+
+- index ตาม content digest (sha256 จาก rootfs manifest -> ไฟล์ที่ไม่เปลี่ยนไม่ถูก hash ซ้ำ):
+  เนื้อหาที่ index แล้ว (ใน tree ใดก็ตาม) ไม่ถูกอ่านอีก เพิ่มแค่แถว path
+- path ใช้ trigram (ค้น substring ได้, อย่างน้อย 3 ตัวอักษร); content ใช้ token + prefix
+  ("dropbear" เจอ "dropbear_2019.78", version เก็บทั้งข้อความและตัวเลข "2019.78")
+- GUI index rootfs อัตโนมัติหลัง Extract, fw_batch เมื่อใช้ --keep (search.path ใน config.yaml)
+"""
+
+import os, re, sys, json, stat, time, struct, sqlite3, argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from rootfs_manifest import update_manifest, SIZE, MODE, DIGEST
+from proc_pool import pool_context
+
+MAX_READ = 16 * 1048576       # bytes read per file for versions / ELF
+MAX_TEXT = 1048576            # text files: tokens from the first MB
+MAX_TOKENS = 4096             # unique tokens kept per text file
+MAX_VERSIONS = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents(
+    id INTEGER PRIMARY KEY, digest TEXT UNIQUE, kind TEXT, size INTEGER, indexed REAL);
+CREATE TABLE IF NOT EXISTS paths(
+    id INTEGER PRIMARY KEY, tree TEXT NOT NULL, rel TEXT NOT NULL, digest TEXT, UNIQUE(tree, rel));
+CREATE INDEX IF NOT EXISTS paths_digest ON paths(digest);
+CREATE VIRTUAL TABLE IF NOT EXISTS path_fts USING fts5(rel, content='paths', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS paths_ai AFTER INSERT ON paths BEGIN
+    INSERT INTO path_fts(rowid, rel) VALUES (new.id, new.rel); END;
+CREATE TRIGGER IF NOT EXISTS paths_ad AFTER DELETE ON paths BEGIN
+    INSERT INTO path_fts(path_fts, rowid, rel) VALUES ('delete', old.id, old.rel); END;
+CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(soname, needed, versions, tokens,
+    tokenize="unicode61 tokenchars '._-+'");
+"""
+
+KINDS = ("any", "path", "soname", "needed", "version", "token")
+_COLUMNS = {"soname": "soname", "needed": "needed", "version": "versions", "token": "tokens"}
+
+_VERSION = re.compile(rb"[A-Za-z][A-Za-z0-9+_-]{1,31}[ _/-]v?(\d+\.\d+(?:\.\d+){0,3}[a-z]?)")
+_TOKEN = re.compile(rb"[A-Za-z_][A-Za-z0-9_.+-]{2,63}")
+
+# -------------------------------------------------
+# Term extraction (runs in worker processes)
+# -------------------------------------------------
+def elf_dynamic(data):
+    """(soname, [needed]) from the PT_DYNAMIC segment of an ELF image; (None, []) if static / not ELF."""
+    if data[:4] != b"\x7fELF":
+        return None, []
+    try:
+        e = "<" if data[5] == 1 else ">"
+        if data[4] == 2:
+            phoff, = struct.unpack_from(e + "Q", data, 32)
+            phentsize, phnum = struct.unpack_from(e + "HH", data, 54)
+            ph = lambda off: struct.unpack_from(e + "IIQQQQ", data, off)     # type, flags, offset, vaddr, paddr, filesz
+            dyn, dyn_size = e + "qQ", 16
+        else:
+            phoff, = struct.unpack_from(e + "I", data, 28)
+            phentsize, phnum = struct.unpack_from(e + "HH", data, 42)
+            def ph(off):
+                p_type, p_off, vaddr, paddr, filesz = struct.unpack_from(e + "IIIII", data, off)
+                return p_type, 0, p_off, vaddr, paddr, filesz
+            dyn, dyn_size = e + "iI", 8
+        loads, dynamic = [], None
+        for i in range(phnum):
+            p_type, _, p_off, vaddr, _, filesz = ph(phoff + i * phentsize)
+            if p_type == 1:
+                loads.append((vaddr, p_off, filesz))
+            elif p_type == 2:
+                dynamic = (p_off, filesz)
+        if dynamic is None:
+            return None, []
+        entries = []
+        for off in range(dynamic[0], dynamic[0] + dynamic[1] - dyn_size + 1, dyn_size):
+            tag, val = struct.unpack_from(dyn, data, off)
+            if tag == 0:
+                break
+            entries.append((tag, val))
+        strtab = next((v for t, v in entries if t == 5), None)
+        base = next((p_off + strtab - vaddr for vaddr, p_off, filesz in loads
+                     if strtab is not None and vaddr <= strtab < vaddr + filesz), None)
+        if base is None:
+            return None, []
+        def string(off):
+            end = data.index(b"\0", base + off)
+            return data[base + off:end].decode("utf-8", "replace")
+        soname = next((string(v) for t, v in entries if t == 14), None)
+        return soname, [string(v) for t, v in entries if t == 1]
+    except (struct.error, IndexError, ValueError):
+        return None, []
+
+def extract_terms(path):
+    """(kind, soname, needed, versions, tokens) of one file, or None when unreadable."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read(MAX_READ)
+    except OSError:
+        return None
+    if data.startswith(b"\x7fELF"):
+        kind = "elf"
+    elif b"\0" not in data[:512]:
+        kind = "text"
+    else:
+        kind = "binary"
+    soname, needed = elf_dynamic(data) if kind == "elf" else (None, [])
+    versions = {}
+    for m in _VERSION.finditer(data):
+        versions[m.group(0).decode("ascii", "replace")] = None
+        versions[m.group(1).decode("ascii")] = None
+        if len(versions) >= MAX_VERSIONS:
+            break
+    tokens = []
+    if kind == "text":
+        tokens = list(dict.fromkeys(t.decode("ascii") for t in _TOKEN.findall(data[:MAX_TEXT])))[:MAX_TOKENS]
+    return kind, soname, needed, list(versions), tokens
+
+def _fts_query(term, prefix=True):
+    q = '"' + term.replace('"', '""') + '"'
+    return q + "*" if prefix else q
+
+# -------------------------------------------------
+# Index
+# -------------------------------------------------
+class SearchIndex:
+    def __init__(self, db_path):
+        d = os.path.dirname(db_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def index_tree(self, tree_dir, workers=None, log_callback=None):
+        """
+        (Re-)index one rootfs tree. Paths are synced to the tree's manifest; only contents whose
+        digest is not in the index yet are read. Returns {files, new_contents, seconds}.
+        """
+        t0 = time.perf_counter()
+        tree = os.path.abspath(tree_dir)
+        files = update_manifest(tree, workers=workers)
+        current = {rel: e[DIGEST] for rel, e in files.items()}
+        old = dict(self.conn.execute("SELECT rel, digest FROM paths WHERE tree=?", (tree,)))
+        gone = [(tree, rel) for rel, digest in old.items() if current.get(rel) != digest]
+        added = [(tree, rel, digest) for rel, digest in current.items() if old.get(rel) != digest]
+
+        todo = {}
+        for rel, e in files.items():
+            digest = e[DIGEST]
+            if stat.S_ISREG(e[MODE]) and digest and digest not in todo and old.get(rel) != digest:
+                todo[digest] = rel
+        if todo:
+            have = set()
+            digests = list(todo)
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                have.update(r[0] for r in self.conn.execute(
+                    f"SELECT digest FROM contents WHERE digest IN ({','.join('?' * len(chunk))})", chunk))
+            for digest in have:
+                del todo[digest]
+        paths = [os.path.join(tree, rel) for rel in todo.values()]
+        workers = max(1, workers or os.cpu_count() or 1)
+        if workers > 1 and len(paths) > 64:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as ex:
+                terms = list(ex.map(extract_terms, paths, chunksize=32))
+        else:
+            terms = [extract_terms(p) for p in paths]
+
+        now = time.time()
+        # todo / old were read outside this transaction: another indexer (fw_batch -j N on images sharing
+        # busybox / libc) may have added the same contents or paths since, so both writes are idempotent
+        new = 0
+        with self.conn:
+            self.conn.executemany("DELETE FROM paths WHERE tree=? AND rel=?",
+                                  gone + [(t, rel) for t, rel, _ in added])
+            self.conn.executemany("INSERT INTO paths(tree, rel, digest) VALUES (?,?,?)", added)
+            for (digest, rel), t in zip(todo.items(), terms):
+                if t is None:
+                    continue
+                kind, soname, needed, versions, tokens = t
+                cur = self.conn.execute("INSERT OR IGNORE INTO contents(digest, kind, size, indexed) VALUES (?,?,?,?)",
+                                        (digest, kind, files[rel][SIZE], now))
+                if not cur.rowcount:
+                    continue
+                new += 1
+                self.conn.execute("INSERT INTO terms(rowid, soname, needed, versions, tokens) VALUES (?,?,?,?,?)",
+                                  (cur.lastrowid, soname or "", " ".join(needed), "\n".join(versions),
+                                   " ".join(tokens)))
+        res = {"files": len(files), "new_contents": new, "seconds": round(time.perf_counter() - t0, 3)}
+        if log_callback:
+            log_callback(f"[SEARCH] {tree}: {res['files']} files, เนื้อหาใหม่ {res['new_contents']} "
+                         f"({res['seconds']}s)")
+        return res
+
+    def forget(self, tree_dir):
+        with self.conn:
+            self.conn.execute("DELETE FROM paths WHERE tree=?", (os.path.abspath(tree_dir),))
+
+    def prune(self):
+        """Forget trees that no longer exist and drop contents no path refers to. Returns (trees, contents)."""
+        trees = [t for (t,) in self.conn.execute("SELECT DISTINCT tree FROM paths") if not os.path.isdir(t)]
+        for t in trees:
+            self.forget(t)
+        with self.conn:
+            ids = [r[0] for r in self.conn.execute(
+                "SELECT id FROM contents WHERE digest NOT IN (SELECT digest FROM paths WHERE digest IS NOT NULL)")]
+            self.conn.executemany("DELETE FROM terms WHERE rowid=?", [(i,) for i in ids])
+            self.conn.executemany("DELETE FROM contents WHERE id=?", [(i,) for i in ids])
+        return len(trees), len(ids)
+
+    def search(self, term, kind="any", limit=200):
+        """
+        [{tree, rel, kind, match}] for paths containing term (kind path) or files whose soname /
+        NEEDED / version strings / text tokens start with term. match = the matching value(s).
+        """
+        if kind not in KINDS:
+            raise ValueError(f"unknown kind {kind!r} (use one of {', '.join(KINDS)})")
+        out = []
+        if kind in ("any", "path") and len(term) >= 3:
+            for tree, rel in self.conn.execute(
+                    "SELECT p.tree, p.rel FROM path_fts JOIN paths p ON p.id = path_fts.rowid "
+                    "WHERE path_fts MATCH ? LIMIT ?", (_fts_query(term, prefix=False), limit)):
+                out.append({"tree": tree, "rel": rel, "kind": "path", "match": rel})
+        if kind != "path":
+            col = _COLUMNS.get(kind)
+            q = f"{col} : {_fts_query(term)}" if col else _fts_query(term)
+            low = term.lower()
+            rows = self.conn.execute(
+                "SELECT p.tree, p.rel, t.soname, t.needed, t.versions FROM terms t "
+                "JOIN contents c ON c.id = t.rowid JOIN paths p ON p.digest = c.digest "
+                "WHERE terms MATCH ? ORDER BY p.tree, p.rel LIMIT ?", (q, limit))
+            for tree, rel, soname, needed, versions in rows:
+                hits = [v for v in [soname] + needed.split() + versions.split("\n") if v and low in v.lower()]
+                out.append({"tree": tree, "rel": rel, "kind": kind if col else "content",
+                            "match": ", ".join(hits[:5]) if hits else term})
+        return out[:limit]
+
+    def stats(self):
+        return {"trees": self.conn.execute("SELECT COUNT(DISTINCT tree) FROM paths").fetchone()[0],
+                "paths": self.conn.execute("SELECT COUNT(*) FROM paths").fetchone()[0],
+                "contents": self.conn.execute("SELECT COUNT(*) FROM contents").fetchone()[0]}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Path / content search across extracted rootfs trees")
+    ap.add_argument("--db", default=None, help="index database (default: config.yaml search.path)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ix = sub.add_parser("index", help="index (or refresh) rootfs trees")
+    ix.add_argument("trees", nargs="+")
+    ix.add_argument("-j", "--workers", type=int, default=None)
+    q = sub.add_parser("query")
+    q.add_argument("term")
+    q.add_argument("--kind", choices=KINDS, default="any")
+    q.add_argument("--limit", type=int, default=200)
+    q.add_argument("--json", action="store_true")
+    sub.add_parser("prune", help="forget deleted trees and unreferenced contents")
+    sub.add_parser("stats")
+    a = ap.parse_args(argv)
+
+    db = a.db
+    if db is None:
+        from fw_batch import load_config
+        db = load_config().get("search", {}).get("path") or os.path.join("workspaces", ".search_index.sqlite")
+    log = lambda msg: print(msg, file=sys.stderr)
+    with SearchIndex(db) as idx:
+        if a.cmd == "index":
+            for tree in a.trees:
+                if os.path.isdir(tree):
+                    idx.index_tree(tree, a.workers, log)
+                else:
+                    log(f"[SEARCH] ข้าม {tree}: ไม่ใช่ directory")
+            return 0
+        if a.cmd == "query":
+            t0 = time.perf_counter()
+            hits = idx.search(a.term, a.kind, a.limit)
+            for h in hits:
+                print(json.dumps(h, ensure_ascii=False) if a.json else
+                      f"{h['tree']}/{h['rel']}\t{h['kind']}\t{h['match']}")
+            log(f"[SEARCH] {len(hits)} hits in {(time.perf_counter() - t0) * 1000:.1f} ms")
+            return 0 if hits else 1
+        if a.cmd == "prune":
+            trees, contents = idx.prune()
+            log(f"[SEARCH] ลบ {trees} tree, {contents} contents")
+            return 0
+        print(json.dumps(idx.stats()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
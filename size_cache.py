@@ -0,0 +1,74 @@
+"""
+Persistent compressed-size cache for SquashFS size prediction.
+
+เก็บขนาด compressed block ของแต่ละไฟล์ (key = sha256 ของเนื้อไฟล์ + block size + codec + level)
+และขนาด fragment block (key = sha256 ของเนื้อ fragment block) ลง SQLite
+เพื่อให้การ Predict ครั้งถัดไปบีบอัดเฉพาะไฟล์ที่เปลี่ยนจริง
+
+digest ของไฟล์มาจาก hashing.default_service() (memo ตาม dev, inode, size, mtime_ns, ctime_ns) จึงไม่ hash ไฟล์ที่ไม่เปลี่ยน
+
+ใช้ร่วมกับ SquashFSBuilder(cache=...) / fmk_integration.estimate_squashfs_breakdown()
+"""
+
+import os, json, sqlite3
+
+from hashing import file_digest
+
+class SizeCache:
+    def __init__(self, db_path):
+        d = os.path.dirname(db_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS file_blocks(
+                digest TEXT, block_size INTEGER, codec TEXT, level INTEGER, words TEXT,
+                PRIMARY KEY(digest, block_size, codec, level));
+            CREATE TABLE IF NOT EXISTS fragment_block(
+                digest TEXT, block_size INTEGER, codec TEXT, level INTEGER, word INTEGER,
+                PRIMARY KEY(digest, block_size, codec, level));
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    # ---------- digests ----------
+    @staticmethod
+    def digest(path, st=None):
+        return file_digest(path, st=st)
+
+    # ---------- block sizes ----------
+    @staticmethod
+    def _profile(profile):
+        block_size, codec, level = profile
+        return block_size, codec, -1 if level is None else level
+
+    def get_blocks(self, digest, profile):
+        row = self.conn.execute(
+            "SELECT words FROM file_blocks WHERE digest=? AND block_size=? AND codec=? AND level=?",
+            (digest,) + self._profile(profile)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_blocks(self, digest, profile, words):
+        self.conn.execute("INSERT OR REPLACE INTO file_blocks VALUES (?,?,?,?,?)",
+                          (digest,) + self._profile(profile) + (json.dumps(list(words)),))
+
+    def get_fragment(self, digest, profile):
+        row = self.conn.execute(
+            "SELECT word FROM fragment_block WHERE digest=? AND block_size=? AND codec=? AND level=?",
+            (digest,) + self._profile(profile)).fetchone()
+        return row[0] if row else None
+
+    def put_fragment(self, digest, profile, word):
+        self.conn.execute("INSERT OR REPLACE INTO fragment_block VALUES (?,?,?,?,?)",
+                          (digest,) + self._profile(profile) + (word,))
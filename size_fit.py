@@ -0,0 +1,143 @@
+"""
+Fit optimizer: หา compression / level / block size ที่ทำให้ rootfs ใหม่ลงพื้นที่เดิมได้
+
+  python size_fit.py workspaces/ws_xxx -j 8                 # span จาก logs/config.log
+  python size_fit.py workspaces/ws_xxx/seg_1 --span 3145728 --all
+
+ลองทุก candidate ด้วย SquashFSBuilder แบบ count-only (ไม่เขียนไฟล์) ขนานกันบน process pool
+หนึ่ง candidate ต่อ process; ลำดับจากที่เปลี่ยนน้อยที่สุดก่อน (config เดิม -> level สูงขึ้น ->
+block ใหญ่ขึ้น -> codec อื่น) และหยุดทันทีที่มี candidate ที่ลงได้ – งานที่รันอยู่ถูก kill (xz-9e
+block 1 MB อาจใช้หลายนาที) แล้วรายงานตัวที่เล็กที่สุดที่ลงได้จากที่เสร็จแล้วพร้อม margin (bytes ที่เหลือ)
+
+codec จำกัดตามที่ kernel ของอุปกรณ์น่าจะรองรับ (เดาจาก FS_COMPRESSION ของ image เดิม):
+zlib ถูก build มากับ squashfs เสมอ, codec อื่นเฉพาะตัวที่ image เดิมใช้อยู่
+block size ลองเฉพาะค่าเดิมขึ้นไปถึง 1 MB (block เล็กลงทำให้ image ใหญ่ขึ้นเสมอ)
+"""
+
+import os, sys, json, lzma, time, argparse, threading
+
+from rebuild_squashfs import SquashFSBuilder, SquashFSError, DEFAULT_LEVELS
+from fmk_integration import parse_config, compute_original_rootfs_span
+from proc_pool import pool_context
+
+MAX_BLOCK_SIZE = 1048576
+
+# codecs a kernel built for FS_COMPRESSION=<key> can mount (zlib is always there)
+KERNEL_CODECS = {"gzip": ("gzip",), "xz": ("xz", "gzip"), "lzma": ("lzma", "gzip")}
+
+# levels worth trying per codec, in increasing effort (lower levels only grow the image)
+CODEC_LEVELS = {
+    "gzip": (9,),
+    "xz": (6, 9, 9 | lzma.PRESET_EXTREME),
+    "lzma": (5, 9, 9 | lzma.PRESET_EXTREME),
+}
+
+def level_name(codec, level):
+    if codec != "gzip" and level & lzma.PRESET_EXTREME:
+        return f"{level & ~lzma.PRESET_EXTREME}e"
+    return str(level)
+
+def candidates(meta):
+    """
+    [{compression, level, block_size}] ordered by how far they move from the original
+    image's settings (first = the original). Raises SquashFSError if meta needs mksquashfs.
+    """
+    base = SquashFSBuilder.from_meta("", meta)
+    orig_level = DEFAULT_LEVELS[base.compression] if base.level is None else base.level
+    sizes = []
+    bs = base.block_size
+    while bs <= MAX_BLOCK_SIZE:
+        sizes.append(bs)
+        bs *= 2
+    out = []
+    for codec in KERNEL_CODECS[base.compression]:
+        levels = [l for l in CODEC_LEVELS[codec] if codec != base.compression or l >= orig_level]
+        if codec == base.compression and orig_level not in levels:
+            levels.insert(0, orig_level)
+        for step, bs in enumerate(sizes):
+            for rank, level in enumerate(levels):
+                out.append(((codec != base.compression, step + rank, step),
+                            {"compression": codec, "level": level, "block_size": bs}))
+    out.sort(key=lambda c: c[0])
+    return [c for _, c in out]
+
+def _predict(rootfs_dir, meta, cand):
+    t0 = time.perf_counter()
+    builder = SquashFSBuilder.from_meta(rootfs_dir, meta, workers=1, **cand)
+    size = builder.build(None)
+    return dict(cand, size=size, seconds=round(time.perf_counter() - t0, 3))
+
+def find_fit(rootfs_dir, meta, span, workers=None, exhaustive=False, log_callback=None,
+             should_stop=None):
+    """
+    Predict candidates (see candidates()) in parallel until one fits in span bytes.
+    Returns (best, results): best = the smallest fitting result or None; results = every
+    finished candidate as {compression, level, block_size, size, margin, seconds}.
+    exhaustive=True predicts all candidates instead of stopping at the first fit.
+    The first fit (or should_stop() true) ends the search: candidates still running are killed
+    (multiprocessing Pool.terminate) and only the finished ones are returned.
+    """
+    todo = candidates(meta)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+    results = []
+    running = []
+    fitted = False
+    wake = threading.Event()
+    pool = pool_context().Pool(workers)
+    try:
+        while todo or running:
+            while todo and len(running) < workers and not (fitted and not exhaustive):
+                running.append(pool.apply_async(_predict, (rootfs_dir, meta, todo.pop(0)),
+                                                callback=lambda _: wake.set(),
+                                                error_callback=lambda _: wake.set()))
+            if not running:
+                break
+            done = [r for r in running if r.ready()]
+            if not done:
+                wake.wait(0.2)
+                wake.clear()
+            for r in done:
+                running.remove(r)
+                res = r.get()
+                res["margin"] = span - res["size"]
+                results.append(res)
+                fitted = fitted or res["margin"] >= 0
+                if log_callback:
+                    log_callback(f"[FIT] {res['compression']}-{level_name(res['compression'], res['level'])} "
+                                 f"block={res['block_size']} -> {res['size']} bytes (margin {res['margin']})")
+            if (fitted and not exhaustive) or (should_stop and should_stop()):
+                break
+    finally:
+        pool.terminate()       # kills whatever is still running; idle workers otherwise
+        pool.join()
+    fits = [r for r in results if r["margin"] >= 0]
+    best = min(fits, key=lambda r: r["size"]) if fits else None
+    return best, results
+
+def build_overrides(result):
+    """SquashFSBuilder.from_meta overrides for a find_fit() result (build_firmware(build_overrides=...))."""
+    return {k: result[k] for k in ("compression", "level", "block_size")}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Find squashfs settings that fit the original rootfs span")
+    ap.add_argument("workspace", help="FMK workspace or multi-squash segment (has rootfs/ and logs/config.log)")
+    ap.add_argument("--span", type=int, default=None, help="bytes available (default: from config.log)")
+    ap.add_argument("-j", "--workers", type=int, default=None)
+    ap.add_argument("--all", action="store_true", help="predict every candidate, do not stop at the first fit")
+    a = ap.parse_args(argv)
+
+    meta, _ = parse_config(os.path.join(a.workspace, "logs", "config.log"))
+    span = a.span if a.span is not None else compute_original_rootfs_span(meta)
+    if span is None:
+        ap.error("cannot compute the original rootfs span (use --span)")
+    log = lambda msg: print(msg, file=sys.stderr)
+    try:
+        best, results = find_fit(os.path.join(a.workspace, "rootfs"), meta, span, a.workers,
+                                 exhaustive=a.all, log_callback=log)
+    except (SquashFSError, OSError) as e:
+        ap.error(str(e))
+    print(json.dumps({"span": span, "fit": best, "results": results}, ensure_ascii=False, indent=1))
+    return 0 if best else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
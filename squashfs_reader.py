@@ -0,0 +1,488 @@
+"""
+Lazy read-only SquashFS (v4) reader
+
+อ่าน squashfs ตรงจาก image (เช่น firmware ทั้งไฟล์ที่ FS_OFFSET) ผ่าน mmap โดยไม่ต้อง unsquashfs:
+- parse superblock / id table / fragment table เมื่อใช้ครั้งแรกเท่านั้น
+- เดิน directory table ตาม path ที่ขอ และอ่าน inode ที่ต้องใช้
+- แตกเฉพาะ data / fragment blocks ของไฟล์ที่อ่าน
+- metadata blocks (inode + directory table) ที่แตกแล้วเก็บใน LRU cache
+
+ใช้ใน analyze_firmware_detailed (อ่าน etc/inittab, etc/passwd ... ภายในไม่กี่ ms ไม่ใช้ disk),
+ตรวจ image ที่ build ใหม่ (verify_tree) และเป็น source สำหรับ diff ได้ (walk / read_file):
+
+  with SquashFSImage("firmware.bin", offset=0x1A0000) as img:
+      img.listdir("etc")
+      img.read_file("etc/passwd")
+      for rel, inode in img.walk(): ...
+
+  python squashfs_reader.py firmware.bin --offset 0x1A0000 ls etc
+  python squashfs_reader.py rootfs.sqsh cat etc/passwd
+
+compression: gzip / xz / lzma ผ่าน stdlib; lzo / lz4 / zstd ใช้ได้เมื่อมี python-lzo / lz4 / zstandard
+"""
+
+import os, stat, struct, mmap, zlib, lzma, posixpath
+from collections import OrderedDict
+from rebuild_squashfs import (SquashFSError, SQUASHFS_MAGIC, SUPERBLOCK_SIZE, METADATA_SIZE,
+                              NO_FRAGMENT, DATA_UNCOMPRESSED, METADATA_UNCOMPRESSED,
+                              DIR_TYPE, FILE_TYPE, SYMLINK_TYPE, BLKDEV_TYPE, CHRDEV_TYPE,
+                              FIFO_TYPE, SOCKET_TYPE, LDIR_TYPE, LREG_TYPE)
+
+COMPRESSION_NAMES = {1: "gzip", 2: "lzma", 3: "lzo", 4: "xz", 5: "lz4", 6: "zstd"}
+
+# basic type (1..7) of every inode type (extended = basic + 7)
+_IFMT = {DIR_TYPE: stat.S_IFDIR, FILE_TYPE: stat.S_IFREG, SYMLINK_TYPE: stat.S_IFLNK,
+         BLKDEV_TYPE: stat.S_IFBLK, CHRDEV_TYPE: stat.S_IFCHR, FIFO_TYPE: stat.S_IFIFO,
+         SOCKET_TYPE: stat.S_IFSOCK}
+
+MAX_SYMLINK_HOPS = 40
+
+def _decompressor(name, max_size):
+    if name == "gzip":
+        return zlib.decompress
+    if name in ("xz", "lzma"):
+        return lzma.decompress
+    try:
+        if name == "lz4":
+            import lz4.block
+            return lambda d: lz4.block.decompress(d, uncompressed_size=max_size)
+        if name == "zstd":
+            import zstandard
+            dctx = zstandard.ZstdDecompressor()
+            return lambda d: dctx.decompress(d, max_output_size=max_size)
+        if name == "lzo":
+            import lzo
+            return lambda d: lzo.decompress(d, False, max_size)
+    except ImportError:
+        raise SquashFSError(f"{name} decompression needs an extra module "
+                            f"(pip install {'python-lzo' if name == 'lzo' else 'lz4' if name == 'lz4' else 'zstandard'})")
+    raise SquashFSError(f"Unsupported compression: {name}")
+
+class Inode:
+    __slots__ = ("ref", "type", "mode", "uid", "gid", "mtime", "number", "nlink", "size",
+                 "start_block", "fragment", "frag_offset", "block_sizes", "dir_offset",
+                 "target", "rdev")
+    def __init__(self, ref):
+        self.ref = ref
+        self.fragment = NO_FRAGMENT
+        self.frag_offset = 0
+        self.block_sizes = ()
+        self.start_block = 0
+        self.dir_offset = 0
+        self.target = None
+        self.rdev = 0
+        self.nlink = 1
+        self.size = 0
+
+    @property
+    def basic_type(self):
+        return self.type if self.type <= SOCKET_TYPE else self.type - 7
+
+    @property
+    def st_mode(self):
+        return _IFMT[self.basic_type] | self.mode
+
+    def is_dir(self):
+        return self.basic_type == DIR_TYPE
+
+    def is_file(self):
+        return self.basic_type == FILE_TYPE
+
+    def is_symlink(self):
+        return self.basic_type == SYMLINK_TYPE
+
+    def __repr__(self):
+        return f"<Inode #{self.number} mode={stat.filemode(self.st_mode)} size={self.size}>"
+
+class SquashFSImage:
+    """
+    Read-only view of a SquashFS v4 filesystem stored at `offset` inside `path`.
+    `path` may also be an already open buffer (mmap / bytes), e.g. one mmap of the firmware
+    shared by several readers; the buffer is not closed by close().
+    Paths are relative to the filesystem root ("etc/passwd", "/etc/passwd" and "" are accepted).
+    """
+    def __init__(self, path, offset=0, cache_blocks=256):
+        self.path = path
+        self.offset = offset
+        if isinstance(path, (str, bytes, os.PathLike)):
+            self._f = open(path, "rb")
+            try:
+                self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._f.close()
+                raise SquashFSError("empty image")
+        else:
+            self._f = None
+            self._mm = path
+        try:
+            self._read_superblock()
+        except Exception:
+            self.close()
+            raise
+        self._cache = OrderedDict()
+        self._cache_blocks = cache_blocks
+        self._ids = None
+        self._root = None
+        self.cache_hits = self.cache_misses = 0
+
+    def close(self):
+        if self._f is None:
+            self._mm = None
+            return
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------------- superblock / tables ----------------
+    def _read_superblock(self):
+        mm, off = self._mm, self.offset
+        if off + SUPERBLOCK_SIZE > len(mm):
+            raise SquashFSError("image too small for a squashfs superblock")
+        (magic, self.inode_count, self.mkfs_time, self.block_size, self.fragment_count,
+         comp, self.block_log, self.flags, self.id_count, major, minor, root_ref,
+         self.bytes_used, self.id_table_start, self.xattr_table_start, self.inode_table_start,
+         self.directory_table_start, self.fragment_table_start,
+         self.export_table_start) = struct.unpack_from("<IIIIIHHHHHHQQQQQQQQ", mm, off)
+        if magic != SQUASHFS_MAGIC:
+            if magic == 0x68737173:
+                raise SquashFSError("big-endian squashfs is not supported")
+            raise SquashFSError(f"no squashfs magic at offset 0x{off:X}")
+        if major != 4:
+            raise SquashFSError(f"squashfs {major}.{minor} is not supported (v4 only)")
+        if self.block_size != 1 << self.block_log:
+            raise SquashFSError("corrupt superblock (block_size / block_log mismatch)")
+        if off + self.bytes_used > len(mm):
+            raise SquashFSError(f"image truncated: bytes_used={self.bytes_used}, "
+                                f"available={len(mm) - off}")
+        self.version = (major, minor)
+        self.root_ref = root_ref
+        self.compression = COMPRESSION_NAMES.get(comp, f"id{comp}")
+        self._decompress = _decompressor(self.compression, self.block_size)
+
+    def _metadata_block(self, pos):
+        """(data, next_pos) of the metadata block at image-relative pos, LRU cached."""
+        hit = self._cache.get(pos)
+        if hit is not None:
+            self._cache.move_to_end(pos)
+            self.cache_hits += 1
+            return hit
+        self.cache_misses += 1
+        base = self.offset + pos
+        hdr = struct.unpack_from("<H", self._mm, base)[0]
+        size = hdr & ~METADATA_UNCOMPRESSED & 0xFFFF
+        raw = self._mm[base + 2:base + 2 + size]
+        data = raw if hdr & METADATA_UNCOMPRESSED else self._decompress(raw)
+        if len(data) > METADATA_SIZE:
+            raise SquashFSError(f"corrupt metadata block at 0x{pos:X}")
+        hit = (data, pos + 2 + size)
+        self._cache[pos] = hit
+        if len(self._cache) > self._cache_blocks:
+            self._cache.popitem(last=False)
+        return hit
+
+    def _read_metadata(self, pos, offset, length):
+        """length bytes starting at `offset` inside the metadata block at pos (may span blocks)."""
+        data, nxt = self._metadata_block(pos)
+        while offset >= len(data) and data:
+            offset -= len(data)
+            data, nxt = self._metadata_block(nxt)
+        if offset + length <= len(data):
+            return data[offset:offset + length]
+        parts = [data[offset:]]
+        have = len(data) - offset
+        while have < length:
+            data, nxt = self._metadata_block(nxt)
+            if not data:
+                raise SquashFSError("metadata read past end of table")
+            parts.append(data[:length - have])
+            have += len(parts[-1])
+        return b"".join(parts)
+
+    def _table_entry(self, index_start, entry_size, i):
+        """Entry i of a table stored as metadata blocks behind a u64 index (id / fragment)."""
+        per_block = METADATA_SIZE // entry_size
+        block_pos = struct.unpack_from("<Q", self._mm, self.offset + index_start + 8 * (i // per_block))[0]
+        return self._read_metadata(block_pos, (i % per_block) * entry_size, entry_size)
+
+    def _id(self, idx):
+        if self._ids is None:
+            self._ids = {}
+        if idx not in self._ids:
+            if idx >= self.id_count:
+                raise SquashFSError(f"id index {idx} out of range")
+            self._ids[idx] = struct.unpack("<I", self._table_entry(self.id_table_start, 4, idx))[0]
+        return self._ids[idx]
+
+    def _fragment(self, idx):
+        """(start, size_word) of fragment block idx."""
+        if idx >= self.fragment_count:
+            raise SquashFSError(f"fragment index {idx} out of range")
+        start, size, _ = struct.unpack("<QII", self._table_entry(self.fragment_table_start, 16, idx))
+        return start, size
+
+    # ---------------- inodes / directories ----------------
+    def inode(self, ref):
+        """Parse the inode at inode reference ref = (block << 16) | offset."""
+        block = self.inode_table_start + (ref >> 16)
+        offset = ref & 0xFFFF
+        rd = lambda n, skip=0: self._read_metadata(block, offset + skip, n)
+        ino = Inode(ref)
+        (ino.type, ino.mode, uid_idx, gid_idx, ino.mtime,
+         ino.number) = struct.unpack("<HHHHII", rd(16))
+        ino.uid, ino.gid = self._id(uid_idx), self._id(gid_idx)
+        t = ino.type
+        if t == DIR_TYPE:
+            ino.start_block, ino.nlink, ino.size, ino.dir_offset, _ = struct.unpack("<IIHHI", rd(16, 16))
+        elif t == LDIR_TYPE:
+            (ino.nlink, ino.size, ino.start_block, _, _, ino.dir_offset,
+             _) = struct.unpack("<IIIIHHI", rd(24, 16))
+        elif t in (FILE_TYPE, LREG_TYPE):
+            if t == FILE_TYPE:
+                ino.start_block, ino.fragment, ino.frag_offset, ino.size = struct.unpack("<IIII", rd(16, 16))
+                skip = 32
+            else:
+                (ino.start_block, ino.size, _, ino.nlink, ino.fragment, ino.frag_offset,
+                 _) = struct.unpack("<QQQIIII", rd(40, 16))
+                skip = 56
+            if ino.fragment == NO_FRAGMENT:
+                nblocks = (ino.size + self.block_size - 1) // self.block_size
+            else:
+                nblocks = ino.size // self.block_size
+            if nblocks:
+                ino.block_sizes = struct.unpack(f"<{nblocks}I", rd(4 * nblocks, skip))
+        elif t in (SYMLINK_TYPE, SYMLINK_TYPE + 7):
+            ino.nlink, n = struct.unpack("<II", rd(8, 16))
+            ino.target = rd(n, 24).decode("utf-8", "surrogateescape")
+            ino.size = n
+        elif t in (BLKDEV_TYPE, CHRDEV_TYPE, BLKDEV_TYPE + 7, CHRDEV_TYPE + 7):
+            ino.nlink, ino.rdev = struct.unpack("<II", rd(8, 16))
+        elif t in (FIFO_TYPE, SOCKET_TYPE, FIFO_TYPE + 7, SOCKET_TYPE + 7):
+            ino.nlink = struct.unpack("<I", rd(4, 16))[0]
+        else:
+            raise SquashFSError(f"unknown inode type {t} at ref 0x{ref:X}")
+        return ino
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = self.inode(self.root_ref)
+        return self._root
+
+    def _entries(self, dino):
+        """[(name, inode_ref, basic_type)] of a directory inode."""
+        # directory size counts 3 extra bytes ("." and "..")
+        size = dino.size - 3
+        if size <= 0:
+            return []
+        data = self._read_metadata(self.directory_table_start + dino.start_block, dino.dir_offset, size)
+        out = []
+        pos = 0
+        while pos < size:
+            count, start, _ = struct.unpack_from("<III", data, pos)
+            pos += 12
+            for _ in range(count + 1):
+                offset, _, itype, nlen = struct.unpack_from("<HhHH", data, pos)
+                name = data[pos + 8:pos + 9 + nlen].decode("utf-8", "surrogateescape")
+                pos += 9 + nlen
+                out.append((name, (start << 16) | offset, itype))
+        return out
+
+    def _resolve(self, path, follow=True, hops=0):
+        parts = [p for p in path.split("/") if p and p != "."]
+        cur, stack = self.root, []
+        for i, name in enumerate(parts):
+            if name == "..":
+                cur = stack.pop() if stack else self.root
+                continue
+            if not cur.is_dir():
+                raise NotADirectoryError(path)
+            for n, ref, _ in self._entries(cur):
+                if n == name:
+                    nxt = self.inode(ref)
+                    break
+            else:
+                raise FileNotFoundError(path)
+            last = i == len(parts) - 1
+            if nxt.is_symlink() and (follow or not last):
+                if hops >= MAX_SYMLINK_HOPS:
+                    raise SquashFSError(f"too many symlink levels: {path}")
+                base = "/".join(parts[:i])
+                target = nxt.target if nxt.target.startswith("/") else posixpath.join(base, nxt.target)
+                rest = "/".join(parts[i + 1:])
+                return self._resolve(posixpath.join(target, rest) if rest else target, follow, hops + 1)
+            stack.append(cur)
+            cur = nxt
+        return cur
+
+    # ---------------- public API ----------------
+    def lookup(self, path, follow=True):
+        """Inode for path (symlinks inside the image are followed unless follow=False)."""
+        return self._resolve(path, follow)
+
+    def exists(self, path):
+        try:
+            self._resolve(path)
+            return True
+        except (FileNotFoundError, NotADirectoryError, SquashFSError):
+            return False
+
+    def isfile(self, path):
+        try:
+            return self._resolve(path).is_file()
+        except (FileNotFoundError, NotADirectoryError, SquashFSError):
+            return False
+
+    def listdir(self, path=""):
+        ino = self._resolve(path)
+        if not ino.is_dir():
+            raise NotADirectoryError(path)
+        return [n for n, _, _ in self._entries(ino)]
+
+    def readlink(self, path):
+        ino = self._resolve(path, follow=False)
+        if not ino.is_symlink():
+            raise SquashFSError(f"not a symlink: {path}")
+        return ino.target
+
+    def iter_file(self, ino):
+        """Yield the decompressed content of a regular file inode block by block."""
+        if not ino.is_file():
+            raise SquashFSError(f"not a regular file (inode #{ino.number})")
+        pos = ino.start_block
+        remaining = ino.size
+        for word in ino.block_sizes:
+            n = min(self.block_size, remaining)
+            size = word & ~DATA_UNCOMPRESSED
+            if size == 0:
+                yield bytes(n)  # sparse block
+            else:
+                raw = self._mm[self.offset + pos:self.offset + pos + size]
+                yield raw if word & DATA_UNCOMPRESSED else self._decompress(raw)
+                pos += size
+            remaining -= n
+        if ino.fragment != NO_FRAGMENT and remaining > 0:
+            yield self._fragment_data(ino.fragment)[ino.frag_offset:ino.frag_offset + remaining]
+
+    def raw_blocks(self, ino, count=None):
+        """
+        (size_word, compressed bytes) of the first `count` data blocks of a file, exactly as stored
+        (sparse blocks give (0, b"")). Used to copy unchanged files into a rebuilt image verbatim.
+        """
+        words = ino.block_sizes if count is None else ino.block_sizes[:count]
+        out = []
+        pos = self.offset + ino.start_block
+        for word in words:
+            size = word & ~DATA_UNCOMPRESSED
+            out.append((word, self._mm[pos:pos + size]))
+            pos += size
+        return out
+
+    def raw_fragment(self, idx):
+        """(size_word, compressed bytes) of fragment block idx exactly as stored."""
+        start, word = self._fragment(idx)
+        pos = self.offset + start
+        return word, self._mm[pos:pos + (word & ~DATA_UNCOMPRESSED)]
+
+    def _fragment_data(self, idx):
+        key = ("frag", idx)
+        hit = self._cache.get(key)
+        if hit is not None:
+            self._cache.move_to_end(key)
+            return hit
+        start, word = self._fragment(idx)
+        size = word & ~DATA_UNCOMPRESSED
+        raw = self._mm[self.offset + start:self.offset + start + size]
+        data = raw if word & DATA_UNCOMPRESSED else self._decompress(raw)
+        self._cache[key] = data
+        if len(self._cache) > self._cache_blocks:
+            self._cache.popitem(last=False)
+        return data
+
+    def read_file(self, path, max_size=None):
+        """Content of a regular file; SquashFSError if larger than max_size."""
+        ino = self._resolve(path)
+        if max_size is not None and ino.size > max_size:
+            raise SquashFSError(f"{path}: {ino.size} bytes > max_size {max_size}")
+        return b"".join(self.iter_file(ino))
+
+    def walk(self, path=""):
+        """Yield (rel_path, inode) for every entry below path (depth-first, no symlink following)."""
+        top = self._resolve(path)
+        stack = [(path.strip("/"), top)]
+        while stack:
+            rel, dino = stack.pop()
+            for name, ref, itype in self._entries(dino):
+                child_rel = f"{rel}/{name}" if rel else name
+                ino = self.inode(ref)
+                yield child_rel, ino
+                if itype == DIR_TYPE:
+                    stack.append((child_rel, ino))
+
+    def verify_tree(self, root_dir, content=False):
+        """
+        Compare the image against the directory it was built from: same names, file types,
+        file sizes, symlink targets and permission bits (content=True also compares file data).
+        Returns a list of problem strings (empty = match).
+        """
+        problems = []
+        seen = set()
+        for rel, ino in self.walk():
+            seen.add(rel)
+            p = os.path.join(root_dir, rel)
+            try:
+                st = os.lstat(p)
+            except OSError:
+                problems.append(f"only in image: {rel}")
+                continue
+            if stat.S_IFMT(st.st_mode) != stat.S_IFMT(ino.st_mode):
+                problems.append(f"type differs: {rel}")
+            elif stat.S_IMODE(st.st_mode) != ino.mode:
+                problems.append(f"mode differs: {rel} ({oct(stat.S_IMODE(st.st_mode))} vs {oct(ino.mode)})")
+            elif ino.is_file():
+                if st.st_size != ino.size:
+                    problems.append(f"size differs: {rel} ({st.st_size} vs {ino.size})")
+                elif content:
+                    with open(p, "rb") as f:
+                        for chunk in self.iter_file(ino):
+                            if f.read(len(chunk)) != chunk:
+                                problems.append(f"content differs: {rel}")
+                                break
+            elif ino.is_symlink() and os.readlink(p) != ino.target:
+                problems.append(f"symlink target differs: {rel}")
+        for dirpath, dnames, fnames in os.walk(root_dir):
+            for n in dnames + fnames:
+                rel = os.path.relpath(os.path.join(dirpath, n), root_dir)
+                if rel not in seen:
+                    problems.append(f"missing from image: {rel}")
+        return problems
+
+if __name__ == "__main__":
+    import argparse, sys
+    ap = argparse.ArgumentParser(description="Read files from a SquashFS v4 image without unsquashfs")
+    ap.add_argument("image")
+    ap.add_argument("--offset", type=lambda v: int(v, 0), default=0)
+    ap.add_argument("cmd", choices=("info", "ls", "cat", "find"))
+    ap.add_argument("path", nargs="?", default="")
+    a = ap.parse_args()
+    with SquashFSImage(a.image, a.offset) as img:
+        if a.cmd == "info":
+            print(f"squashfs {img.version[0]}.{img.version[1]} {img.compression} block={img.block_size} "
+                  f"inodes={img.inode_count} bytes_used={img.bytes_used}")
+        elif a.cmd == "ls":
+            for name in img.listdir(a.path):
+                ino = img.lookup(posixpath.join(a.path, name), follow=False)
+                print(f"{stat.filemode(ino.st_mode)} {ino.uid:>5}/{ino.gid:<5} {ino.size:>10} {name}"
+                      + (f" -> {ino.target}" if ino.is_symlink() else ""))
+        elif a.cmd == "cat":
+            for chunk in img.iter_file(img.lookup(a.path)):
+                sys.stdout.buffer.write(chunk)
+        else:
+            for rel, ino in img.walk(a.path):
+                print(rel)
@@ -0,0 +1,163 @@
+"""
+Span tracing -> Chrome trace-event JSON (เปิดใน chrome://tracing หรือ ui.perfetto.dev)
+
+  tracing.enable()                                      # trace.enabled ใน config.yaml / fw_batch --trace
+  with tracing.span("copy_output", cat="build", target=path):
+      ...
+  @tracing.traced("fmk")
+  def build_firmware(...): ...
+  tracing.export("workspaces/ws_a/logs/trace.json", since=mark)
+
+ต่อ span เก็บ wall time, CPU time ของ thread, bytes ที่อ่าน / เขียน (/proc/self/io rchar / wchar: นับทั้ง process
+รวม child ที่ reap แล้ว) และ resource usage ของ child process (run_cmd ใช้ os.wait4: utime / stime / maxrss / block I/O)
+span ใน worker process (AI ALL) ถูกส่งกลับมาพร้อมผลแล้วรวมด้วย add_events() – pid แยก lane ใน viewer
+
+ปิดอยู่ (ค่าเริ่มต้น): span() คืน object ว่างตัวเดียวกัน และ @traced เรียกฟังก์ชันตรง (เช็ค flag ครั้งเดียว)
+"""
+
+import os, json, time, threading, functools
+
+MAX_EVENTS = 200000          # หยุดเก็บเมื่อเกิน (นับใน dropped) – กัน memory โตไม่จำกัดเมื่อเปิด GUI ทั้งวัน
+
+_enabled = False
+_events = []
+_threads = {}                # (pid, tid) -> thread name
+_lock = threading.Lock()
+dropped = 0
+
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+def enabled():
+    return _enabled
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+def _io():
+    try:
+        with open("/proc/self/io", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    out = {}
+    for line in data.splitlines():
+        k, _, v = line.partition(b":")
+        if k in (b"rchar", b"wchar"):
+            out[k] = int(v)
+    return out
+
+def _record(event):
+    global dropped
+    key = (event["pid"], event["tid"])
+    with _lock:
+        if len(_events) >= MAX_EVENTS:
+            dropped += 1
+            return
+        _events.append(event)
+        if key not in _threads:
+            _threads[key] = threading.current_thread().name
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "t0", "cpu0", "io0")
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.io0 = _io()
+        self.cpu0 = time.thread_time_ns()
+        self.t0 = time.monotonic_ns()      # system-wide clock: spans from worker processes line up
+        return self
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.monotonic_ns()
+        args = self.args
+        args["cpu_ms"] = round((time.thread_time_ns() - self.cpu0) / 1e6, 3)
+        io1 = _io()
+        if self.io0 and io1:
+            args["read_bytes"] = io1[b"rchar"] - self.io0[b"rchar"]
+            args["written_bytes"] = io1[b"wchar"] - self.io0[b"wchar"]
+        if exc_type is not None:
+            args["error"] = f"{exc_type.__name__}: {exc}"
+        _record({"name": self.name, "cat": self.cat, "ph": "X", "ts": self.t0 / 1000,
+                 "dur": (t1 - self.t0) / 1000, "pid": os.getpid(), "tid": threading.get_native_id(),
+                 "args": args})
+        return False
+
+def span(name, cat="app", **args):
+    """Context manager timing a phase; .set(**args) adds values known only at the end."""
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name, cat, args)
+
+def traced(cat="app", name=None):
+    """Decorator: the whole call is one span named after the function."""
+    def deco(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(label, cat, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def rusage_args(ru):
+    """Span args of a child's os.wait4() resource usage."""
+    return {"child_user_s": round(ru.ru_utime, 4), "child_sys_s": round(ru.ru_stime, 4),
+            "child_maxrss_kb": ru.ru_maxrss, "child_inblock": ru.ru_inblock, "child_oublock": ru.ru_oublock}
+
+def mark():
+    """Position in the event buffer, for export(since=...)."""
+    return len(_events)
+
+def drain():
+    """Take every recorded event (worker processes send them back to the parent)."""
+    with _lock:
+        events = list(_events)
+        _events.clear()
+        names = dict(_threads)
+    return {"events": events, "threads": names}
+
+def add_events(batch):
+    """Merge drain() output of another process."""
+    if not batch:
+        return
+    with _lock:
+        room = MAX_EVENTS - len(_events)
+        _events.extend(batch["events"][:max(0, room)])
+        _threads.update(batch["threads"])
+
+def export(path, since=0):
+    """Write events recorded after mark() == since as Chrome trace-event JSON. Returns the event count."""
+    with _lock:
+        events = _events[since:]
+        names = dict(_threads)
+    meta = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for (pid, tid), name in names.items()]
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms",
+                   "otherData": {"dropped": dropped}}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return len(events)